@@ -0,0 +1,144 @@
+from __future__ import annotations
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Pesi del costo giocatore × partita (un'unità = una squadra già avuta una volta)
+PESO_SQUADRA = float(os.getenv("ASSIGN_PESO_SQUADRA", "1"))
+PESO_PARTITA = float(os.getenv("ASSIGN_PESO_PARTITA", "3"))        # stessa identica partita già avuta
+PESO_DIFFICOLTA = float(os.getenv("ASSIGN_PESO_DIFFICOLTA", "4"))  # riequilibrio delle partite difficili
+# Rumore casuale aggiunto ai costi: sceglie a caso tra le soluzioni quasi ottime
+RUMORE = float(os.getenv("ASSIGN_RUMORE", "0.5"))
+
+
+def _teams(fixture: str) -> Tuple[str, str]:
+    home, _, away = fixture.partition("-")
+    return home.strip().lower(), away.strip().lower()
+
+
+def linear_assignment(cost: np.ndarray) -> np.ndarray:
+    """
+    Assegnamento di costo minimo (algoritmo ungherese con cammini minimi, O(n²·m)).
+    cost: matrice n × m con n <= m. Ritorna per ogni riga l'indice della colonna assegnata.
+    Il ciclo interno sulle colonne è vettorizzato.
+    """
+    n, m = cost.shape
+    if n > m:
+        raise ValueError("Servono almeno tante colonne quante righe")
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)    # p[j] = riga (1-based) assegnata alla colonna j
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            cand = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(cand)) + 1
+            delta = cand[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    rows = np.empty(n, dtype=np.int64)
+    cols = np.nonzero(p[1:])[0]
+    rows[p[1:][cols] - 1] = cols
+    return rows
+
+
+def storico_assegnazioni(data: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Giocatore -> partite avute nelle giornate già estratte (in ordine)."""
+    out: Dict[str, List[str]] = {}
+    bets = data.get("bets", {})
+    for g_key in sorted(bets, key=int):
+        for player, fixture in bets[g_key].assignments.items():
+            out.setdefault(player, []).append(fixture)
+    return out
+
+
+def difficolta_squadre(data: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Difficoltà di ogni squadra (minuscolo) = quota di giocate perse sulle sue partite,
+    con lisciatura di Laplace (una squadra mai vista vale 0.5).
+    """
+    username_to_name = data.get("roster", {})
+    name_to_username = {v: k for k, v in username_to_name.items()}
+    perse: Dict[str, int] = {}
+    totali: Dict[str, int] = {}
+    for giornata in data.get("bets", {}).values():
+        bets = giornata.bets
+        for player, fixture in giornata.assignments.items():
+            bet = bets.get(name_to_username.get(player, ""))
+            esito = bet.esito if bet is not None else None
+            if esito is None:
+                continue
+            for team in _teams(fixture):
+                totali[team] = totali.get(team, 0) + 1
+                perse[team] = perse.get(team, 0) + (esito == "persa")
+    return {t: (perse[t] + 1) / (totali[t] + 2) for t in totali}
+
+
+def matrice_costi(players: Sequence[str], matches: Sequence[str],
+                  storico: Dict[str, List[str]], difficolta: Dict[str, float]) -> np.ndarray:
+    """
+    Costo giocatore × partita:
+    - PESO_SQUADRA per ogni volta che il giocatore ha già avuto una delle due squadre;
+    - PESO_PARTITA per ogni volta che ha già avuto la stessa partita;
+    - PESO_DIFFICOLTA × (difficoltà media avuta finora − media del gruppo) × difficoltà della partita:
+      chi ha avuto partite difficili riceve più facilmente quelle facili, e viceversa.
+    """
+    teams = sorted({t for f in matches for t in _teams(f)} |
+                   {t for p in players for f in storico.get(p, []) for t in _teams(f)})
+    idx = {t: i for i, t in enumerate(teams)}
+    # conteggio squadre per giocatore (P × T) e incidenza squadre per partita (F × T)
+    avute = np.zeros((len(players), len(teams)))
+    for r, p in enumerate(players):
+        for f in storico.get(p, []):
+            for t in _teams(f):
+                avute[r, idx[t]] += 1
+    incidenza = np.zeros((len(matches), len(teams)))
+    for c, f in enumerate(matches):
+        for t in _teams(f):
+            incidenza[c, idx[t]] = 1
+    stesse = np.array([[storico.get(p, []).count(f) for f in matches] for p in players], dtype=float)
+
+    diff_team = np.array([difficolta.get(t, 0.5) for t in teams])
+    diff_partita = incidenza @ diff_team / 2
+    # difficoltà media delle partite avute finora, rispetto alla media del gruppo
+    n_giornate = avute.sum(axis=1) / 2
+    has = n_giornate > 0
+    carico = np.zeros(len(players))
+    if has.any():
+        media = (avute[has] @ diff_team) / 2 / n_giornate[has]
+        carico[has] = media - media.mean()
+
+    return (PESO_SQUADRA * (avute @ incidenza.T)
+            + PESO_PARTITA * stesse
+            + PESO_DIFFICOLTA * np.outer(carico, diff_partita))
+
+
+def assegna(players: Sequence[str], matches: Sequence[str], data: Dict[str, Any],
+            rng: Optional[np.random.Generator] = None, rumore: float = RUMORE) -> Dict[str, str]:
+    """Giocatore -> partita, ottima (a meno del rumore) rispetto a matrice_costi."""
+    rng = rng if rng is not None else np.random.default_rng()
+    cost = matrice_costi(players, matches, storico_assegnazioni(data), difficolta_squadre(data))
+    if rumore:
+        cost = cost + rng.uniform(0, rumore, size=cost.shape)
+    cols = linear_assignment(cost)
+    return {p: matches[c] for p, c in zip(players, cols)}
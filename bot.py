@@ -1,87 +1,373 @@
-import os, re, json
-from typing import List, Dict
+import asyncio, copy, functools, os, re, json, sys, time
+_AVVIO_T0 = time.perf_counter()  # prima degli import pesanti: vedi AVVIO
+from typing import List, Dict, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler
+from telegram.request import HTTPXRequest
 
+from chat_locks import chat_key, per_chat
+from export import FORMATI, nome_file, spool
 from game_utils import (
-    load_data, save_data,
+    SHARDS, SHARDS_DIR, WORKER, avviso_legacy, get_store, group_chat_ids, persistence_store, roster, admins,
     estrai_partite, inizio_giornata, fine_giornata,
-    applica_esiti_manuali
+    applica_esiti_manuali, applica_lotto, verifica_aggregati, schedule_for, schedule_path_for, SCHEDULES
 )
+from inbox import Inbox, InboxApplication, InboxQueue
+from kickoff import KickoffScheduler
+from markets import canonical, parse_giocata, regola_giornata, to_dati
+from metrics import METRICS, METRICS_PATH, StartupTimer, serve_metrics, tornado_handler
+from ledger import ETICHETTE
+from outbox import MAX_MSG_LEN, OUTBOX_GLOBAL_PER_SEC, Outbox, mention_batches
+from persistence import StorePersistence
+from results import ResultsIngester, default_source
+from state_store import CURRENT_UPDATE, BaseStore
+from summary import SummaryScheduler
+from workers import WORKER_ID, WORKERS, supervisiona
 
 # ====== CONFIG ======
 TOKEN = os.getenv("BOT_TOKEN", "REPLACE_ME_TOKEN")  # set in Railway as BOT_TOKEN
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")              # es: https://<app>.up.railway.app
+# Server della Bot API alternativo (es. tools/fake_bot_api.py per test e benchmark offline)
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL")    # es: http://127.0.0.1:8081
+# Update gestiti in parallelo (chat diverse); la stessa chat resta serializzata da per_chat
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+# In polling /metrics non ha un server web: se impostata, lo serve su questa porta
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Inbox durevole degli update (rigiocati all'avvio se il bot si è fermato a metà), uno per worker
+INBOX_PATH = os.getenv("INBOX_PATH", os.path.join(SHARDS_DIR, f"inbox-{WORKER_ID}.jsonl" if WORKER_ID else "inbox.jsonl"))
+# Secondi concessi allo shutdown per spedire i messaggi ancora in coda (solleciti)
+OUTBOX_DRAIN_TIMEOUT = float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "10"))
 MIN_QUOTA = 1.50
 TOT_JOLLY = 3
 JOLLY_PENALTY_EUR = 20
 
-# Admin che può usare /estrai /inizio_giornata /fine_giornata /esiti /versa
-ADMINS = {"@BTC_TonyStark"}
+# Rosa (username -> Nome) e admin sono per gruppo: vedi /registra, /admin e game_utils.roster
 
-# Mappa username -> Nome giocatore
-USERNAME_TO_NAME: Dict[str, str] = {
-    "@Federico_Lolli": "Effe",
-    "@Federico9499": "Fruca",
-    "@agggg21": "Gargiu",
-    "@BTC_TonyStark": "Gabbo",
-    "@TheBu7cher": "Pavi",
-    "@Chris4rda": "Chri",
-    "@JoLaFlame": "Gio"
-}
-NAME_TO_USERNAME = {v: k for k, v in USERNAME_TO_NAME.items()}
+# Fasi dell'avvio (import, app, init, primo update), stampate quando il bot è pronto e al primo update.
+# Gli import pesanti (numpy) sono rimandati al primo uso: vedi proiezione_cmd, game_utils.estrai_partite
+AVVIO = StartupTimer(_AVVIO_T0)
+METRICS.add_gauge("bot_startup_seconds", "Secondi dall'inizio dell'avvio a bot pronto.", lambda: AVVIO.fasi["init"])
+METRICS.add_gauge("bot_first_update_seconds", "Secondi dall'inizio dell'avvio al primo update gestito.",
+                  lambda: AVVIO.fasi["primo update"])
+# Task dell'avvio che girano in sottofondo per non ritardare il primo update (vedi _post_init)
+_SOTTOFONDO: List[asyncio.Task] = []
 
 
 # ====== HELPERS ======
-def is_admin(username: str) -> bool:
-    return username in ADMINS
+def _store(update: Update) -> BaseStore:
+    return get_store(update.effective_chat.id)
 
 
-async def pin_or_edit_summary(update: Update, context: ContextTypes.DEFAULT_TYPE, g_key: str) -> None:
-    """Crea/aggiorna e mette in pin il messaggio riassuntivo delle giocate della giornata."""
-    data = load_data()
-    giornata = data["bets"][g_key]
-    bets = giornata.get("bets", {})
+# Chiamate che contano per il limite globale di Telegram sui messaggi (~30/s per bot)
+_LIMITED_METHODS = frozenset({"sendMessage", "sendDocument", "editMessageText", "editMessageReplyMarkup",
+                              "pinChatMessage", "unpinChatMessage"})
+
+
+class _CountingRequest(HTTPXRequest):
+    """
+    Richieste alla Bot API contate in metrics (per metodo e per update). Quelle che mandano o
+    modificano messaggi passano dal bucket globale di OUTBOX: riepiloghi e solleciti aspettano
+    il loro turno, le risposte ai comandi no (vedi Outbox.acquire_global).
+    """
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        name = url.rsplit("/", 1)[-1]
+        METRICS.api_call(name)
+        if name in _LIMITED_METHODS:
+            await OUTBOX.acquire_global()
+        return await super().do_request(url, method, request_data, *args, **kwargs)
+
+
+def _ricorda_utente(update: Update) -> None:
+    """Salva lo user_id dei giocatori della rosa (serve per i solleciti in privato); scrive solo se cambia."""
+    user, chat = update.effective_user, update.effective_chat
+    if user is None or not user.username or chat is None or chat.type == "private":
+        return
+    store = get_store(chat.id)
+    username = f"@{user.username}"
+    if username in roster(store.data) and store.data.get("user_ids", {}).get(username) != user.id:
+        store.apply({"type": "player_linked", "username": username, "user_id": user.id})
+
+
+# Tipi di chat che hanno uno stato (uno shard): le chat private e i canali no
+_CHAT_GRUPPO = ("group", "supergroup")
+
+
+def once_per_update(fn, solo_gruppi: bool = True):
+    """
+    Rende l'handler idempotente per update_id: gli eventi che applica portano l'update_id
+    (state_store.CURRENT_UPDATE) e un update rigiocato dall'inbox che li ha già prodotti viene saltato.
+    Con solo_gruppi l'handler fuori da un gruppo risponde con un avviso, senza creare uno stato per la chat.
+    """
+    @functools.wraps(fn)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # con più worker: la chat è passata a un altro processo mentre l'update era in coda
+        if WORKER is not None and not WORKER.mia(chat_key(update)) and await WORKER.instrada(update, in_ordine=False):
+            return
+        chat = update.effective_chat
+        if chat is not None and chat.type not in _CHAT_GRUPPO:
+            if solo_gruppi:
+                if update.effective_message is not None:
+                    await update.effective_message.reply_text("ℹ️ Questo comando funziona solo nei gruppi.")
+                return
+        elif chat is not None and _store(update).applied_update(update.update_id):
+            print(f"↩️ Update {update.update_id} già applicato, salto", flush=True)
+            return
+        # fuori da CURRENT_UPDATE: non deve far sembrare già applicato l'update se il bot cade subito dopo
+        _ricorda_utente(update)
+        token = CURRENT_UPDATE.set(update.update_id)
+        try:
+            return await fn(update, context)
+        finally:
+            CURRENT_UPDATE.reset(token)
+            if AVVIO.fase("primo update"):
+                print(f"⏱️ Primo update: {AVVIO.riepilogo()}", flush=True)
+    return wrapper
+
+
+def handler(fn, name: str = None, solo_gruppi: bool = True):
+    """Handler serializzato per chat (per_chat), idempotente e misurato (latenza, errori, chiamate API)."""
+    return METRICS.instrument(name or fn.__name__)(per_chat(once_per_update(fn, solo_gruppi)))
+
+
+def _add_metrics_route() -> None:
+    """Aggiunge /metrics all'app tornado che run_webhook crea per il webhook."""
+    # python-telegram-bot non espone l'app tornado: la versione è fissata in requirements.txt
+    from telegram.ext import _updater
+    base = _updater.WebhookAppClass
+    metrics_handler = tornado_handler()
+
+    class WebhookAppWithMetrics(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.add_handlers(r".*", [(METRICS_PATH, metrics_handler)])
+
+    _updater.WebhookAppClass = WebhookAppWithMetrics
+
+
+def _webhook_reuse_port() -> None:
+    """Il server del webhook apre la porta con SO_REUSEPORT: più worker ascoltano sulla stessa."""
+    from telegram.ext import _updater
+    base = _updater.WebhookServer
+
+    class WebhookServerCondiviso(base):
+        async def serve_forever(self, ready=None) -> None:
+            async with self._server_lock:
+                self._http_server.listen(self.port, address=self.listen, reuse_port=True)
+                self.is_running = True
+                if ready is not None:
+                    ready.set()
+
+    _updater.WebhookServer = WebhookServerCondiviso
+
+
+def is_admin(data: Dict, username: str) -> bool:
+    """Admin del gruppo: può usare /estrai /inizio_giornata /fine_giornata /esiti /versa /registra."""
+    return username in admins(data)
 
+
+def summary_text(data: Dict, g_key: str) -> str:
+    """Testo del messaggio riassuntivo delle giocate della giornata."""
+    bets = data["bets"][g_key].bets
     lines = [f"📋 GIOCATE GIORNATA {g_key}"]
-    for u, name in USERNAME_TO_NAME.items():
-        if u in bets:
-            giocata = bets[u].get("giocata", "(nessuna)")
-            quota = bets[u].get("quota", 0.0)
-            jolly = " 🃏" if bets[u].get("jolly") else ""
-            lines.append(f"{u}: {giocata} @ {quota:.2f}{jolly}")
+    for u, name in roster(data).items():
+        b = bets.get(u)
+        if b is not None:
+            jolly = " 🃏" if b.jolly else ""
+            lines.append(f"{u}: {b.giocata} @ {b.quota:.2f}{jolly}")
         else:
             lines.append(f"{u}: ❌ Non ancora giocato")
-    text = "\n".join(lines)
+    return "\n".join(lines)
 
-    chat_id = update.effective_chat.id
+
+OUTBOX = Outbox()
+# i riepiloghi in pin passano dagli stessi bucket per chat dei solleciti
+SUMMARIES = SummaryScheduler(get_store, summary_text, buckets=OUTBOX.chat_buckets,
+                             owns=lambda chat_id: WORKER is None or WORKER.mia(chat_id))
+METRICS.add_gauge("bot_outbox_queued", "Messaggi in coda di invio (solleciti).", lambda: len(OUTBOX))
+
+SOLLECITO_MODI = ("gruppo", "privato", "off")
+
+
+def mancanti(data: Dict, g_key: str) -> List[str]:
+    """Giocatori della rosa che non hanno ancora giocato (esclusi quelli con la partita già iniziata)."""
+    giornata = data["bets"][g_key]
+    fatto = set(giornata.bets) | set(giornata.bloccate)
+    return [u for u in roster(data) if u not in fatto]
+
+
+def sollecita(bot, chat_id, store: BaseStore, g_key: str, privato: bool) -> int:
+    """
+    Sollecita chi non ha giocato: in privato chi ha uno user_id noto, nel gruppo (menzioni raggruppate
+    nel minor numero di messaggi) tutti gli altri e chi non può ricevere messaggi privati dal bot.
+    L'invio avviene in background tramite OUTBOX. Ritorna quanti giocatori vengono sollecitati.
+    """
+    users = mancanti(store.data, g_key)
+    if users:
+        ids = store.data.get("user_ids", {}) if privato else {}
+        OUTBOX.spawn(_invia_solleciti(bot, chat_id, g_key, users, ids))
+    return len(users)
+
+
+async def _invia_solleciti(bot, chat_id, g_key: str, users: List[str], ids: Dict[str, int]) -> None:
+    dm = [u for u in users if u in ids]
+    futures = [OUTBOX.send(bot, ids[u], f"⏰ Non hai ancora giocato la G{g_key}! Usa /gioca nel gruppo.",
+                           key=("sollecito", chat_id, g_key, u)) for u in dm]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    # chi non ha mai avviato il bot in privato (Forbidden) viene menzionato nel gruppo
+    gruppo = [u for u in users if u not in ids] + [u for u, r in zip(dm, results) if isinstance(r, BaseException)]
+    for i, text in enumerate(mention_batches(f"⏰ G{g_key}: devono ancora giocare ", gruppo)):
+        OUTBOX.send(bot, chat_id, text, key=("sollecito", chat_id, g_key, i))
+
+
+async def pin_or_edit_summary(update: Update, context: ContextTypes.DEFAULT_TYPE, g_key: str) -> None:
+    """Crea/aggiorna e mette in pin il messaggio riassuntivo (con debounce: vedi summary.SummaryScheduler)."""
+    SUMMARIES.schedule(context.bot, update.effective_chat.id, g_key)
+
+
+# ====== CALENDARIO AUTOMATICO (giornate.json con i calci d'inizio) ======
+async def _kickoff_promemoria(bot, chat_id, store: BaseStore, g_key: str, usernames) -> None:
+    if store.data["bets"][g_key].status != "assigned":
+        return
+    modo = store.data.get("solleciti", "gruppo")
+    if modo != "off":
+        sollecita(bot, chat_id, store, g_key, privato=modo == "privato")
+
+
+async def _kickoff_inizio(bot, chat_id, store: BaseStore, g_key: str, usernames) -> None:
+    gnum, err = inizio_giornata(store)
+    if not err:
+        await bot.send_message(chat_id, f"🏁 Giornata {gnum} iniziata (primo calcio d'inizio). Buone giocate!")
+
+
+async def _kickoff_blocco(bot, chat_id, store: BaseStore, g_key: str, usernames) -> None:
+    bloccate = store.data["bets"][g_key].bloccate
+    nuove = [u for u in usernames if u not in bloccate]
+    if not nuove:
+        return
+    store.apply({"type": "bets_locked", "g": g_key, "usernames": nuove})
+    await bot.send_message(chat_id, f"🔒 Partita iniziata: giocate bloccate per {', '.join(nuove)}.",
+                           disable_notification=True)
+
+
+async def _kickoff_fine(bot, chat_id, store: BaseStore, g_key: str, usernames) -> None:
+    gnum, err = fine_giornata(store)
+    if not err:
+        await bot.send_message(chat_id, f"🧾 Giornata {gnum} finita. Ora /esiti (o /risultati e /regola) per gli esiti.")
+
+
+def _kickoff_for(store: BaseStore, g_key: str) -> Dict[str, float]:
     try:
-        if "pinned_summary_id" in giornata:
-            await context.bot.unpin_chat_message(chat_id=chat_id, message_id=giornata["pinned_summary_id"])
-    except Exception:
-        pass
+        return schedule_for(store).kickoff.get(g_key, {})
+    except (KeyError, OSError):
+        return {}
+
 
-    msg_id = giornata.get("summary_message_id")
-    if msg_id:
+KICKOFFS = KickoffScheduler(get_store, _kickoff_for, {
+    "promemoria": _kickoff_promemoria, "inizio": _kickoff_inizio,
+    "blocco": _kickoff_blocco, "fine": _kickoff_fine,
+}, owns=lambda chat_id: WORKER is None or WORKER.mia(chat_id))
+METRICS.add_gauge("bot_kickoff_timers", "Azioni del calendario automatico in attesa.", lambda: len(KICKOFFS))
+
+
+# ====== PIÙ WORKER (WORKER_ID / WORKERS, vedi workers.py) ======
+def _chat_acquisita(chat_id) -> None:
+    # la copia in memoria (se c'è) può essere più vecchia di quella scritta dall'ultimo proprietario
+    SHARDS.discard(chat_id)
+    if isinstance(chat_id, int) and chat_id < 0:  # solo i gruppi hanno giornate
         try:
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=msg_id, text=text)
-            new_id = msg_id
-        except Exception:
-            m = await context.bot.send_message(chat_id=chat_id, text=text)
-            new_id = m.message_id
-            giornata["summary_message_id"] = new_id
-    else:
-        m = await context.bot.send_message(chat_id=chat_id, text=text)
-        new_id = m.message_id
-        giornata["summary_message_id"] = new_id
+            KICKOFFS.plan(chat_id)
+        except Exception as e:
+            print(f"⚠️ Calendario: gruppo {chat_id} non pianificato: {e}", flush=True)
+
+
+def _chat_persa(chat_id) -> None:
+    SHARDS.discard(chat_id)
+    KICKOFFS.forget(chat_id)
+
+
+def _dopo_heartbeat() -> None:
+    # il limite globale di Telegram vale per il bot: ogni worker ne usa una parte proporzionale alle sue chat
+    OUTBOX.global_bucket.rate = OUTBOX_GLOBAL_PER_SEC * WORKER.quota
 
+
+if WORKER is not None:
+    WORKER.acquisita, WORKER.persa, WORKER.heartbeat_fatto = _chat_acquisita, _chat_persa, _dopo_heartbeat
+    METRICS.add_gauge("bot_worker_chats", "Chat di cui questo worker è proprietario.", lambda: len(WORKER.mie))
+    METRICS.add_gauge("bot_worker_leader", "1 se questo worker è il leader.", lambda: int(WORKER.leader))
+    METRICS.add_gauge("bot_worker_routed", "Update girati ad altri worker dall'avvio.",
+                      lambda: WORKER.stats["instradati"])
+
+
+async def _pulizia_webhook(bot) -> None:
+    # in polling: se c'è un webhook attivo lo cancelliamo con lo STESSO token in uso
+    # (lo fa anche l'Updater di PTB prima del primo getUpdates: qui resta la traccia nel log)
     try:
-        await context.bot.pin_chat_message(chat_id=chat_id, message_id=new_id)
-        giornata["pinned_summary_id"] = new_id
-    except Exception:
-        pass
+        info = await bot.get_webhook_info()
+        print("Webhook attuale:", info.url or "(nessuno)", flush=True)
+        if info.url:
+            await bot.delete_webhook()  # gli update in attesa li prende il polling
+            print("Webhook cancellato.", flush=True)
+    except Exception as e:
+        print(f"⚠️ Controllo del webhook fallito: {e}", flush=True)
+
 
-    save_data(data)
+async def _pianifica_calendario(chat_ids) -> None:
+    t0 = time.perf_counter()
+    n = await KICKOFFS.plan_all(chat_ids)
+    if n:
+        print(f"⏱️ Calendario automatico: {n} giornate, {len(KICKOFFS)} azioni in attesa "
+              f"({(time.perf_counter() - t0) * 1000:.0f} ms)", flush=True)
+
+
+def _in_sottofondo(coro) -> None:
+    _SOTTOFONDO.append(asyncio.get_running_loop().create_task(coro))
+
+
+async def _post_init(app) -> None:
+    SHARDS.start_flusher()
+    if not WEBHOOK_URL:
+        _in_sottofondo(_pulizia_webhook(app.bot))
+    if app.job_queue is None:
+        print("⚠️ JobQueue non disponibile (python-telegram-bot[job-queue]): calendario automatico spento", flush=True)
+    else:
+        KICKOFFS.start(app.job_queue)
+        # caricare tutti i gruppi richiede tempo: si pianifica in sottofondo mentre arrivano gli update.
+        # Con più worker ognuno pianifica le chat che prende (vedi _chat_acquisita)
+        if WORKER is None:
+            _in_sottofondo(_pianifica_calendario(group_chat_ids()))
+    if WORKER is not None:
+        await WORKER.start(app.update_queue, app.bot, group_chat_ids)
+        print(f"👷 Worker {WORKER.id}: {len(WORKER.mie)} chat, {WORKER.vivi} worker attivi", flush=True)
+    if isinstance(app.update_queue, InboxQueue):
+        t0 = time.perf_counter()
+        n = await app.update_queue.inbox.replay(app, app.update_queue.instrada)
+        if n:
+            print(f"📥 Rimessi in coda {n} update non finiti ({(time.perf_counter() - t0) * 1000:.0f} ms)", flush=True)
+    AVVIO.fase("init")
+    print(f"⏱️ Avvio: {AVVIO.riepilogo()}", flush=True)
+
+
+async def _post_stop(app) -> None:
+    # qui il bot può ancora chiamare la Bot API (in post_shutdown è già chiuso)
+    await OUTBOX.drain(OUTBOX_DRAIN_TIMEOUT)
+    await SUMMARIES.drain()
+    print(f"Riepiloghi: {SUMMARIES.stats}", flush=True)
+    print(f"Messaggi in uscita: {OUTBOX.stats}", flush=True)
+
+
+async def _post_shutdown(app) -> None:
+    for task in _SOTTOFONDO:
+        task.cancel()
+    await asyncio.gather(*_SOTTOFONDO, return_exceptions=True)
+    await SHARDS.stop_flusher()
+    if WORKER is not None:
+        # dopo il salvataggio: da qui le chat possono passare agli altri worker
+        print(f"Worker: {WORKER.stats}", flush=True)
+        await WORKER.stop()
+    if isinstance(app.update_queue, InboxQueue):
+        print(f"Inbox: {app.update_queue.inbox.stats}", flush=True)
+        app.update_queue.inbox.close()
 
 
 # ====== COMMANDS ======
@@ -92,30 +378,44 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/estrai  /inizio_giornata  /fine_giornata  /esiti (admin)\n"
         "/gioca  /modifica\n"
         "/classifica  /jolly  /Jolly  /malloppo [totale|solo giocate]\n"
-        "/soldi  /versa @user <euro> (admin)  /giornate  /aggiorna"
+        "/soldi  /estratto [@user] [da G] [a G]  /versa @user <euro>  /esporta [csv|jsonl] [stagione] (admin)  /giornate  /aggiorna  /proiezione  /statistiche [@user]\n"
+        "/rosa  /registra @user Nome  /rimuovi @user  /admin @user (admin)\n"
+        "/sollecita [privato]  /sollecita auto gruppo|privato|off (admin)\n"
+        "/calendario <squadra>  /campionato [competizione stagione]\n"
+        "/risultato Casa-Ospite 2-1  /risultati  /regola  /verifica  /stato (admin)"
     )
 
 
-async def classifica(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    d = load_data()
+def _render_classifica(d: Dict) -> str:
     txt = "📊 Classifica:\n"
-    for u, name in USERNAME_TO_NAME.items():
-        txt += f"{u:<15} → {d['players'][name]['points']} punti\n"
+    for u, name in roster(d).items():
+        txt += f"{u:<15} → {d['players'][name].points} punti\n"
+    return txt
+
+
+async def classifica(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    txt = _store(update).cached_view("classifica", "classifica", _render_classifica)
     await update.message.reply_text(txt)
 
 
-async def jolly(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    d = load_data()
+def _render_jolly(d: Dict) -> str:
     txt = "🃏 Jolly usati:\n"
-    for u, name in USERNAME_TO_NAME.items():
-        txt += f"{u:<15} → {d['players'][name]['jolly_used']} jolly\n"
+    for u, name in roster(d).items():
+        txt += f"{u:<15} → {d['players'][name].jolly_used} jolly\n"
+    return txt
+
+
+async def jolly(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    txt = _store(update).cached_view("jolly", "jolly", _render_jolly)
     await update.message.reply_text(txt)
 
 
 async def gioca(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     username = f"@{user.username}"
-    if username not in USERNAME_TO_NAME:
+    store = _store(update)
+    d = store.data
+    if username not in roster(d):
         await update.message.reply_text("❌ Non sei autorizzato.")
         return
 
@@ -127,20 +427,25 @@ async def gioca(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     giocata = m.group(1).strip()
     quota = float(m.group(2))
-    d = load_data()
-    bets = d.get("bets", {})
-    if not bets:
+    g_key = store.current_giornata()
+    if g_key is None:
         await update.message.reply_text("❌ Nessuna giornata attiva. Usa /estrai prima.")
         return
 
-    g_key = str(max(int(k) for k in bets.keys()))
-    giornata = bets[g_key]
-    if giornata["status"] not in ("assigned", "started"):
+    giornata = d["bets"][g_key]
+    if giornata.status not in ("assigned", "started"):
         await update.message.reply_text("❌ Le giocate non sono più accettate (giornata conclusa).")
         return
+    if username in giornata.bloccate:
+        await update.message.reply_text("🔒 La tua partita è già iniziata: giocata bloccata.")
+        return
 
-    giornata.setdefault("bets", {})
-    giornata["bets"][username] = {
+    name = roster(d)[username]
+    event = {
+        "type": "bet_placed",
+        "g": g_key,
+        "username": username,
+        "player": name,
         "giocata": giocata,
         "quota": quota,
         "jolly": quota < MIN_QUOTA
@@ -148,21 +453,26 @@ async def gioca(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Gestione jolly "a cicli" con penale dopo TOT_JOLLY
     if quota < MIN_QUOTA:
-        name = USERNAME_TO_NAME[username]
-        used = d["players"][name].get("jolly_used", 0) + 1
+        used = d["players"][name].jolly_used + 1
         if used > TOT_JOLLY:
             # scatta penale e riparte il conteggio
-            d["players"][name]["jolly_used"] = 1
-            d["players"][name]["debt"] = d["players"][name].get("debt", 0) + JOLLY_PENALTY_EUR
-            d["malloppo"]["penali_jolly"] += JOLLY_PENALTY_EUR
+            event["jolly_used"] = 1
+            event["penalty"] = JOLLY_PENALTY_EUR
             extra = f" 💸 Penale {JOLLY_PENALTY_EUR}€ applicata, jolly azzerati (ora 1/{TOT_JOLLY})."
         else:
-            d["players"][name]["jolly_used"] = used
+            event["jolly_used"] = used
             extra = f" 🃏 Jolly usato ({used}/{TOT_JOLLY})."
     else:
         extra = ""
 
-    save_data(d)
+    combo = parse_giocata(giocata)
+    if combo is not None:
+        event["tipo_verifica"] = "mercato"
+        event["dati_verifica"] = to_dati(combo)
+    else:
+        extra += " ✍️ Mercato non riconosciuto: l'esito andrà dato a mano con /esiti."
+
+    store.apply(event)
     await update.message.reply_text(f"✅ Giocata salvata.{extra}")
     await pin_or_edit_summary(update, context, g_key)
 
@@ -170,34 +480,34 @@ async def gioca(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def modifica(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     username = f"@{user.username}"
-    if username not in USERNAME_TO_NAME:
+    store = _store(update)
+    d = store.data
+    if username not in roster(d):
         await update.message.reply_text("❌ Non sei autorizzato.")
         return
-    d = load_data()
-    bets = d.get("bets", {})
-    if not bets:
+    g_key = store.current_giornata()
+    if g_key is None:
         await update.message.reply_text("❌ Nessuna giornata attiva.")
         return
-    g_key = str(max(int(k) for k in bets.keys()))
-    giornata = bets[g_key]
-    if giornata["status"] != "assigned":
+    giornata = d["bets"][g_key]
+    if giornata.status != "assigned" or username in giornata.bloccate:
         await update.message.reply_text("⚠️ Giornata già iniziata: non puoi modificare.")
         return
-    if username not in giornata.get("bets", {}):
+    if username not in giornata.bets:
         await update.message.reply_text("❌ Non hai ancora giocato.")
         return
-    del giornata["bets"][username]
-    save_data(d)
+    store.apply({"type": "bet_deleted", "g": g_key, "username": username})
     await update.message.reply_text("✏️ Giocata cancellata. Re-invia con /gioca …")
 
 
 async def estrai_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     username = f"@{user.username}"
-    if not is_admin(username):
+    store = _store(update)
+    if not is_admin(store.data, username):
         await update.message.reply_text("❌ Solo l'admin può estrarre.")
         return
-    result, error = estrai_partite()
+    result, error = estrai_partite(store)
     if error:
         await update.message.reply_text(f"❌ {error}")
         return
@@ -205,20 +515,24 @@ async def estrai_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     assignments = result["assignments"]
     leftover = result["leftover"]
     txt = f"🎲 *Partite estratte per la giornata {giornata}*\n\n"
+    name_to_username = {v: k for k, v in roster(store.data).items()}
     for player, match in assignments.items():
-        u = NAME_TO_USERNAME.get(player, player)
+        u = name_to_username.get(player, player)
         txt += f"{u}: {match}\n"
     if leftover:
         txt += "\n❗ Partite non assegnate:\n" + "\n".join(f"- {m}" for m in leftover)
+    if KICKOFFS.plan(update.effective_chat.id):
+        txt += "\n⏱️ Inizio, blocco delle giocate e fine seguono i calci d'inizio del calendario."
     await update.message.reply_text(txt, parse_mode="Markdown")
 
 
 async def inizio_giornata_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if f"@{user.username}" not in ADMINS:
+    store = _store(update)
+    if not is_admin(store.data, f"@{user.username}"):
         await update.message.reply_text("❌ Solo l'admin può iniziare la giornata.")
         return
-    gnum, err = inizio_giornata()
+    gnum, err = inizio_giornata(store)
     if err:
         await update.message.reply_text(f"❌ {err}")
         return
@@ -227,10 +541,11 @@ async def inizio_giornata_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def fine_giornata_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if f"@{user.username}" not in ADMINS:
+    store = _store(update)
+    if not is_admin(store.data, f"@{user.username}"):
         await update.message.reply_text("❌ Solo l'admin può chiudere la giornata.")
         return
-    gnum, err = fine_giornata()
+    gnum, err = fine_giornata(store)
     if err:
         await update.message.reply_text(f"❌ {err}")
         return
@@ -238,9 +553,9 @@ async def fine_giornata_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ====== ESITI MANUALI ======
-def _keyboard_esiti(losers: List[str]) -> InlineKeyboardMarkup:
+def _keyboard_esiti(usernames: List[str], losers: List[str]) -> InlineKeyboardMarkup:
     rows = []
-    for u in USERNAME_TO_NAME:
+    for u in usernames:
         flag = "❌" if u in losers else "✅"
         rows.append([InlineKeyboardButton(text=f"{flag} {u}", callback_data=f"esiti_toggle|{u}")])
     rows.append([
@@ -253,24 +568,30 @@ def _keyboard_esiti(losers: List[str]) -> InlineKeyboardMarkup:
 async def esiti_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     username = f"@{user.username}"
-    if not is_admin(username):
+    store = _store(update)
+    d = store.data
+    if not is_admin(d, username):
         await update.message.reply_text("❌ Solo l'admin può impostare gli esiti.")
         return
 
-    d = load_data()
-    bets = d.get("bets", {})
-    if not bets:
+    g_key = store.current_giornata()
+    if g_key is None:
         await update.message.reply_text("❌ Nessuna giornata.")
         return
-    g_key = str(max(int(k) for k in bets.keys()))
-    if bets[g_key].get("status") != "finished":
+    if d["bets"][g_key].status != "finished":
         await update.message.reply_text("ℹ️ La giornata non è ancora *finished*. Usa /fine_giornata prima.")
         return
 
-    context.chat_data["esiti"] = {"g_key": g_key, "losers": set()}
+    # se ci sono risultati (/risultato, /risultati) i perdenti calcolati sono già selezionati
+    losers, hint = [], ""
+    if d["bets"][g_key].risultati:
+        losers, pending = regola_giornata(d["bets"][g_key], roster(d))
+        hint = "\nPreselezionati dai risultati" + (f"; da decidere: {', '.join(pending)}" if pending else "") + "."
+    # lista e non set: chat_data viene salvato in JSON (persistence.StorePersistence)
+    context.chat_data["esiti"] = {"g_key": g_key, "losers": sorted(losers)}
     await update.message.reply_text(
-        f"Seleziona i PERDENTI della Giornata {g_key} (toggle sui nomi).",
-        reply_markup=_keyboard_esiti([])
+        f"Seleziona i PERDENTI della Giornata {g_key} (toggle sui nomi).{hint}",
+        reply_markup=_keyboard_esiti(list(roster(d)), losers)
     )
 
 
@@ -283,12 +604,16 @@ async def esiti_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("Sessione esiti non trovata. Rilancia /esiti.")
         return
     losers = data["losers"]
+    store = _store(update)
 
     if query.data.startswith("esiti_toggle|"):
         u = query.data.split("|", 1)[1]
-        if u in losers: losers.remove(u)
-        else: losers.add(u)
-        await query.edit_message_reply_markup(reply_markup=_keyboard_esiti(list(losers)))
+        # i toggle stanno in chat_data, non in un evento: un toggle rigiocato non va ripetuto
+        if update.update_id > data.get("ultimo_update", 0):
+            if u in losers: losers.remove(u)
+            else: losers.append(u)
+            data["ultimo_update"] = update.update_id
+        await query.edit_message_reply_markup(reply_markup=_keyboard_esiti(list(roster(store.data)), losers))
         return
 
     if query.data == "esiti_cancel":
@@ -299,7 +624,7 @@ async def esiti_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if query.data == "esiti_confirm":
         g_key = data["g_key"]
         losers_usernames = list(losers)
-        applica_esiti_manuali(g_key, losers_usernames, USERNAME_TO_NAME)
+        applica_esiti_manuali(store, g_key, losers_usernames, roster(store.data), da=f"@{query.from_user.username}")
         context.chat_data.pop("esiti", None)
 
         if losers_usernames:
@@ -310,70 +635,217 @@ async def esiti_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text(f"📌 Esiti G{g_key} salvati. Nessun perdente 🎉")
 
 
-async def soldi(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    d = load_data()
+def _render_soldi(d: Dict) -> str:
     txt = "💰 *Situazione versamenti:*\n\n"
-    for u, name in USERNAME_TO_NAME.items():
-        debt = d["players"][name].get("debt", 0)
-        paid = d["players"][name].get("paid", 0)
+    for u, name in roster(d).items():
+        debt = d["players"][name].debt
+        paid = d["players"][name].paid
         status = "✅" if paid >= debt else "❌"
         txt += f"{u:<15} → Deve {debt}€, Ha versato {paid}€ {status}\n"
+    return txt
+
+
+async def soldi(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    txt = _store(update).cached_view("soldi", "soldi", _render_soldi)
     await update.message.reply_text(txt, parse_mode="Markdown")
 
 
 async def versa(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if f"@{user.username}" not in ADMINS:
+    store = _store(update)
+    if not is_admin(store.data, f"@{user.username}"):
         await update.message.reply_text("❌ Solo l'admin può registrare versamenti.")
         return
+    # una o più coppie: /versa @a 5 @b 10 ... (tutte insieme o nessuna)
+    args = context.args or []
     try:
-        args = context.args
-        if len(args) != 2:
+        if not args or len(args) % 2:
             raise ValueError("Formato errato")
-        username = args[0]
-        euro = int(args[1])
-        if username not in USERNAME_TO_NAME:
-            await update.message.reply_text("❌ Username non valido.")
+        pairs = [(args[i], int(args[i + 1])) for i in range(0, len(args), 2)]
+    except ValueError:
+        await update.message.reply_text("Formato: /versa @username <euro> [@username <euro> ...]  (es: /versa @Chris4rda 5)")
+        return
+    r = roster(store.data)
+    unknown = [u for u, _ in pairs if u not in r]
+    if unknown:
+        await update.message.reply_text(f"❌ Username non valido: {', '.join(unknown)}")
+        return
+    n, err = applica_lotto(store, [{"type": "payment_recorded", "player": r[u], "euro": euro, "da": f"@{user.username}"}
+                                   for u, euro in pairs])
+    if err:
+        await update.message.reply_text(f"❌ Nessun versamento registrato.\n{err}")
+        return
+    if n == 1:
+        await update.message.reply_text(f"✅ Aggiunti {pairs[0][1]}€ a {pairs[0][0]}.")
+    else:
+        righe = "\n".join(f"- {u}: {euro}€" for u, euro in pairs)
+        await update.message.reply_text(f"✅ {n} versamenti registrati:\n{righe}")
+
+
+def _righe_estratto(store: BaseStore, u: str, name: str, da: Optional[int], a: Optional[int]):
+    ledger = store.ledger()
+    movimenti = store.data["movimenti"]
+    periodo = f" G{da or 1}–G{a}" if a is not None else (f" dalla G{da}" if da else "")
+    yield f"📒 Estratto conto {u} ({name}){periodo}"
+    if da:
+        yield f"Saldo prima della G{da}: {ledger.saldo(name, da - 1)}€"
+    for m, saldo in ledger.estratto(movimenti, name, da, a):
+        quando = f"G{m.giornata}" if m.giornata else "—"
+        dettagli = [x for x in (m.da and f"da {m.da}", m.ts and time.strftime("%d/%m/%Y", time.localtime(m.ts))) if x]
+        extra = f" ({', '.join(dettagli)})" if dettagli else ""
+        yield f"{quando} {ETICHETTE.get(m.tipo, m.tipo)}{extra}: {m.variazione:+d}€ → {saldo}€"
+    if a is not None:
+        yield f"Saldo dopo la G{a}: {ledger.saldo(name, a)}€"
+    else:
+        yield f"Saldo attuale: {ledger.saldo(name)}€ (positivo = da versare)"
+
+
+async def estratto(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = _store(update)
+    d = store.data
+    args = list(context.args or [])
+    u = f"@{update.effective_user.username}"
+    if args and not args[0].lstrip("gG").isdigit():
+        u = args.pop(0)
+        u = u if u.startswith("@") else f"@{u}"
+    try:
+        if len(args) > 2:
+            raise ValueError("Formato errato")
+        da, a = ([int(x.lstrip("gG")) for x in args] + [None, None])[:2]
+        if da is not None and a is not None and da > a:
+            raise ValueError("Intervallo vuoto")
+    except ValueError:
+        await update.message.reply_text("Formato: /estratto [@username] [da G] [a G]  (es: /estratto @Chris4rda 3 10)")
+        return
+    if u not in roster(d):
+        await update.message.reply_text(f"❌ {u} non è nella rosa.")
+        return
+    # l'estratto può essere lungo: parte a pezzi da un messaggio man mano che le righe si accumulano
+    pezzo = ""
+    for riga in _righe_estratto(store, u, roster(d)[u], da, a):
+        if pezzo and len(pezzo) + 1 + len(riga) > MAX_MSG_LEN:
+            await update.message.reply_text(pezzo)
+            pezzo = ""
+        pezzo = f"{pezzo}\n{riga}" if pezzo else riga
+    await update.message.reply_text(pezzo)
+
+
+async def esporta(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = _store(update)
+    if not is_admin(store.data, f"@{update.effective_user.username}"):
+        await update.message.reply_text("❌ Solo l'admin può esportare lo storico.")
+        return
+    args = list(context.args or [])
+    formato = args.pop(0).lower() if args and args[0].lower() in FORMATI else "csv"
+    if len(args) > 1:
+        await update.message.reply_text("Formato: /esporta [csv|jsonl] [stagione]  (es: /esporta jsonl 2025-26)")
+        return
+    stagione = args[0] if args else None
+    chat_id = update.effective_chat.id
+    # il file si scrive in un thread, così uno storico lungo non ferma le altre chat; il lock della
+    # chat resta preso (per_chat), quindi nessun evento cambia lo stato mentre lo si legge
+    f, n = await asyncio.to_thread(spool, store.data, chat_id, formato, stagione)
+    with f:
+        if not n:
+            await update.message.reply_text(f"Niente da esportare{f' per la stagione {stagione}' if stagione else ''}.")
             return
-        name = USERNAME_TO_NAME[username]
-        d = load_data()
-        d["players"][name].setdefault("paid", 0)
-        d["players"][name]["paid"] += euro
-        save_data(d)
-        await update.message.reply_text(f"✅ Aggiunti {euro}€ a {username}.")
-    except Exception:
-        await update.message.reply_text("Formato: /versa @username <euro>  (es: /versa @Chris4rda 5)")
+        await update.message.reply_document(document=f, filename=nome_file(chat_id, formato, stagione),
+                                            caption=f"📦 Storico: {n} righe")
+
+
+def _render_malloppo(d: Dict) -> str:
+    m = d["malloppo"]
+    return (
+        f"💰 *Malloppo Totale: {m.totale}€*\n\n"
+        f"- Giocate sbagliate: {m.giocate_sbagliate}€\n"
+        f"- Penali jolly: {m.penali_jolly}€\n"
+        f"- Giocate di gruppo: {m.giocate_gruppo}€"
+    )
+
+
+def _render_malloppo_solo(d: Dict) -> str:
+    return f"💰 *Malloppo solo giocate sbagliate:* {d['malloppo'].giocate_sbagliate}€"
 
 
 async def malloppo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    d = load_data()
+    store = _store(update)
     args = [a.lower() for a in context.args]
     solo = (args == ["solo", "giocate"]) or (args and args[0] in {"solo_giocate", "solo"})
-    m = d["malloppo"]
-    totale = m["giocate_sbagliate"] + m["penali_jolly"] + m["giocate_gruppo"]
     if solo:
-        text = f"💰 *Malloppo solo giocate sbagliate:* {m['giocate_sbagliate']}€"
+        text = store.cached_view("malloppo_solo", "malloppo", _render_malloppo_solo)
     else:
-        text = (
-            f"💰 *Malloppo Totale: {totale}€*\n\n"
-            f"- Giocate sbagliate: {m['giocate_sbagliate']}€\n"
-            f"- Penali jolly: {m['penali_jolly']}€\n"
-            f"- Giocate di gruppo: {m['giocate_gruppo']}€"
-        )
+        text = store.cached_view("malloppo", "malloppo", _render_malloppo)
     await update.message.reply_text(text, parse_mode="Markdown")
 
 
+async def verifica(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    d = _store(update).data
+    if not is_admin(d, f"@{user.username}"):
+        await update.message.reply_text("❌ Solo l'admin può verificare i totali.")
+        return
+    drift = verifica_aggregati(d)
+    if not drift:
+        await update.message.reply_text("✅ Punti, debiti e malloppo tornano con lo storico delle giocate.")
+        return
+    await update.message.reply_text("⚠️ Differenze rispetto allo storico:\n" + "\n".join(f"- {r}" for r in drift))
+
+
+async def stato(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not is_admin(_store(update).data, f"@{user.username}"):
+        await update.message.reply_text("❌ Solo l'admin può vedere lo stato del bot.")
+        return
+    uptime = int(time.time() - METRICS.started)
+    lines = [
+        f"🩺 Stato bot (attivo da {uptime // 3600}h {uptime % 3600 // 60}m)",
+        f"Gruppi in memoria: {len(SHARDS)}  scaricati: {SHARDS.evictions}",
+        f"Scritti: {', '.join(f'{k} {v / 1024:.0f} KB' for k, v in sorted(METRICS.bytes_written.items())) or '-'}",
+        f"Chiamate API: {sum(METRICS.api_calls.values())}",
+        "",
+        "🔥 Handler più costosi (tempo totale):",
+    ]
+    for name, h, errors, api in METRICS.hottest(8):
+        lines.append(f"/{name}: {h.count}× tot {h.sum:.1f}s p50 {h.quantile(0.5) * 1000:.0f}ms "
+                     f"p99 {h.quantile(0.99) * 1000:.0f}ms api/upd {api:.1f}" + (f" ❗{errors} errori" if errors else ""))
+    await update.message.reply_text("\n".join(lines))
+
+
+async def sollecita_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = _store(update)
+    args = [a.lower() for a in context.args or []]
+    if args[:1] == ["auto"]:
+        if not is_admin(store.data, f"@{update.effective_user.username}"):
+            await update.message.reply_text("❌ Solo l'admin può cambiare i solleciti automatici.")
+            return
+        if len(args) != 2 or args[1] not in SOLLECITO_MODI:
+            await update.message.reply_text(f"Formato: /sollecita auto {'|'.join(SOLLECITO_MODI)}  "
+                                            f"(ora: {store.data.get('solleciti', 'gruppo')})")
+            return
+        store.apply({"type": "reminders_set", "modo": args[1]})
+        await update.message.reply_text(f"✅ Solleciti automatici prima del calcio d'inizio: {args[1]}.")
+        return
+    if args not in ([], ["privato"]):
+        await update.message.reply_text("Formato: /sollecita [privato]  oppure  /sollecita auto gruppo|privato|off")
+        return
+    g_key = store.current_giornata()
+    if g_key is None or store.data["bets"][g_key].status not in ("assigned", "started"):
+        await update.message.reply_text("❌ Nessuna giornata aperta alle giocate.")
+        return
+    n = sollecita(context.bot, update.effective_chat.id, store, g_key, privato=args == ["privato"])
+    if n:
+        await update.message.reply_text(f"📣 Sollecito inviato a {n} giocatori.")
+    else:
+        await update.message.reply_text(f"✅ Hanno già giocato tutti la G{g_key}.")
+
+
 async def giornate(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    d = load_data()
-    bets = d.get("bets", {})
-    if not bets:
+    store = _store(update)
+    if store.current_giornata() is None:
         await update.message.reply_text("❌ Nessuna giornata ancora registrata.")
         return
     resp = "📅 *Storico Giornate*\n\n"
-    for g_key in sorted(bets.keys(), key=lambda x: int(x)):
-        g = bets[g_key]
-        if g.get("status") != "finished": continue
-        losers = [u for u, b in g.get("bets", {}).items() if b.get("esito") == "persa"]
+    for g_key, losers in store.storico_perdenti():
         if losers:
             resp += f"G{g_key}: {', '.join(losers)}\n"
         else:
@@ -381,52 +853,389 @@ async def giornate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(resp, parse_mode="Markdown")
 
 
+# ====== RISULTATI ======
+_INGESTER: Optional[ResultsIngester] = None
+
+
+def _ingester() -> ResultsIngester:
+    # creato al primo /risultati: la sorgente si configura con RESULTS_URL_TEMPLATE
+    global _INGESTER
+    if _INGESTER is None:
+        _INGESTER = ResultsIngester(default_source())
+    return _INGESTER
+
+
+async def risultati(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    store = _store(update)
+    d = store.data
+    if not is_admin(d, f"@{user.username}"):
+        await update.message.reply_text("❌ Solo l'admin può scaricare i risultati.")
+        return
+    g_key = store.current_giornata()
+    if g_key is None:
+        await update.message.reply_text("❌ Nessuna giornata.")
+        return
+    try:
+        ingester = _ingester()
+    except ValueError as e:
+        await update.message.reply_text(f"❌ Sorgente dei risultati non configurata: {e}")
+        return
+    cal = schedule_for(store)
+    fixtures = cal.giornate.get(g_key, [])
+    results = await ingester.fetch(fixtures, g_key, cal.competition, cal.season)
+
+    known = d["bets"][g_key].risultati
+    new = {f: list(score) for f, (score, final) in results.items() if final and known.get(f) != list(score)}
+    if new:
+        store.apply({"type": "results_recorded", "g": g_key, "results": new})
+    righe = [f"📥 Risultati G{g_key}:"]
+    for f, (score, final) in results.items():
+        if final:
+            righe.append(f"{f} {score[0]}-{score[1]}")
+        elif score:
+            righe.append(f"{f} {score[0]}-{score[1]} (in corso)")
+        else:
+            righe.append(f"{f} ?")
+    righe.append(f"{len(new)} nuovi risultati salvati.")
+    await update.message.reply_text("\n".join(righe))
+
+
+def _find_fixture(fixtures: List[str], text: str) -> Optional[str]:
+    """Partita della giornata da "Inter-Torino" (maiuscole e spazi indifferenti)."""
+    key = re.sub(r"\s+", "", text).lower()
+    for f in fixtures:
+        if re.sub(r"\s+", "", f).lower() == key:
+            return f
+    return None
+
+
+async def risultato(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    store = _store(update)
+    d = store.data
+    if not is_admin(d, f"@{user.username}"):
+        await update.message.reply_text("❌ Solo l'admin può inserire i risultati.")
+        return
+    g_key = store.current_giornata()
+    if g_key is None:
+        await update.message.reply_text("❌ Nessuna giornata.")
+        return
+    m = re.match(r"(.+?)\s+(\d+)\s*-\s*(\d+)$", " ".join(context.args))
+    if not m:
+        await update.message.reply_text("Formato: /risultato Casa-Ospite <gol casa>-<gol ospite>\nEs: /risultato Inter-Torino 2-1")
+        return
+    fixtures = schedule_for(store).giornate.get(g_key, [])
+    fixture = _find_fixture(fixtures, m.group(1))
+    if fixture is None:
+        await update.message.reply_text(f"❌ {m.group(1)} non è una partita della G{g_key}.")
+        return
+    score = [int(m.group(2)), int(m.group(3))]
+    store.apply({"type": "results_recorded", "g": g_key, "results": {fixture: score}})
+
+    losers, pending = regola_giornata(d["bets"][g_key], roster(d))
+    righe = [f"📝 {fixture} {score[0]}-{score[1]} salvato (G{g_key})."]
+    if pending:
+        righe.append(f"Da decidere: {len(pending)} ({', '.join(pending)})")
+    else:
+        righe.append("Tutte le giocate sono decidibili: /regola per applicare gli esiti.")
+    await update.message.reply_text("\n".join(righe))
+
+
+async def regola(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    store = _store(update)
+    d = store.data
+    if not is_admin(d, f"@{user.username}"):
+        await update.message.reply_text("❌ Solo l'admin può regolare la giornata.")
+        return
+    g_key = store.current_giornata()
+    if g_key is None:
+        await update.message.reply_text("❌ Nessuna giornata.")
+        return
+    giornata = d["bets"][g_key]
+    if giornata.status != "finished":
+        await update.message.reply_text("ℹ️ La giornata non è ancora *finished*. Usa /fine_giornata prima.")
+        return
+    if any(b.esito is not None for b in giornata.bets.values()):
+        await update.message.reply_text(f"ℹ️ Gli esiti della G{g_key} sono già stati applicati.")
+        return
+    losers, pending = regola_giornata(giornata, roster(d))
+    if pending:
+        righe = [f"⚠️ Non posso regolare da solo la G{g_key}:"]
+        righe += [f"- {u}: {motivo}" for u, motivo in pending.items()]
+        righe.append("Inserisci i risultati mancanti con /risultato oppure usa /esiti (perdenti già preselezionati).")
+        await update.message.reply_text("\n".join(righe))
+        return
+    applica_esiti_manuali(store, g_key, losers, roster(d), da=f"@{update.effective_user.username}")
+    righe = [f"🤖 Esiti G{g_key} calcolati dai risultati:"]
+    bets = giornata.bets
+    for u in roster(d):
+        combo = parse_giocata(bets[u].giocata)
+        esito = "❌ persa" if u in losers else "✅ vinta"
+        righe.append(f"{u}: {canonical(combo) if combo else bets[u].giocata} → {esito}")
+    await update.message.reply_text("\n".join(righe))
+
+
+async def proiezione_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = _store(update)
+    d = store.data
+    if not roster(d):
+        await update.message.reply_text("❌ Nessun giocatore registrato.")
+        return
+    from projection import PROIEZIONE_SIMULAZIONI, giornate_rimaste, proiezione  # numpy: solo al primo uso
+    n_sim = PROIEZIONE_SIMULAZIONI
+    if context.args and context.args[0].isdigit():
+        n_sim = max(1000, min(int(context.args[0]), 1_000_000))
+    n_giornate = giornate_rimaste(d, schedule_for(store).giornate)
+    if n_giornate == 0:
+        await update.message.reply_text("ℹ️ Stagione finita: niente da proiettare.")
+        return
+    t0 = time.perf_counter()
+    # calcolo numerico fuori dall'event loop, su una copia (altri handler possono toccare lo stato)
+    snapshot = copy.deepcopy({k: d.get(k, {}) for k in ("roster", "players", "bets")})
+    res = await asyncio.to_thread(proiezione, snapshot, n_giornate, MIN_QUOTA, TOT_JOLLY, JOLLY_PENALTY_EUR, n_sim)
+    ms = (time.perf_counter() - t0) * 1000
+    name_to_username = {v: k for k, v in roster(d).items()}
+    righe = [f"🔮 Proiezione a fine stagione ({n_giornate} giornate, {n_sim:,} simulazioni)".replace(",", "."),
+             "punti e debito: 10° / 50° / 90° percentile"]
+    for name, r in sorted(res.items(), key=lambda kv: -kv[1]["p_top"]):
+        p, e = r["punti"], r["debito"]
+        righe.append(f"{name_to_username.get(name, name)}: {p[0]:.0f}/{p[1]:.0f}/{p[2]:.0f} pt, "
+                     f"{e[0]:.0f}/{e[1]:.0f}/{e[2]:.0f}€ — {r['p_top'] * 100:.0f}% di pagare di più"
+                     + (f", ~{r['penali']:.1f} penali jolly" if r["penali"] >= 0.05 else ""))
+    righe.append(f"(calcolata in {ms:.0f} ms)")
+    await update.message.reply_text("\n".join(righe))
+
+
+async def statistiche(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = _store(update)
+    d = store.data
+    history = store.history()
+    if context.args:
+        u = context.args[0] if context.args[0].startswith("@") else f"@{context.args[0]}"
+        st = history.stats([u]).get(u)
+        if st is None:
+            await update.message.reply_text(f"❌ Nessuna giocata regolata per {u}.")
+            return
+        await update.message.reply_text(
+            f"📈 Statistiche {u}\n"
+            f"Giocate regolate: {st['giocate']}  vinte: {st['vinte_pct']:.0f}%\n"
+            f"Quota media: {st['quota_media']:.2f}  ROI simulato: {st['roi_pct']:+.0f}%\n"
+            f"Jolly: {st['jolly']} ({st['jolly_vinti_pct']:.0f}% vinti)\n"
+            f"Serie di vittorie: migliore {st['serie_max']}, attuale {st['serie_attuale']}"
+        )
+        return
+    stats = history.stats(list(roster(d)))
+    if not stats:
+        await update.message.reply_text("❌ Nessuna giocata ancora regolata.")
+        return
+    righe = ["📈 Statistiche (vinte %, quota media, ROI, serie migliore/attuale, jolly)"]
+    for u, st in sorted(stats.items(), key=lambda kv: -kv[1]["vinte_pct"]):
+        righe.append(f"{u}: {st['vinte_pct']:.0f}% su {st['giocate']}, @{st['quota_media']:.2f}, "
+                     f"ROI {st['roi_pct']:+.0f}%, serie {st['serie_max']}/{st['serie_attuale']}, 🃏{st['jolly']}")
+    await update.message.reply_text("\n".join(righe))
+
+
+# ====== CALENDARIO ======
+async def calendario(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.message.reply_text("Formato: /calendario <squadra>  (es: /calendario Inter)")
+        return
+    store = _store(update)
+    cal = schedule_for(store)
+    team = cal.find_team(" ".join(context.args))
+    if team is None:
+        await update.message.reply_text("❌ Squadra non trovata nel calendario.")
+        return
+    played = set(store.data.get("bets", {}))
+    txt = f"📆 Calendario {team} ({cal.competition} {cal.season}):\n"
+    for g_key, fixture in cal.team_fixtures(team):
+        mark = "✔️" if g_key in played else "▫️"
+        txt += f"{mark} G{g_key}: {fixture}\n"
+    await update.message.reply_text(txt)
+
+
+async def campionato(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = _store(update)
+    d = store.data
+    schedule_file = SCHEDULES.file(schedule_path_for(store))
+    schedule_file.refresh()
+    if not context.args:
+        cal = schedule_for(store)
+        disponibili = ", ".join(f"{c} {s}" for c, s in schedule_file.calendars)
+        await update.message.reply_text(f"🏆 In uso: {cal.competition} {cal.season}\nDisponibili: {disponibili}")
+        return
+    if not is_admin(d, f"@{update.effective_user.username}"):
+        await update.message.reply_text("❌ Solo l'admin può cambiare campionato.")
+        return
+    if len(context.args) != 2 or tuple(context.args) not in schedule_file.calendars:
+        await update.message.reply_text("Formato: /campionato <competizione> <stagione>  (vedi /campionato)")
+        return
+    if store.current_giornata() is not None:
+        # le giornate sono numerate per gruppo: cambiare calendario a metà mescolerebbe lo storico
+        await update.message.reply_text("❌ Il campionato si sceglie prima della prima /estrai.")
+        return
+    store.apply({"type": "calendar_selected", "competizione": context.args[0], "stagione": context.args[1]})
+    await update.message.reply_text(f"🏆 Ora si gioca su {context.args[0]} {context.args[1]}.")
+
+
+# ====== ROSA DEL GRUPPO ======
+async def rosa(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    d = _store(update).data
+    r = roster(d)
+    if not r:
+        await update.message.reply_text("Nessun giocatore registrato. Usa /registra @username Nome.")
+        return
+    txt = "👥 Rosa del gruppo:\n"
+    for u, name in r.items():
+        star = " ⭐" if u in admins(d) else ""
+        txt += f"{u:<15} → {name}{star}\n"
+    await update.message.reply_text(txt)
+
+
+async def registra(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    caller = f"@{user.username}"
+    store = _store(update)
+    d = store.data
+    # il primo che registra in un gruppo senza admin ne diventa admin
+    bootstrap = not admins(d)
+    if not bootstrap and not is_admin(d, caller):
+        await update.message.reply_text("❌ Solo l'admin può registrare giocatori.")
+        return
+    args = context.args
+    if len(args) != 2 or not args[0].startswith("@"):
+        await update.message.reply_text("Formato: /registra @username Nome  (es: /registra @Chris4rda Chri)")
+        return
+    username, name = args
+    r = roster(d)
+    if name in r.values() and r.get(username) != name:
+        await update.message.reply_text(f"❌ Il nome {name} è già usato da un altro giocatore.")
+        return
+    if bootstrap:
+        store.apply({"type": "admin_added", "username": caller})
+    store.apply({"type": "player_registered", "username": username, "player": name})
+    extra = f"\n⭐ {caller} è admin del gruppo." if bootstrap else ""
+    await update.message.reply_text(f"✅ {username} registrato come {name}.{extra}")
+
+
+async def rimuovi(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    store = _store(update)
+    if not is_admin(store.data, f"@{user.username}"):
+        await update.message.reply_text("❌ Solo l'admin può rimuovere giocatori.")
+        return
+    if len(context.args) != 1 or context.args[0] not in roster(store.data):
+        await update.message.reply_text("Formato: /rimuovi @username (deve essere in /rosa)")
+        return
+    store.apply({"type": "player_removed", "username": context.args[0]})
+    await update.message.reply_text(f"🗑 {context.args[0]} rimosso dalla rosa (lo storico resta).")
+
+
+async def admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    store = _store(update)
+    if not is_admin(store.data, f"@{user.username}"):
+        await update.message.reply_text("❌ Solo un admin può nominare altri admin.")
+        return
+    if len(context.args) != 1 or not context.args[0].startswith("@"):
+        await update.message.reply_text("Formato: /admin @username")
+        return
+    store.apply({"type": "admin_added", "username": context.args[0]})
+    await update.message.reply_text(f"⭐ {context.args[0]} ora è admin del gruppo.")
+
+
+def build_app():
+    """Application con tutti gli handler (usata da main e dagli strumenti in tools/)."""
+    builder = (
+        ApplicationBuilder().token(TOKEN)
+        .application_class(InboxApplication)
+        .update_queue(InboxQueue(Inbox(INBOX_PATH), instrada=WORKER.instrada if WORKER is not None else None))
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .request(_CountingRequest(connection_pool_size=256))
+        .post_init(_post_init)
+        .post_stop(_post_stop)
+        .post_shutdown(_post_shutdown)
+        .persistence(StorePersistence(persistence_store))
+    )
+    if BOT_API_BASE_URL:
+        print(f"🧪 Bot API su {BOT_API_BASE_URL}", flush=True)
+        builder = builder.base_url(f"{BOT_API_BASE_URL}/bot").base_file_url(f"{BOT_API_BASE_URL}/file/bot")
+    app = builder.build()
+    # anche in privato: serve a chi vuole ricevere i solleciti in privato (vedi /sollecita)
+    app.add_handler(CommandHandler("start", handler(start, solo_gruppi=False)))
+    app.add_handler(CommandHandler("classifica", handler(classifica)))
+    app.add_handler(CommandHandler("jolly", handler(jolly)))
+    app.add_handler(CommandHandler("Jolly", handler(jolly)))  # alias
+    app.add_handler(CommandHandler("gioca", handler(gioca)))
+    app.add_handler(CommandHandler("modifica", handler(modifica)))
+    app.add_handler(CommandHandler("estrai", handler(estrai_cmd)))
+    app.add_handler(CommandHandler("inizio_giornata", handler(inizio_giornata_cmd)))
+    app.add_handler(CommandHandler("fine_giornata", handler(fine_giornata_cmd)))
+    app.add_handler(CommandHandler("esiti", handler(esiti_cmd)))
+    app.add_handler(CommandHandler("aggiorna", handler(esiti_cmd)))  # alias di /esiti
+    app.add_handler(CallbackQueryHandler(handler(esiti_cb), pattern="^esiti_"))
+    app.add_handler(CommandHandler("soldi", handler(soldi)))
+    app.add_handler(CommandHandler("versa", handler(versa)))
+    app.add_handler(CommandHandler("estratto", handler(estratto)))
+    app.add_handler(CommandHandler("esporta", handler(esporta)))
+    app.add_handler(CommandHandler("malloppo", handler(malloppo)))
+    app.add_handler(CommandHandler("giornate", handler(giornate)))
+    app.add_handler(CommandHandler("verifica", handler(verifica)))
+    app.add_handler(CommandHandler("risultati", handler(risultati)))
+    app.add_handler(CommandHandler("risultato", handler(risultato)))
+    app.add_handler(CommandHandler("regola", handler(regola)))
+    app.add_handler(CommandHandler("proiezione", handler(proiezione_cmd)))
+    app.add_handler(CommandHandler("statistiche", handler(statistiche)))
+    app.add_handler(CommandHandler("calendario", handler(calendario)))
+    app.add_handler(CommandHandler("campionato", handler(campionato)))
+    app.add_handler(CommandHandler("rosa", handler(rosa)))
+    app.add_handler(CommandHandler("registra", handler(registra)))
+    app.add_handler(CommandHandler("rimuovi", handler(rimuovi)))
+    app.add_handler(CommandHandler("admin", handler(admin_cmd)))
+    app.add_handler(CommandHandler("stato", handler(stato)))
+    app.add_handler(CommandHandler("sollecita", handler(sollecita_cmd)))
+    return app
+
+
 def main():
     print("BOT_TOKEN from env:", os.getenv("BOT_TOKEN"))
     print("TOKEN effettivo usato:", TOKEN)
     print("ENV BOT_TOKEN presente:", bool(os.getenv("BOT_TOKEN")), flush=True)
     print("TOKEN length:", len(TOKEN), flush=True)
-    app = ApplicationBuilder().token(TOKEN).build()
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("classifica", classifica))
-    app.add_handler(CommandHandler("jolly", jolly))
-    app.add_handler(CommandHandler("Jolly", jolly))  # alias
-    app.add_handler(CommandHandler("gioca", gioca))
-    app.add_handler(CommandHandler("modifica", modifica))
-    app.add_handler(CommandHandler("estrai", estrai_cmd))
-    app.add_handler(CommandHandler("inizio_giornata", inizio_giornata_cmd))
-    app.add_handler(CommandHandler("fine_giornata", fine_giornata_cmd))
-    app.add_handler(CommandHandler("esiti", esiti_cmd))
-    app.add_handler(CommandHandler("aggiorna", esiti_cmd))  # alias di /esiti
-    app.add_handler(CallbackQueryHandler(esiti_cb, pattern="^esiti_"))
-    app.add_handler(CommandHandler("soldi", soldi))
-    app.add_handler(CommandHandler("versa", versa))
-    app.add_handler(CommandHandler("malloppo", malloppo))
-    app.add_handler(CommandHandler("giornate", giornate))
+    if (WORKERS > 1 or WORKER_ID) and not WEBHOOK_URL:
+        # in polling Telegram accetta un solo getUpdates alla volta
+        raise SystemExit("❌ Più worker richiedono il webhook (WEBHOOK_URL)")
+    avviso = avviso_legacy()
+    if avviso:
+        print(avviso, file=sys.stderr, flush=True)
+    if WORKERS > 1 and not WORKER_ID:
+        print(f"👷 Avvio {WORKERS} worker sulla porta {os.environ.get('PORT', 8080)}", flush=True)
+        raise SystemExit(supervisiona(WORKERS, sys.argv))
+    AVVIO.fase("import")
+    app = build_app()
+    AVVIO.fase("app")
 
     if WEBHOOK_URL:
         print(f"🚀 Imposto webhook su: {WEBHOOK_URL}")
+        _add_metrics_route()
+        if WORKER is not None:
+            _webhook_reuse_port()
         app.run_webhook(
             listen="0.0.0.0",
             port=int(os.environ.get("PORT", 8080)),
             webhook_url=WEBHOOK_URL,
-            drop_pending_updates=True,
+            # ogni worker reimposta lo stesso webhook: un 429 di setWebhook si riprova
+            bootstrap_retries=-1 if WORKER is not None else 0,
         )
     else:
-        # ✅ PULIZIA: se c'è un webhook attivo lo cancelliamo con lo STESSO token in uso
-        import asyncio
-
-        async def _cleanup(bot):
-            info = await bot.get_webhook_info()
-            print("Webhook attuale:", info.url or "(nessuno)")
-            if info.url:
-                await bot.delete_webhook(drop_pending_updates=True)
-                print("Webhook cancellato.")
-
-        asyncio.get_event_loop().run_until_complete(_cleanup(app.bot))
-
+        # la pulizia del webhook gira in sottofondo durante l'inizializzazione (vedi _post_init)
+        if METRICS_PORT:
+            serve_metrics(int(METRICS_PORT))
+            print(f"📈 Metriche su :{METRICS_PORT}{METRICS_PATH}")
         print("▶️ Avvio in polling (WEBHOOK_URL non impostato)")
-        app.run_polling(drop_pending_updates=True)
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
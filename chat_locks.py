@@ -0,0 +1,61 @@
+from __future__ import annotations
+import asyncio, functools
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class KeyedLocks:
+    """
+    Un asyncio.Lock per chiave, creato al primo uso e rimosso quando nessuno lo aspetta più.
+    Gli acquirenti della stessa chiave vengono serviti in ordine FIFO (garanzia di asyncio.Lock).
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._waiters: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def busy(self, key: Hashable) -> bool:
+        """True se qualcuno tiene o aspetta il lock di key."""
+        return key in self._locks
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiters[key] -= 1
+            if self._waiters[key] == 0:
+                del self._waiters[key]
+                del self._locks[key]
+
+
+CHAT_LOCKS = KeyedLocks()
+
+
+def chat_key(update: Any) -> Hashable:
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "effective_user", None)
+    return ("user", user.id) if user is not None else None
+
+
+def per_chat(handler: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Serializza l'handler per chat: con concurrent_updates attivo, chat diverse
+    girano in parallelo ma gli update della stessa chat vengono eseguiti uno alla volta
+    (load → mutazione → riepilogo in pin restano atomici).
+    """
+    @functools.wraps(handler)
+    async def wrapper(update, context, *args, **kwargs):
+        async with CHAT_LOCKS.hold(chat_key(update)):
+            return await handler(update, context, *args, **kwargs)
+    return wrapper
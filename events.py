@@ -0,0 +1,287 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Set
+
+from model import QUOTA_PERSA_EUR, Bet, Giornata, Movimento, Player
+
+# Eventi tipizzati che descrivono ogni mutazione dello stato.
+# Ogni evento è un dict serializzabile {"type": ..., ...}; apply_event lo applica
+# al documento in memoria (vedi model.py) ed è deterministico, così il journal può essere
+# rigiocato sopra l'ultimo snapshot all'avvio.
+
+Event = Dict[str, Any]
+
+# Viste derivate dallo stato (testi di /classifica, /jolly, /soldi, /malloppo):
+# ogni evento dichiara quali invalida, così le altre restano in cache.
+ALL_VIEWS: FrozenSet[str] = frozenset({"classifica", "jolly", "soldi", "malloppo"})
+
+
+def flatten(event: Event) -> List[Event]:
+    """Gli eventi semplici contenuti in event (un "batch" ne contiene molti, applicati insieme)."""
+    return event["events"] if event["type"] == "batch" else [event]
+
+
+def touched_views(event: Event) -> FrozenSet[str]:
+    t = event["type"]
+    if t == "batch":
+        return frozenset().union(*(touched_views(e) for e in event["events"]))
+    if t == "bet_placed":
+        if not event["jolly"]:
+            return frozenset()
+        return ALL_VIEWS - {"classifica"} if event.get("penalty") else frozenset({"jolly"})
+    if t == "outcomes_applied":
+        return frozenset({"classifica", "soldi", "malloppo"})
+    if t == "payment_recorded":
+        return frozenset({"soldi"})
+    if t == "player_adjusted":
+        return ALL_VIEWS
+    if t in ("player_registered", "player_removed"):
+        return ALL_VIEWS
+    return frozenset()
+
+
+# Chiavi di primo livello del documento che ogni tipo di evento può cambiare
+# (applica_lotto ne copia solo quelle, SqliteStore le riscrive in "meta": vedi touched_keys)
+_CHIAVI: Dict[str, FrozenSet[str]] = {
+    "giornata_extracted": frozenset({"bets"}),
+    "giornata_imported": frozenset({"bets"}),
+    "status_changed": frozenset({"bets"}),
+    "bet_placed": frozenset({"bets", "players", "malloppo", "movimenti"}),
+    "bet_deleted": frozenset({"bets"}),
+    "bets_locked": frozenset({"bets"}),
+    "payment_recorded": frozenset({"players", "movimenti"}),
+    "player_adjusted": frozenset({"players", "movimenti"}),
+    "migration_applied": frozenset({"migrazioni"}),
+    "outcomes_applied": frozenset({"bets", "players", "malloppo", "movimenti"}),
+    "summary_updated": frozenset({"bets"}),
+    "player_registered": frozenset({"roster", "players"}),
+    "player_removed": frozenset({"roster"}),
+    "admin_added": frozenset({"admins"}),
+    "player_linked": frozenset({"user_ids"}),
+    "reminders_set": frozenset({"solleciti"}),
+    "calendar_selected": frozenset({"competizione", "stagione"}),
+    "results_recorded": frozenset({"bets"}),
+    "persistence_updated": frozenset({"persistenza"}),
+}
+
+
+def touched_keys(event: Event) -> Optional[FrozenSet[str]]:
+    """Chiavi di primo livello che l'evento cambia (update_applicati compreso); None se non si sa."""
+    keys: Set[str] = set()
+    for sub in flatten(event):
+        chiavi = _CHIAVI.get(sub["type"])
+        if chiavi is None:
+            return None
+        keys |= chiavi
+    if event.get("update_id") is not None:
+        keys.add("update_applicati")
+    return frozenset(keys)
+
+
+_APPLIERS: Dict[str, Callable[[Dict[str, Any], Event], None]] = {}
+
+
+def _applier(event_type: str):
+    def deco(fn):
+        _APPLIERS[event_type] = fn
+        return fn
+    return deco
+
+
+def _movimento(data: Dict[str, Any], ev: Event, giocatore: str, tipo: str, euro: int,
+               g: Any = None) -> None:
+    # registro in sola aggiunta dei movimenti di denaro (vedi ledger.py); senza giornata
+    # esplicita vale quella corrente, così un versamento cade tra due giornate
+    if g is None and data["bets"]:
+        g = max(map(int, data["bets"]))
+    data["movimenti"].append(Movimento(giocatore, tipo, euro, None if g is None else int(g),
+                                       ev.get("ts"), ev.get("da")))
+
+
+# Quanti update_id (gli ultimi) restano in data["update_applicati"]: vedi BaseStore.applied_update
+UPDATE_APPLICATI_MAX = 500
+
+
+def apply_event(data: Dict[str, Any], event: Event) -> None:
+    try:
+        fn = _APPLIERS[event["type"]]
+    except KeyError:
+        raise ValueError(f"Evento sconosciuto: {event.get('type')!r}")
+    fn(data, event)
+    update_id = event.get("update_id")
+    if update_id is not None:
+        # l'update che ha generato l'evento non va riapplicato se viene rigiocato dall'inbox
+        applicati = data.setdefault("update_applicati", [])
+        if update_id not in applicati:
+            applicati.append(update_id)
+            del applicati[:-UPDATE_APPLICATI_MAX]
+
+
+@_applier("batch")
+def _batch(data: Dict[str, Any], ev: Event) -> None:
+    # una sola riga di journal: dopo un crash o c'è tutto il lotto o niente (vedi game_utils.applica_lotto)
+    for sub in ev["events"]:
+        # ora e autore del lotto valgono per ogni suo evento (vedi BaseStore._stamp)
+        for k in ("ts", "da"):
+            if k in ev and k not in sub:
+                sub = dict(sub, **{k: ev[k]})
+        apply_event(data, sub)
+
+
+@_applier("giornata_extracted")
+def _giornata_extracted(data: Dict[str, Any], ev: Event) -> None:
+    data["bets"][ev["g"]] = Giornata(assignments=dict(ev["assignments"]), leftover=list(ev["leftover"]),
+                                     stagione=ev.get("stagione"))
+
+
+@_applier("giornata_imported")
+def _giornata_imported(data: Dict[str, Any], ev: Event) -> None:
+    # giornata storica già conclusa (import da CSV o migrazione): solo lo storico, i totali non cambiano
+    bets = data["bets"]
+    if ev["g"] in bets:
+        raise ValueError(f"la giornata {ev['g']} esiste già")
+    bets[ev["g"]] = Giornata(status="finished", settled=True, assignments=dict(ev.get("assignments", {})),
+                             bets={u: Bet.from_dict(b) for u, b in ev["bets"].items()})
+
+
+@_applier("status_changed")
+def _status_changed(data: Dict[str, Any], ev: Event) -> None:
+    giornata = data["bets"][ev["g"]]
+    giornata.status = ev["status"]
+    if ev["status"] == "finished":
+        giornata.settled = True
+
+
+@_applier("bet_placed")
+def _bet_placed(data: Dict[str, Any], ev: Event) -> None:
+    giornata = data["bets"][ev["g"]]
+    # tipo/dati_verifica: mercati riconosciuti dal testo (vedi markets.py), usati per l'esito automatico
+    giornata.bets[ev["username"]] = Bet(ev["giocata"], ev["quota"], ev["jolly"], None,
+                                        ev.get("tipo_verifica"), ev.get("dati_verifica"))
+    if ev["jolly"]:
+        player = data["players"][ev["player"]]
+        player.jolly_used = ev["jolly_used"]
+        penalty = ev.get("penalty", 0)
+        if penalty:
+            player.debt += penalty
+            data["malloppo"].penali_jolly += penalty
+            # resta anche se la giocata viene poi cancellata con /modifica (serve a /verifica)
+            giornata.penali[ev["username"]] = giornata.penali.get(ev["username"], 0) + penalty
+            _movimento(data, ev, ev["player"], "penale_jolly", penalty, ev["g"])
+
+
+@_applier("bet_deleted")
+def _bet_deleted(data: Dict[str, Any], ev: Event) -> None:
+    data["bets"][ev["g"]].bets.pop(ev["username"], None)
+
+
+@_applier("bets_locked")
+def _bets_locked(data: Dict[str, Any], ev: Event) -> None:
+    bloccate = data["bets"][ev["g"]].bloccate
+    bloccate.extend(u for u in ev["usernames"] if u not in bloccate)
+
+
+@_applier("payment_recorded")
+def _payment_recorded(data: Dict[str, Any], ev: Event) -> None:
+    data["players"][ev["player"]].paid += ev["euro"]
+    _movimento(data, ev, ev["player"], "versamento", ev["euro"])
+
+
+@_applier("player_adjusted")
+def _player_adjusted(data: Dict[str, Any], ev: Event) -> None:
+    # correzione esplicita (migrazioni): variazioni di punti/debito/versato con il motivo
+    player = data["players"][ev["player"]]
+    for k in ("points", "debt", "paid"):
+        if ev.get(k):
+            setattr(player, k, getattr(player, k) + ev[k])
+    if ev.get("debt"):
+        _movimento(data, ev, ev["player"], "rettifica_debito", ev["debt"])
+    if ev.get("paid"):
+        _movimento(data, ev, ev["player"], "rettifica_versato", ev["paid"])
+
+
+@_applier("migration_applied")
+def _migration_applied(data: Dict[str, Any], ev: Event) -> None:
+    data.setdefault("migrazioni", []).append(ev["id"])
+
+
+@_applier("outcomes_applied")
+def _outcomes_applied(data: Dict[str, Any], ev: Event) -> None:
+    bets = data["bets"][ev["g"]].bets
+    players = data["players"]
+    malloppo = data["malloppo"]
+    losers = set(ev["losers"])
+    for u, name in ev["roster"].items():
+        bet = bets.get(u)
+        if bet is None:
+            bet = bets[u] = Bet()
+        if u in losers:
+            bet.esito = "persa"
+            player = players[name]
+            player.points += 1
+            player.debt += QUOTA_PERSA_EUR
+            malloppo.giocate_sbagliate += QUOTA_PERSA_EUR
+            _movimento(data, ev, name, "persa", QUOTA_PERSA_EUR, ev["g"])
+        else:
+            bet.esito = "vinta"
+
+
+@_applier("summary_updated")
+def _summary_updated(data: Dict[str, Any], ev: Event) -> None:
+    giornata = data["bets"][ev["g"]]
+    for k in ("summary_message_id", "pinned_summary_id"):
+        if ev.get(k) is not None:
+            setattr(giornata, k, ev[k])
+
+
+@_applier("player_registered")
+def _player_registered(data: Dict[str, Any], ev: Event) -> None:
+    data.setdefault("roster", {})[ev["username"]] = ev["player"]
+    data["players"].setdefault(ev["player"], Player())
+
+
+@_applier("player_removed")
+def _player_removed(data: Dict[str, Any], ev: Event) -> None:
+    # lo storico (punti, debiti, giocate) resta in "players" e "bets"
+    data.get("roster", {}).pop(ev["username"], None)
+
+
+@_applier("admin_added")
+def _admin_added(data: Dict[str, Any], ev: Event) -> None:
+    admins = data.setdefault("admins", [])
+    if ev["username"] not in admins:
+        admins.append(ev["username"])
+
+
+@_applier("player_linked")
+def _player_linked(data: Dict[str, Any], ev: Event) -> None:
+    # user_id Telegram del giocatore, per scrivergli in privato (vedi /sollecita)
+    data.setdefault("user_ids", {})[ev["username"]] = ev["user_id"]
+
+
+@_applier("reminders_set")
+def _reminders_set(data: Dict[str, Any], ev: Event) -> None:
+    data["solleciti"] = ev["modo"]
+
+
+@_applier("calendar_selected")
+def _calendar_selected(data: Dict[str, Any], ev: Event) -> None:
+    data["competizione"] = ev["competizione"]
+    data["stagione"] = ev["stagione"]
+
+
+@_applier("results_recorded")
+def _results_recorded(data: Dict[str, Any], ev: Event) -> None:
+    # risultati finali delle partite della giornata: {"Inter-Torino": [2, 1], ...}
+    data["bets"][ev["g"]].risultati.update(ev["results"])
+
+
+@_applier("persistence_updated")
+def _persistence_updated(data: Dict[str, Any], ev: Event) -> None:
+    # chat_data / user_data / bot_data di PTB (vedi persistence.py); valore None = cancellato
+    persistenza = data.setdefault("persistenza", {})
+    for kind, key, value in ev["entries"]:
+        bucket = persistenza.setdefault(kind, {})
+        if value is None:
+            bucket.pop(key, None)
+        else:
+            bucket[key] = value
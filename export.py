@@ -0,0 +1,168 @@
+"""
+Esportazione dello storico di un gruppo: assegnazioni, giocate, esiti e movimenti di denaro,
+in CSV o JSONL. Le righe escono da un generatore e finiscono a blocchi in un file temporaneo
+"spooled" (in RAM fino a ESPORTA_SPOOL_BYTES, poi su disco), così la memoria resta piatta
+qualunque sia la lunghezza dello storico. Usato da /esporta e da riga di comando:
+
+    python export.py                                  # tutti i gruppi, un file ciascuno
+    python export.py -1001234567890 --formato jsonl --stagione 2025-26
+    python export.py data.json gruppi/-100123/data.sqlite -o storico.csv
+"""
+from __future__ import annotations
+import argparse, csv, io, json, os, tempfile
+from datetime import datetime, timezone
+from typing import IO, Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from schedule import DEFAULT_SEASON
+
+FORMATI = ("csv", "jsonl")
+# Oltre questa dimensione il file temporaneo passa dalla RAM al disco
+SPOOL_BYTES = int(os.getenv("ESPORTA_SPOOL_BYTES", str(1 << 20)))
+# Le righe vengono accumulate in testo e scritte nel file a blocchi di circa questa dimensione
+_BLOCCO = 64 * 1024
+
+# Colonne di ogni riga, nell'ordine del CSV. "tipo" è "giocata" per le righe delle giornate
+# (assegnazione, giocata ed esito di un giocatore) oppure il tipo del movimento di denaro.
+CAMPI = ("chat_id", "tipo", "stagione", "giornata", "stato", "username", "giocatore", "partita",
+         "risultato", "giocata", "quota", "jolly", "esito", "euro", "ts", "da")
+
+
+def _stagione_default(data: Dict[str, Any]) -> str:
+    # giornate estratte prima che venisse registrata la stagione: quella scelta con /campionato
+    return data.get("stagione") or DEFAULT_SEASON
+
+
+def righe(data: Dict[str, Any], chat_id: Hashable, stagione: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Righe dello storico del gruppo, giornata per giornata e poi i movimenti (solo la stagione indicata)."""
+    default = _stagione_default(data)
+    rosa = data.get("roster", {})
+    nomi = {name: u for u, name in rosa.items()}
+    stagioni: Dict[int, str] = {}
+    for key in sorted(data["bets"], key=int):
+        g = data["bets"][key]
+        st = stagioni[int(key)] = g.stagione or default
+        if stagione is not None and st != stagione:
+            continue
+        base = {"chat_id": chat_id, "tipo": "giocata", "stagione": st, "giornata": int(key), "stato": g.status}
+        visti = set()
+        for name, partita in g.assignments.items():
+            u = nomi.get(name)
+            visti.add(u)
+            yield _riga_giocata(base, g, u, name, partita)
+        # giocate senza assegnazione (storiche importate) o di chi nel frattempo è uscito dalla rosa
+        for u in g.bets:
+            if u not in visti:
+                yield _riga_giocata(base, g, u, rosa.get(u), None)
+    for m in data["movimenti"]:
+        st = stagioni.get(m.giornata) if m.giornata is not None else None
+        if stagione is not None and st != stagione:
+            continue
+        yield {"chat_id": chat_id, "tipo": m.tipo, "stagione": st, "giornata": m.giornata,
+               "username": nomi.get(m.giocatore), "giocatore": m.giocatore, "euro": m.euro,
+               "ts": datetime.fromtimestamp(m.ts, timezone.utc).isoformat() if m.ts is not None else None,
+               "da": m.da}
+
+
+def _riga_giocata(base: Dict[str, Any], g, u: Optional[str], name: Optional[str],
+                  partita: Optional[str]) -> Dict[str, Any]:
+    riga = dict(base, username=u, giocatore=name, partita=partita)
+    ris = g.risultati.get(partita) if partita else None
+    if ris is not None:
+        riga["risultato"] = f"{ris[0]}-{ris[1]}"
+    bet = g.bets.get(u) if u else None
+    if bet is not None:
+        riga.update(giocata=bet.giocata, quota=bet.quota, jolly=bet.jolly, esito=bet.esito)
+    return riga
+
+
+def scrivi(out: IO[bytes], gruppi: Iterator[Dict[str, Any]], formato: str) -> int:
+    """Scrive le righe in out (binario) a blocchi; ritorna quante righe ha scritto."""
+    buf = io.StringIO()
+    writer = None
+    if formato == "csv":
+        writer = csv.DictWriter(buf, fieldnames=CAMPI, lineterminator="\n")
+        writer.writeheader()
+    n = 0
+    for riga in gruppi:
+        if writer is not None:
+            writer.writerow(riga)
+        else:
+            buf.write(json.dumps({k: riga.get(k) for k in CAMPI}, ensure_ascii=False))
+            buf.write("\n")
+        n += 1
+        if buf.tell() >= _BLOCCO:
+            out.write(buf.getvalue().encode("utf-8"))
+            buf.seek(0)
+            buf.truncate()
+    out.write(buf.getvalue().encode("utf-8"))
+    return n
+
+
+def spool(data: Dict[str, Any], chat_id: Hashable, formato: str = "csv",
+          stagione: Optional[str] = None) -> Tuple[IO[bytes], int]:
+    """(file temporaneo su disco riavvolto, righe scritte) con lo storico del gruppo; il chiamante lo chiude."""
+    f = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, mode="w+b")
+    n = scrivi(f, righe(data, chat_id, stagione), formato)
+    # anche se è piccolo va su disco: l'upload di PTB vuole un file vero, un buffer in RAM non ha nome
+    f.rollover()
+    f.seek(0)
+    return f, n
+
+
+def nome_file(chat_id: Hashable, formato: str, stagione: Optional[str] = None) -> str:
+    return f"storico_{chat_id}_{stagione or 'tutto'}.{formato}"
+
+
+def _gruppi(stati: List[str], stagione: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Righe di più gruppi, aprendone uno alla volta e chiudendolo prima del successivo."""
+    from migrate import apri
+    for stato in stati:
+        chat_id, path = _risolvi(stato)
+        store = apri(path)
+        try:
+            yield from righe(store.data, chat_id, stagione)
+        finally:
+            store.close()
+
+
+def _risolvi(stato: str) -> Tuple[Hashable, str]:
+    """(chat_id, percorso) da un chat_id o dal percorso di un data.json / data.sqlite."""
+    from game_utils import DATA_PATH, LEGACY_CHAT_ID, SHARDS
+    if not os.path.exists(stato) and stato.lstrip("-").isdigit():
+        return int(stato), SHARDS.path_for(int(stato))
+    if LEGACY_CHAT_ID and os.path.abspath(stato) == DATA_PATH:
+        return int(LEGACY_CHAT_ID), stato
+    # gruppi/<chat_id>/data.json: il chat_id è il nome della cartella
+    cartella = os.path.basename(os.path.dirname(os.path.abspath(stato)))
+    return (int(cartella) if cartella.lstrip("-").isdigit() else cartella), stato
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Esporta lo storico dei gruppi in CSV o JSONL")
+    ap.add_argument("gruppi", nargs="*", help="chat_id o percorsi di data.json / data.sqlite (default: tutti)")
+    ap.add_argument("--formato", choices=FORMATI, default="csv")
+    ap.add_argument("--stagione", help="solo le giornate di questa stagione (es. 2025-26)")
+    ap.add_argument("-o", "--output", help="un unico file con tutti i gruppi (default: un file per gruppo)")
+    ap.add_argument("--cartella", default=".", help="dove scrivere i file per gruppo")
+    args = ap.parse_args()
+
+    stati = args.gruppi
+    if not stati:
+        from game_utils import SHARDS, group_chat_ids
+        stati = [str(c) for c in group_chat_ids() if os.path.exists(SHARDS.path_for(c))]
+    if args.output:
+        with open(args.output, "wb") as f:
+            n = scrivi(f, _gruppi(stati, args.stagione), args.formato)
+        print(f"✅ {args.output}: {n} righe da {len(stati)} gruppi")
+        return
+    os.makedirs(args.cartella, exist_ok=True)
+    for stato in stati:
+        chat_id, _ = _risolvi(stato)
+        path = os.path.join(args.cartella, nome_file(chat_id, args.formato, args.stagione))
+        with open(path, "wb") as f:
+            n = scrivi(f, _gruppi([stato], args.stagione), args.formato)
+        print(f"✅ {path}: {n} righe")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,196 @@
 from __future__ import annotations
-import json, os, random
-from typing import Any, Dict, List, Optional, Tuple
+import copy, os, random
+from typing import Any, Dict, Hashable, List, Optional, Tuple
 
-# Nomi "umani" dei giocatori (coerenti con data.json)
-PLAYERS: List[str] = ["Chri", "Gabbo", "Pavi", "Fruca", "Effe", "Gargiu", "Gio"]
+from chat_locks import CHAT_LOCKS
+from events import QUOTA_PERSA_EUR, Event, apply_event, flatten, touched_keys
+from metrics import METRICS
+from model import CREDITI, Player, new_group
+from schedule import Calendar, ScheduleService
+from shards import ShardManager
+from sqlite_store import SqliteStore
+from state_store import BaseStore, StateStore
+from workers import WORKER_ID, Coordinator
 
 _BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_PATH = os.path.join(_BASE_DIR, "data.json")
 SCHEDULE_PATH = os.path.join(_BASE_DIR, "giornate.json")
 
+# Ogni gruppo ha la sua cartella <SHARDS_DIR>/<chat_id>/ con data.json (e volendo giornate.json)
+SHARDS_DIR = os.getenv("SHARDS_DIR", os.path.join(_BASE_DIR, "gruppi"))
+# Il gruppo storico continua a usare data.json nella root del progetto
+LEGACY_CHAT_ID = os.getenv("LEGACY_CHAT_ID")
+# Quanti gruppi tenere in memoria al massimo (LRU)
+MAX_LOADED_SHARDS = int(os.getenv("MAX_LOADED_SHARDS", "256"))
+# "json" (data.json + journal) oppure "sqlite" (data.sqlite, importabile con `python sqlite_store.py`)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+# Database di coordinamento dei worker (solo con WORKER_ID impostato, vedi workers.py)
+WORKERS_DB = os.getenv("WORKERS_DB", os.path.join(SHARDS_DIR, "workers.sqlite"))
 
-def load_data() -> Dict[str, Any]:
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+# Rosa e admin del gruppo storico, usati solo per inizializzare un data.json che non li ha ancora.
+# I gruppi nuovi registrano i giocatori con /registra.
+LEGACY_ROSTER: Dict[str, str] = {
+    "@Federico_Lolli": "Effe",
+    "@Federico9499": "Fruca",
+    "@agggg21": "Gargiu",
+    "@BTC_TonyStark": "Gabbo",
+    "@TheBu7cher": "Pavi",
+    "@Chris4rda": "Chri",
+    "@JoLaFlame": "Gio"
+}
+LEGACY_ADMINS: List[str] = ["@BTC_TonyStark"]
+LEGACY = {"roster": LEGACY_ROSTER, "admins": LEGACY_ADMINS}
 
 
-def save_data(data: Dict[str, Any]) -> None:
-    with open(DATA_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+def avviso_legacy() -> Optional[str]:
+    """Avviso se c'è il data.json del gruppo storico ma LEGACY_CHAT_ID non dice di quale chat è."""
+    if LEGACY_CHAT_ID or not os.path.exists(DATA_PATH):
+        return None
+    return (f"⚠️⚠️ {DATA_PATH} esiste ma LEGACY_CHAT_ID non è impostato: lo stato del gruppo storico "
+            "NON viene usato. Quel gruppo ripartirebbe vuoto e il primo che fa /registra ne diventerebbe "
+            "admin. Imposta LEGACY_CHAT_ID con il chat_id del gruppo (o sposta il file in "
+            f"{os.path.join(SHARDS_DIR, '<chat_id>')}/).")
 
 
-def load_schedule() -> Dict[str, List[str]]:
-    with open(SCHEDULE_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+def _is_legacy(chat_id: Hashable) -> bool:
+    return LEGACY_CHAT_ID is not None and str(chat_id) == LEGACY_CHAT_ID
+
+
+def _shard_dir(chat_id: Hashable) -> str:
+    return _BASE_DIR if _is_legacy(chat_id) else os.path.join(SHARDS_DIR, str(chat_id))
+
+
+_BACKENDS = {"json": ("data.json", StateStore), "sqlite": ("data.sqlite", SqliteStore)}
+_DATA_FILE, _STORE_CLASS = _BACKENDS[STORAGE_BACKEND]
+
+# Con più worker ognuno scrive solo le chat di cui è proprietario (e il suo shard di persistenza)
+WORKER: Optional[Coordinator] = Coordinator(WORKERS_DB, WORKER_ID) if WORKER_ID else None
+# Shard non legato a un gruppo: chat_data/user_data/bot_data di PTB (vedi persistence.py), uno per worker
+PERSISTENZA_KEY = f"bot-{WORKER_ID}" if WORKER_ID else "bot"
+
+
+def _may_write(chat_id: Hashable) -> bool:
+    return WORKER is None or chat_id == PERSISTENZA_KEY or WORKER.mia(chat_id)
+
+
+SHARDS = ShardManager(
+    path_for=lambda chat_id: os.path.join(_shard_dir(chat_id), _DATA_FILE),
+    default=new_group,
+    max_loaded=MAX_LOADED_SHARDS,
+    store_factory=lambda path, default: _STORE_CLASS(path, default=default, legacy=LEGACY),
+    is_busy=CHAT_LOCKS.busy,
+    may_write=_may_write,
+)
+
+
+def _state_file_bytes() -> int:
+    total = 0
+    for store in SHARDS:
+        journal = getattr(store, "journal", None)
+        # snapshot + journal (json) oppure database + WAL (sqlite)
+        for p in (store.path, store.path + "-wal", journal.path if journal else None):
+            if p and os.path.exists(p):
+                total += os.path.getsize(p)
+    return total
+
+
+METRICS.add_gauge("bot_state_file_bytes", "Dimensione su disco dello stato dei gruppi caricati.", _state_file_bytes)
+METRICS.add_gauge("bot_shards_loaded", "Gruppi con lo stato in memoria.", lambda: len(SHARDS))
+METRICS.add_gauge("bot_shard_evictions", "Gruppi scaricati dalla memoria (LRU) dall'avvio.", lambda: SHARDS.evictions)
+
+
+def persistence_store() -> BaseStore:
+    return SHARDS.get(PERSISTENZA_KEY)
+
+
+def group_chat_ids() -> List[Hashable]:
+    """chat_id dei gruppi che hanno uno stato su disco (senza caricarli)."""
+    ids: List[Hashable] = [int(LEGACY_CHAT_ID)] if LEGACY_CHAT_ID else []
+    if os.path.isdir(SHARDS_DIR):
+        for name in os.listdir(SHARDS_DIR):
+            if name.lstrip("-").isdigit() and os.path.isdir(os.path.join(SHARDS_DIR, name)):
+                ids.append(int(name))
+    return ids
+
+
+@METRICS.timed("get_store")
+def get_store(chat_id: Hashable) -> BaseStore:
+    """Stato del gruppo chat_id (caricato alla prima richiesta)."""
+    # un data.json storico senza rosa la riceve da LEGACY prima dell'aggiornamento dello schema
+    return SHARDS.get(chat_id)
+
+
+@METRICS.timed("load_data")
+def load_data(chat_id: Hashable) -> Dict[str, Any]:
+    """Ritorna lo stato in memoria del gruppo (lo stesso oggetto a ogni chiamata)."""
+    return get_store(chat_id).data
+
+
+@METRICS.timed("save_data")
+def save_data(chat_id: Hashable, data: Dict[str, Any]) -> None:
+    """
+    Marca lo stato del gruppo come da salvare dopo modifiche fatte a mano sul dict.
+    Le mutazioni normali passano da store.apply() e finiscono nel journal.
+    """
+    store = get_store(chat_id)
+    if data is not store.data:
+        store.replace(data)
+    else:
+        store.mark_dirty()
+
+
+def roster(data: Dict[str, Any]) -> Dict[str, str]:
+    """Mappa '@username' -> 'Nome' dei giocatori del gruppo."""
+    return data.get("roster", {})
+
+
+def admins(data: Dict[str, Any]) -> List[str]:
+    return data.get("admins", [])
+
+
+# Calendari caricati una volta e riletti solo quando il file cambia
+SCHEDULES = ScheduleService()
+
+
+def schedule_path_for(store: Optional[BaseStore] = None) -> str:
+    if store is not None:
+        own = os.path.join(os.path.dirname(store.path), "giornate.json")
+        if os.path.exists(own):
+            return own
+    return SCHEDULE_PATH
+
+
+def schedule_for(store: Optional[BaseStore] = None) -> Calendar:
+    """
+    Calendario del gruppo: il suo giornate.json se ce l'ha, altrimenti quello comune,
+    nella competizione/stagione scelta con /campionato (default: quella del file).
+    """
+    data = store.data if store is not None else {}
+    return SCHEDULES.calendar(schedule_path_for(store), data.get("competizione"), data.get("stagione"))
+
+
+def load_schedule(store: Optional[BaseStore] = None) -> Dict[str, List[str]]:
+    return schedule_for(store).giornate
 
 
 def next_giornata(data: Dict[str, Any]) -> int:
-    g = data.get("giornate", [])
-    if isinstance(g, list):
-        return len(g) + 1
-    if isinstance(g, dict):
-        return (max(map(int, g.keys())) + 1) if g else 1
-    return 1
-
-
-def estrai_partite() -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
-    data = load_data()
-    schedule = load_schedule()
-
-    bets = data.get("bets", {})
-    if bets:
-        last_key = max(int(k) for k in bets.keys())
-        last_entry = bets[str(last_key)]
-        if last_entry.get("status", "finished") != "finished":
+    bets = data["bets"]
+    return (max(map(int, bets)) + 1) if bets else 1
+
+
+def estrai_partite(store: BaseStore) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    data = store.data
+    cal = schedule_for(store)
+    schedule = cal.giornate
+    players = list(roster(data).values())
+    if not players:
+        return None, "Nessun giocatore registrato. Usa /registra @username Nome."
+
+    bets = data["bets"]
+    last = store.current_giornata()
+    if last is not None:
+        last_key = int(last)
+        if bets[last].status != "finished":
             return None, (f"Non puoi estrarre finché la G{last_key} non è conclusa con /fine_giornata.")
 
     g_num = next_giornata(data)
@@ -54,92 +202,268 @@ def estrai_partite() -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
         return None, f"La giornata {g_num} è già stata estratta."
 
     matches = schedule[g_key]
-    if len(matches) < len(PLAYERS):
+    if len(matches) < len(players):
         return None, f"Nella G{g_num} non ci sono abbastanza partite per tutti."
 
-    selected = random.sample(matches, len(PLAYERS))
-    shuffled = PLAYERS.copy()
-    random.shuffle(shuffled)
-    assignments = {p: m for p, m in zip(shuffled, selected)}
-    leftover = [m for m in matches if m not in selected]
+    # assegnazione equa: poche squadre ripetute e partite difficili distribuite (vedi assignment.py);
+    # numpy si importa qui, al primo /estrai, e non all'avvio del bot
+    import numpy as np
+    from assignment import assegna
+    rng = np.random.default_rng(random.getrandbits(64))
+    assignments = assegna(players, matches, data, rng=rng)
+    chosen = set(assignments.values())
+    leftover = [m for m in matches if m not in chosen]
 
-    bets[g_key] = {
+    store.apply({
+        "type": "giornata_extracted",
+        "g": g_key,
         "assignments": assignments,
         "leftover": leftover,
-        "bets": {},               # qui si accumulano le /gioca
-        "status": "assigned",
-        "settled": False
-    }
-    data["bets"] = bets
-
-    if isinstance(data.get("giornate"), list):
-        data["giornate"].append(g_num)
-    else:
-        data.setdefault("giornate", {})[g_key] = {}
-
-    save_data(data)
+        "stagione": cal.season
+    })
     return {"giornata": g_num, "assignments": assignments, "leftover": leftover}, None
 
 
-def inizio_giornata() -> Tuple[Optional[int], Optional[str]]:
-    data = load_data()
-    bets = data.get("bets", {})
-    if not bets:
+def inizio_giornata(store: BaseStore) -> Tuple[Optional[int], Optional[str]]:
+    last = store.current_giornata()
+    if last is None:
         return None, "Nessuna giornata estratta. Usa /estrai prima."
-    last_key = max(int(k) for k in bets.keys())
-    entry = bets[str(last_key)]
-    s = entry.get("status", "finished")
+    last_key = int(last)
+    s = store.data["bets"][last].status
     if s == "assigned":
-        entry["status"] = "started"
-        save_data(data)
+        store.apply({"type": "status_changed", "g": str(last_key), "status": "started"})
         return last_key, None
     if s == "started":
         return None, f"La giornata {last_key} è già in corso."
     return None, f"La giornata {last_key} è già stata conclusa."
 
 
-def fine_giornata() -> Tuple[Optional[int], Optional[str]]:
-    data = load_data()
-    bets = data.get("bets", {})
-    if not bets:
+def fine_giornata(store: BaseStore) -> Tuple[Optional[int], Optional[str]]:
+    last = store.current_giornata()
+    if last is None:
         return None, "Nessuna giornata estratta. Usa /estrai prima."
-    last_key = max(int(k) for k in bets.keys())
-    entry = bets[str(last_key)]
-    s = entry.get("status", "finished")
+    last_key = int(last)
+    s = store.data["bets"][last].status
     if s == "started":
-        entry["status"] = "finished"
-        entry["settled"] = True
-        save_data(data)
+        store.apply({"type": "status_changed", "g": str(last_key), "status": "finished"})
         return last_key, None
     if s == "assigned":
         return None, f"La G{last_key} non è ancora iniziata. Usa /inizio_giornata prima."
     return None, f"La giornata {last_key} è già stata conclusa."
 
 
-def applica_esiti_manuali(g_key: str, losers_usernames: List[str], username_to_name: Dict[str, str]) -> None:
+def applica_esiti_manuali(store: BaseStore, g_key: str, losers_usernames: List[str],
+                          username_to_name: Dict[str, str], da: Optional[str] = None) -> None:
     """
     Aggiorna punti, debiti, malloppo e marca 'vinta/persa' per l'ultima giornata finita.
     Parametri:
+      - store: stato del gruppo
       - g_key: stringa numero giornata (es. "2")
       - losers_usernames: elenco '@username' che hanno perso
       - username_to_name: mappa '@user' -> 'Nome'
+      - da: '@username' dell'admin, registrato nei movimenti di denaro
     """
-    data = load_data()
-    if "bets" not in data or g_key not in data["bets"]:
+    if g_key not in store.data["bets"]:
         raise ValueError("Giornata inesistente.")
 
-    giornata = data["bets"][g_key]
-    giornata.setdefault("bets", {})
-    for u, name in username_to_name.items():
-        giornata["bets"].setdefault(u, {"giocata": "(nessuna)", "quota": 0.0, "jolly": False})
-
-        if u in losers_usernames:
-            giornata["bets"][u]["esito"] = "persa"
-            player_name = username_to_name[u]
-            data["players"][player_name]["points"] += 1
-            data["players"][player_name]["debt"] = data["players"][player_name].get("debt", 0) + 5
-            data["malloppo"]["giocate_sbagliate"] += 5
-        else:
-            giornata["bets"][u]["esito"] = "vinta"
-
-    save_data(data)
+    event = {
+        "type": "outcomes_applied",
+        "g": g_key,
+        "losers": list(losers_usernames),
+        "roster": dict(username_to_name)
+    }
+    if da is not None:
+        event["da"] = da
+    store.apply(event)
+
+
+# Violazione di un invariante dei totali: (soggetto, campo, atteso, trovato)
+Violazione = Tuple[str, str, int, int]
+
+# Controlli sui totali salvati: campo -> (attributo di Player/Malloppo, da dove si ricalcola, unità)
+_CONTROLLI: Dict[str, Tuple[str, str, str]] = {
+    "punti": ("points", "lo storico", ""),
+    "debito": ("debt", "lo storico", "€"),
+    "debito (registro)": ("debt", "il registro", "€"),
+    "versato (registro)": ("paid", "il registro", "€"),
+    "giocate sbagliate": ("giocate_sbagliate", "lo storico", "€"),
+    "penali jolly": ("penali_jolly", "lo storico", "€"),
+}
+_CAMPI_GIOCATORE = ("punti", "debito", "debito (registro)", "versato (registro)")
+_CAMPI_MALLOPPO = ("giocate sbagliate", "penali jolly")
+MALLOPPO = "Malloppo"
+
+
+def _somma(out: Dict[Tuple[str, str], int], soggetto: str, campo: str, euro: int) -> None:
+    out[soggetto, campo] = out.get((soggetto, campo), 0) + euro
+
+
+def _dallo_storico(data: Dict[str, Any], giornate) -> Dict[Tuple[str, str], int]:
+    """Punti, debiti e malloppo ricalcolati dalle giocate delle giornate indicate."""
+    username_to_name = roster(data)
+    out: Dict[Tuple[str, str], int] = {}
+    for g_key in giornate:
+        g = data["bets"].get(g_key)
+        if g is None:
+            continue
+        for u, b in g.bets.items():
+            if b.esito == "persa":
+                name = username_to_name.get(u, u)
+                _somma(out, name, "punti", 1)
+                _somma(out, name, "debito", QUOTA_PERSA_EUR)
+                _somma(out, MALLOPPO, "giocate sbagliate", QUOTA_PERSA_EUR)
+        for u, eur in g.penali.items():
+            _somma(out, username_to_name.get(u, u), "debito", eur)
+            _somma(out, MALLOPPO, "penali jolly", eur)
+    return out
+
+
+def _dal_registro(movimenti) -> Dict[Tuple[str, str], int]:
+    out: Dict[Tuple[str, str], int] = {}
+    for mov in movimenti:
+        _somma(out, mov.giocatore, "versato (registro)" if mov.tipo in CREDITI else "debito (registro)", mov.euro)
+    return out
+
+
+def _salvato(data: Dict[str, Any], soggetto: str, campo: str) -> int:
+    obj = data["malloppo"] if campo in _CAMPI_MALLOPPO else data["players"].get(soggetto, Player())
+    return getattr(obj, _CONTROLLI[campo][0])
+
+
+def _aggregati(data: Dict[str, Any]) -> List[Violazione]:
+    attesi = _dallo_storico(data, list(data["bets"]))
+    attesi.update(_dal_registro(data["movimenti"]))
+    names = set(data["players"]) | {s for s, c in attesi if c in _CAMPI_GIOCATORE}
+    out = []
+    for soggetto, campi in [(n, _CAMPI_GIOCATORE) for n in sorted(names)] + [(MALLOPPO, _CAMPI_MALLOPPO)]:
+        for campo in campi:
+            atteso, trovato = attesi.get((soggetto, campo), 0), _salvato(data, soggetto, campo)
+            if atteso != trovato:
+                out.append((soggetto, campo, atteso, trovato))
+    return out
+
+
+def descrivi(v: Violazione) -> str:
+    """Testo leggibile di una violazione, es. "Chri: punti 2 ma lo storico dice 1"."""
+    soggetto, campo, atteso, trovato = v
+    if campo.endswith(" negativo"):
+        return f"{soggetto}: {campo} ({trovato})"
+    _, fonte, unita = _CONTROLLI[campo]
+    return f"{soggetto}: {campo.split(' (')[0]} {trovato}{unita} ma {fonte} dice {atteso}{unita}"
+
+
+def verifica_aggregati(data: Dict[str, Any]) -> List[str]:
+    """
+    Ricalcola punti, debiti e malloppo dallo storico delle giocate e li confronta con i totali
+    salvati. Ritorna l'elenco delle differenze (vuoto se tutto torna).
+    Punti = giocate perse; debito = 5€ a giocata persa + penali jolly; i versamenti
+    e le giocate di gruppo non sono ricostruibili dallo storico e non vengono controllati.
+    Debito e versato devono inoltre tornare con il registro dei movimenti.
+    """
+    return [descrivi(v) for v in _aggregati(data)]
+
+
+def _negativi(soggetto: str, obj: Any, attributi) -> List[Violazione]:
+    return [(soggetto, f"{k} negativo", 0, getattr(obj, k)) for k in attributi if getattr(obj, k) < 0]
+
+
+def _non_negativi(data: Dict[str, Any], soggetto: str) -> List[Violazione]:
+    if soggetto == MALLOPPO:
+        return _negativi(MALLOPPO, data["malloppo"], data["malloppo"].to_dict())
+    p = data["players"].get(soggetto)
+    return [] if p is None else _negativi(soggetto, p, ("points", "debt", "paid"))
+
+
+def invarianti(data: Dict[str, Any]) -> List[Violazione]:
+    """Violazioni degli invarianti dei totali: quelle di verifica_aggregati più valori negativi."""
+    out = _aggregati(data)
+    for soggetto in list(data["players"]) + [MALLOPPO]:
+        out += _non_negativi(data, soggetto)
+    return out
+
+
+def _giornate(events: List[Event]) -> Optional[set]:
+    """Giornate che gli eventi possono cambiare; None se tra questi c'è un evento che non si sa."""
+    out = set()
+    for ev in events:
+        for sub in flatten(ev):
+            keys = touched_keys(sub)
+            if keys is None or ("bets" in keys and "g" not in sub):
+                return None
+            if "bets" in keys:
+                out.add(sub["g"])
+    return out
+
+
+def _copia_per(data: Dict[str, Any], events: List[Event], giornate: set) -> Dict[str, Any]:
+    # copia su cui provare il lotto: solo le chiavi (e le giornate) che gli eventi cambiano;
+    # il registro dei movimenti è in sola aggiunta e basta copiarne l'elenco
+    prova = dict(data)
+    for key in frozenset().union(*(touched_keys(ev) for ev in events)):
+        if key == "movimenti":
+            prova[key] = list(data[key])
+        elif key == "bets":
+            prova[key] = dict(data[key])
+            for g in giornate & set(data[key]):
+                prova[key][g] = copy.deepcopy(data[key][g])
+        elif key in data:
+            prova[key] = copy.deepcopy(data[key])
+    return prova
+
+
+def _violazioni_nuove(prima: Dict[str, Any], dopo: Dict[str, Any], giornate: Optional[set]) -> List[Violazione]:
+    """
+    Violazioni che il lotto introduce: per ogni (soggetto, campo) la differenza tra totale
+    salvato e ricalcolato non deve cambiare (una differenza già presente resta tollerata, una
+    nuova sullo stesso soggetto no). Si guardano solo i giocatori, le giornate e i movimenti
+    toccati; lo stato intero si rilegge solo per descrivere le violazioni trovate.
+    """
+    if giornate is None or roster(prima) != roster(dopo):
+        # eventi sconosciuti o rosa cambiata (lo storico intero cambia giocatore): confronto completo
+        vecchie = {(s, c, t - a) for s, c, a, t in invarianti(prima)}
+        return [v for v in invarianti(dopo) if (v[0], v[1], v[3] - v[2]) not in vecchie]
+    delta: Dict[Tuple[str, str], int] = {}
+    for lato, segno in ((prima, 1), (dopo, -1)):
+        for k, v in _dallo_storico(lato, giornate).items():
+            delta[k] = delta.get(k, 0) + segno * v
+    for k, v in _dal_registro(dopo["movimenti"][len(prima["movimenti"]):]).items():
+        delta[k] = delta.get(k, 0) - v
+    toccati = [(n, _CAMPI_GIOCATORE) for n in set(prima["players"]) | set(dopo["players"])
+               if prima["players"].get(n) != dopo["players"].get(n)]
+    if prima["malloppo"] != dopo["malloppo"]:
+        toccati.append((MALLOPPO, _CAMPI_MALLOPPO))
+    for soggetto, campi in toccati:
+        for campo in campi:
+            delta[soggetto, campo] = (delta.get((soggetto, campo), 0) + _salvato(dopo, soggetto, campo)
+                                      - _salvato(prima, soggetto, campo))
+    sospetti = {k for k, v in delta.items() if v}
+    for soggetto, _ in toccati:
+        vecchi = set(_non_negativi(prima, soggetto))
+        sospetti |= {(s, c) for s, c, a, t in _non_negativi(dopo, soggetto) if (s, c, a, t) not in vecchi}
+    if not sospetti:
+        return []
+    return [v for v in invarianti(dopo) if (v[0], v[1]) in sospetti]
+
+
+def applica_lotto(store: BaseStore, events: List[Event], dry_run: bool = False) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Applica molti eventi come una sola transazione (un evento "batch": una riga di journal,
+    o una transazione SQLite). Prima li prova su una copia delle parti di stato che toccano:
+    se uno fallisce o il risultato viola invarianti che prima erano rispettati non viene
+    applicato niente. Ritorna (eventi applicati, None) oppure (None, errore).
+    """
+    if not events:
+        return 0, None
+    giornate = _giornate(events)
+    prova = copy.deepcopy(store.data) if giornate is None else _copia_per(store.data, events, giornate)
+    for i, ev in enumerate(events, 1):
+        try:
+            apply_event(prova, ev)
+        except (KeyError, ValueError, TypeError) as e:
+            return None, f"Operazione {i} ({ev.get('type')}) non valida: {e}"
+    nuove = _violazioni_nuove(store.data, prova, giornate)
+    if nuove:
+        return None, "Invarianti violati:\n" + "\n".join(f"- {descrivi(v)}" for v in nuove)
+    if not dry_run:
+        store.apply({"type": "batch", "events": events})
+    return len(events), None
@@ -0,0 +1,137 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from model import Giornata
+
+# Valori della colonna esito
+PERSA, VINTA = 1, 0
+
+
+class BetHistory:
+    """
+    Storico delle giocate regolate in colonne NumPy (una riga per giocata):
+    giornata, giocatore (id), quota, jolly, esito. Le colonne crescono per raddoppio,
+    così append() costa O(1) ammortizzato; le statistiche sono riduzioni vettoriali.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.n = 0
+        self.ids: Dict[str, int] = {}     # '@username' -> id
+        self.usernames: List[str] = []
+        self._giornata = np.zeros(capacity, dtype=np.int32)
+        self._player = np.zeros(capacity, dtype=np.int32)
+        self._quota = np.zeros(capacity, dtype=np.float32)
+        self._jolly = np.zeros(capacity, dtype=bool)
+        self._esito = np.zeros(capacity, dtype=np.int8)
+
+    @classmethod
+    def from_data(cls, data: Dict[str, Any]) -> "BetHistory":
+        h = cls()
+        bets = data.get("bets", {})
+        for g_key in sorted(bets, key=int):
+            h.append_giornata(g_key, bets[g_key])
+        return h
+
+    def _id(self, username: str) -> int:
+        i = self.ids.get(username)
+        if i is None:
+            i = self.ids[username] = len(self.usernames)
+            self.usernames.append(username)
+        return i
+
+    def _grow(self, need: int) -> None:
+        cap = len(self._giornata)
+        if need <= cap:
+            return
+        while cap < need:
+            cap *= 2
+        for name in ("_giornata", "_player", "_quota", "_jolly", "_esito"):
+            old = getattr(self, name)
+            new = np.zeros(cap, dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def append_giornata(self, g_key: str, giornata: Giornata) -> None:
+        """Aggiunge le giocate regolate della giornata (sostituendo righe già presenti per la stessa giornata)."""
+        rows = [(u, b) for u, b in giornata.bets.items() if b.esito is not None]
+        g = int(g_key)
+        if self.n and (self._giornata[:self.n] == g).any():
+            keep = self._giornata[:self.n] != g
+            k = int(keep.sum())
+            for name in ("_giornata", "_player", "_quota", "_jolly", "_esito"):
+                col = getattr(self, name)
+                col[:k] = col[:self.n][keep]
+            self.n = k
+        self._grow(self.n + len(rows))
+        for u, b in rows:
+            i = self.n
+            self._giornata[i] = g
+            self._player[i] = self._id(u)
+            self._quota[i] = b.quota
+            self._jolly[i] = b.jolly
+            self._esito[i] = PERSA if b.esito == "persa" else VINTA
+            self.n += 1
+
+    def __len__(self) -> int:
+        return self.n
+
+    def stats(self, usernames: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+        """
+        Per giocatore: giocate, % vinte, quota media, jolly (usati e % vinte), ROI simulato
+        (1€ su ogni giocata alla quota giocata), serie di vittorie più lunga e serie attuale.
+        Le giornate senza giocata (quota 0) contano per le vittorie/serie ma non per quote e ROI.
+        """
+        n = self.n
+        g, p = self._giornata[:n], self._player[:n]
+        q, j = self._quota[:n].astype(np.float64), self._jolly[:n]
+        vinta = self._esito[:n] == VINTA
+        giocata = q > 0
+        k = len(self.usernames)
+
+        count = np.bincount(p, minlength=k)
+        wins = np.bincount(p, weights=vinta, minlength=k)
+        n_q = np.bincount(p, weights=giocata, minlength=k)
+        sum_q = np.bincount(p, weights=q, minlength=k)
+        ritorno = np.bincount(p, weights=np.where(vinta & giocata, q, 0.0), minlength=k)
+        n_j = np.bincount(p, weights=j, minlength=k)
+        wins_j = np.bincount(p, weights=j & vinta, minlength=k)
+        best, current = self._serie(g, p, vinta, k)
+
+        out: Dict[str, Dict[str, float]] = {}
+        for u in usernames if usernames is not None else self.usernames:
+            i = self.ids.get(u)
+            if i is None or count[i] == 0:
+                continue
+            out[u] = {
+                "giocate": int(count[i]),
+                "vinte_pct": float(wins[i] / count[i] * 100),
+                "quota_media": float(sum_q[i] / n_q[i]) if n_q[i] else 0.0,
+                "jolly": int(n_j[i]),
+                "jolly_vinti_pct": float(wins_j[i] / n_j[i] * 100) if n_j[i] else 0.0,
+                "roi_pct": float((ritorno[i] - n_q[i]) / n_q[i] * 100) if n_q[i] else 0.0,
+                "serie_max": int(best[i]),
+                "serie_attuale": int(current[i]),
+            }
+        return out
+
+    @staticmethod
+    def _serie(g: np.ndarray, p: np.ndarray, vinta: np.ndarray, k: int):
+        """Serie di vittorie consecutive (più lunga e attuale) per giocatore, senza cicli Python sulle righe."""
+        best, current = np.zeros(k, dtype=np.int64), np.zeros(k, dtype=np.int64)
+        if len(g) == 0:
+            return best, current
+        order = np.lexsort((g, p))               # per giocatore, poi per giornata
+        p_s, v_s = p[order], vinta[order]
+        # una serie si interrompe a ogni sconfitta e a ogni cambio di giocatore
+        new_run = np.ones(len(p_s), dtype=bool)
+        new_run[1:] = (p_s[1:] != p_s[:-1]) | ~v_s[:-1]
+        run_id = np.cumsum(new_run) - 1
+        run_len = np.bincount(run_id, weights=v_s).astype(np.int64)
+        run_player = p_s[new_run]
+        np.maximum.at(best, run_player, run_len)
+        last = np.ones(len(p_s), dtype=bool)
+        last[:-1] = p_s[1:] != p_s[:-1]           # ultima riga di ogni giocatore
+        current[p_s[last]] = run_len[run_id[last]] * v_s[last]
+        return best, current
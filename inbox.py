@@ -0,0 +1,206 @@
+from __future__ import annotations
+import asyncio, json, os, tempfile
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from telegram import Update
+from telegram.ext import Application
+
+from journal import JOURNAL_FSYNC
+from metrics import METRICS
+
+# Update già finiti ricordati per scartare le consegne doppie (Telegram rimanda
+# gli update non confermati dopo un riavvio)
+INBOX_KEEP_DONE = int(os.getenv("INBOX_KEEP_DONE", "10000"))
+# Oltre questa dimensione il file viene riscritto con i soli update ancora da finire
+INBOX_MAX_BYTES = int(os.getenv("INBOX_MAX_BYTES", str(1024 * 1024)))
+
+
+class Inbox:
+    """
+    Inbox durevole degli update in arrivo, un file JSON-lines:
+      {"u": <update>}   ricevuto (scritto con fsync prima di confermarlo a Telegram)
+      {"d": update_id}  finito (senza fsync: se si perde, l'update viene solo rigiocato)
+      {"seen": [...]}   update finiti di recente, dopo una compattazione
+    All'avvio gli update ricevuti e mai finiti vengono rigiocati (vedi replay).
+    Gli handler devono essere idempotenti per update_id: vedi BaseStore.applied_update.
+    """
+
+    def __init__(self, path: str, fsync: bool = JOURNAL_FSYNC,
+                 keep_done: int = INBOX_KEEP_DONE, max_bytes: int = INBOX_MAX_BYTES):
+        self.path = path
+        self.fsync = fsync
+        self.keep_done = keep_done
+        self.max_bytes = max_bytes
+        self.pending: Dict[int, Dict[str, Any]] = {}
+        self._done: Set[int] = set()
+        self._done_order: Deque[int] = deque()
+        self._f = None
+        # righe scritte / già su disco (fsync): vedi sync()
+        self._scritte = 0
+        self._sincronizzate = 0
+        self._fsync: Optional[asyncio.Future] = None
+        self.stats: Dict[str, int] = {"received": 0, "duplicates": 0, "replayed": 0, "compactions": 0}
+        self._load()
+
+    # ---- file ----
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # scrittura interrotta da un crash
+                rec = json.loads(line)
+                if "u" in rec:
+                    self.pending[rec["u"]["update_id"]] = rec["u"]
+                elif "d" in rec:
+                    self.pending.pop(rec["d"], None)
+                    self._remember(rec["d"])
+                else:
+                    for update_id in rec.get("seen", []):
+                        self._remember(update_id)
+
+    def _file(self):
+        if self._f is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._f = open(self.path, "a", encoding="utf-8")
+        return self._f
+
+    def _write(self, rec: Dict[str, Any]) -> None:
+        f = self._file()
+        line = json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n"
+        f.write(line)
+        f.flush()
+        self._scritte += 1
+        METRICS.wrote("inbox", len(line.encode("utf-8")))
+
+    async def sync(self) -> None:
+        """
+        Porta su disco (fsync in un thread, fuori dall'event loop) le righe scritte finora.
+        Un solo fsync alla volta: chi arriva mentre è in corso aspetta il successivo, che copre
+        insieme tutte le righe scritte nel frattempo.
+        """
+        target = self._scritte
+        while self.fsync and self._sincronizzate < target:
+            if self._fsync is None or self._fsync.done():
+                self._fsync = asyncio.ensure_future(self._fsync_file(self._file(), self._scritte))
+            await asyncio.shield(self._fsync)
+
+    async def _fsync_file(self, f, scritte: int) -> None:
+        await asyncio.to_thread(os.fsync, f.fileno())
+        self._sincronizzate = max(self._sincronizzate, scritte)
+
+    def _remember(self, update_id: int) -> None:
+        if update_id in self._done:
+            return
+        self._done.add(update_id)
+        self._done_order.append(update_id)
+        while len(self._done_order) > self.keep_done:
+            self._done.discard(self._done_order.popleft())
+
+    def compact(self) -> None:
+        """Riscrive il file (in modo atomico) con gli update da finire e quelli finiti di recente."""
+        self.close()
+        # il nuovo file contiene tutto quello che era da sincronizzare ed è già su disco
+        self._sincronizzate = self._scritte
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".inbox-", suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"seen": list(self._done_order)}, separators=(",", ":")) + "\n")
+                for update in self.pending.values():
+                    f.write(json.dumps({"u": update}, ensure_ascii=False, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.stats["compactions"] += 1
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    # ---- ciclo di vita di un update ----
+    def seen(self, update_id: int) -> bool:
+        return update_id in self.pending or update_id in self._done
+
+    async def receive(self, update: Update) -> bool:
+        """Registra l'update, che al ritorno è su disco. False se è una consegna doppia (già ricevuto)."""
+        if self.seen(update.update_id):
+            self.stats["duplicates"] += 1
+            return False
+        data = update.to_dict()
+        self._write({"u": data})
+        self.pending[update.update_id] = data
+        self.stats["received"] += 1
+        await self.sync()
+        return True
+
+    def done(self, update_id: int) -> None:
+        if self.pending.pop(update_id, None) is None:
+            return
+        self._write({"d": update_id})
+        self._remember(update_id)
+        # non durante un fsync: il thread lavora ancora sul file che compact() chiuderebbe
+        if self._f.tell() > self.max_bytes and (self._fsync is None or self._fsync.done()):
+            self.compact()
+
+    async def replay(self, app: Application, instrada: Optional[Callable[[Update], Awaitable[bool]]] = None) -> int:
+        """
+        Rimette in coda (in ordine di update_id) gli update ricevuti e mai finiti; quelli che
+        instrada() gira a un altro worker (vedi InboxQueue) si considerano finiti qui.
+        """
+        n = len(self.pending)
+        for update_id in sorted(self.pending):
+            update = Update.de_json(self.pending[update_id], app.bot)
+            if instrada is not None and await instrada(update):
+                self.done(update_id)
+                continue
+            await asyncio.Queue.put(app.update_queue, update)
+        self.stats["replayed"] += n
+        return n
+
+
+class InboxQueue(asyncio.Queue):
+    """
+    update_queue dell'Application: ogni update passa dall'inbox prima di entrare in coda.
+    Updater e webhook confermano l'update a Telegram solo dopo put(), quindi a quel punto è su disco.
+    Con più worker instrada(update) gira al proprietario della chat gli update che non sono di
+    questo processo (ritorna True se l'ha fatto): quelli non entrano né nell'inbox né in coda.
+    """
+
+    def __init__(self, inbox: Inbox, instrada: Optional[Callable[[Update], Awaitable[bool]]] = None):
+        super().__init__()
+        self.inbox = inbox
+        self.instrada = instrada
+
+    async def put(self, item: Any) -> None:
+        if isinstance(item, Update):
+            if self.instrada is not None and await self.instrada(item):
+                return
+            if not await self.inbox.receive(item):
+                return
+        await super().put(item)
+
+    async def put_girato(self, item: Update) -> None:
+        """Come put() ma senza instrada: per gli update che un altro worker ha girato a questo."""
+        if await self.inbox.receive(item):
+            await super().put(item)
+
+
+class InboxApplication(Application):
+    """Application che segna l'update come finito nell'inbox quando tutti i suoi handler sono terminati."""
+
+    async def process_update(self, update: object) -> None:
+        try:
+            await super().process_update(update)
+        finally:
+            if isinstance(update, Update) and isinstance(self.update_queue, InboxQueue):
+                self.update_queue.inbox.done(update.update_id)
+
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import json, os
+from typing import Any, Dict, Iterator
+
+from metrics import METRICS
+
+# Se "0" non si fa fsync a ogni evento (più veloce, ma un crash del SO può perdere le ultime righe)
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "1") != "0"
+
+
+class Journal:
+    """
+    Journal append-only di eventi, una riga JSON per evento.
+    Al momento dello snapshot il file corrente viene ruotato in "<path>.old":
+    gli eventi scritti mentre lo snapshot è in corso finiscono nel file nuovo,
+    e "<path>.old" si cancella solo quando lo snapshot è su disco.
+    """
+
+    def __init__(self, path: str, fsync: bool = JOURNAL_FSYNC):
+        self.path = path
+        self.old_path = path + ".old"
+        self.fsync = fsync
+        self._f = None
+
+    def _file(self):
+        if self._f is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._f = open(self.path, "a", encoding="utf-8")
+        return self._f
+
+    def append(self, event: Dict[str, Any]) -> None:
+        f = self._file()
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n"
+        f.write(line)
+        f.flush()
+        METRICS.wrote("journal", len(line.encode("utf-8")))
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def size(self) -> int:
+        if self._f is not None:
+            return self._f.tell()
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """Eventi di "<path>.old" e poi del file corrente; una riga finale troncata viene ignorata."""
+        for p in (self.old_path, self.path):
+            if not os.path.exists(p):
+                continue
+            with open(p, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # scrittura interrotta da un crash
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+
+    def rotate(self) -> None:
+        self.close()
+        if os.path.exists(self.path):
+            if os.path.exists(self.old_path):
+                # snapshot precedente mai completato: accodo invece di sovrascrivere
+                with open(self.path, "r", encoding="utf-8") as src, open(self.old_path, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.old_path)
+
+    def drop_rotated(self) -> None:
+        if os.path.exists(self.old_path):
+            os.remove(self.old_path)
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
@@ -0,0 +1,177 @@
+from __future__ import annotations
+import asyncio, heapq, itertools, os, time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from telegram.error import TelegramError
+
+from chat_locks import CHAT_LOCKS
+from state_store import BaseStore
+
+# Promemoria a chi non ha ancora giocato, quanti secondi prima del primo calcio d'inizio
+KICKOFF_PROMEMORIA = float(os.getenv("KICKOFF_PROMEMORIA", str(2 * 3600)))
+# La giornata si chiude quanti secondi dopo l'ultimo calcio d'inizio
+KICKOFF_DURATA = float(os.getenv("KICKOFF_DURATA", str(2 * 3600)))
+
+# (istante, seq, chat_id, g_key, azione, usernames da bloccare)
+Timer = Tuple[float, int, Hashable, str, str, Tuple[str, ...]]
+
+
+def piano_giornata(kickoff: Dict[str, float], assignments: Dict[str, str],
+                   roster: Dict[str, str]) -> List[Tuple[float, str, Tuple[str, ...]]]:
+    """
+    Azioni della giornata [(istante, azione, usernames)]: "promemoria" e "inizio" sul primo calcio
+    d'inizio, un "blocco" per ogni orario con i giocatori la cui partita comincia lì, "fine" dopo l'ultimo.
+    Le partite senza orario non bloccano nessuno e non spostano inizio e fine.
+    """
+    times = [kickoff[f] for f in assignments.values() if f in kickoff]
+    if not times:
+        return []
+    first, last = min(times), max(times)
+    name_to_username = {v: k for k, v in roster.items()}
+    per_orario: Dict[float, List[str]] = {}
+    for player, fixture in assignments.items():
+        if fixture in kickoff and player in name_to_username:
+            per_orario.setdefault(kickoff[fixture], []).append(name_to_username[player])
+    out = [(first - KICKOFF_PROMEMORIA, "promemoria", ()), (first, "inizio", ())]
+    out += [(t, "blocco", tuple(sorted(users))) for t, users in sorted(per_orario.items())]
+    out.append((last + KICKOFF_DURATA, "fine", ()))
+    return out
+
+
+class KickoffScheduler:
+    """
+    Fa avanzare da sola le giornate che hanno i calci d'inizio nel calendario.
+    Tutte le azioni di tutti i gruppi stanno in un unico heap ordinato per istante e sulla
+    JobQueue di PTB c'è un solo job, armato sulla prima scadenza: quando scatta esegue le azioni
+    scadute e si riarma sulla successiva. Un'azione non più valida (es. giornata chiusa a mano)
+    viene scartata quando scatta. Le azioni sono idempotenti, quindi dopo un riavvio si
+    ripianifica tutto (quelle già passate scattano subito).
+    Con più worker ogni processo pianifica le chat di cui è proprietario (owns): le azioni di
+    una chat passata a un altro worker vengono scartate (vedi forget e workers.py).
+    """
+
+    def __init__(self, get_store: Callable[[Hashable], BaseStore],
+                 kickoff_for: Callable[[BaseStore, str], Dict[str, float]],
+                 actions: Dict[str, Callable[..., Any]],
+                 clock: Callable[[], float] = time.time,
+                 owns: Callable[[Hashable], bool] = lambda chat_id: True):
+        self.get_store = get_store
+        self.kickoff_for = kickoff_for
+        self.actions = actions            # azione -> async fn(bot, chat_id, store, g_key, usernames)
+        self.clock = clock
+        self.owns = owns
+        self._heap: List[Timer] = []
+        self._seq = itertools.count()
+        self._planned: Set[Tuple[Hashable, str]] = set()
+        self._job_queue = None
+        self._job = None
+        self._armed_at: Optional[float] = None
+        self.stats: Dict[str, int] = {"planned": 0, "fired": 0, "stale": 0, "errors": 0}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def start(self, job_queue: Any, chat_ids=()) -> int:
+        """Collega la JobQueue e pianifica le giornate in corso dei gruppi dati. Ritorna le giornate pianificate."""
+        self._job_queue = job_queue
+        n = sum(self._plan_safe(chat_id) for chat_id in chat_ids)
+        self._arm()  # anche per quelle pianificate prima di avere la JobQueue
+        return n
+
+    async def plan_all(self, chat_ids, pausa: float = 0.005) -> int:
+        """
+        Come start() ma un gruppo alla volta, con una pausa tra l'uno e l'altro: all'avvio gli update
+        arrivati nel frattempo non aspettano il caricamento di tutti i gruppi. Con sleep(0) non basta:
+        un update passa da molti giri dell'event loop e ogni giro pagherebbe il caricamento di un gruppo.
+        """
+        n = 0
+        for chat_id in chat_ids:
+            n += self._plan_safe(chat_id)
+            await asyncio.sleep(pausa)
+        return n
+
+    def _plan_safe(self, chat_id: Hashable) -> bool:
+        try:
+            return self.plan(chat_id)
+        except Exception as e:
+            print(f"⚠️ Calendario: gruppo {chat_id} non pianificato: {e}", flush=True)
+            return False
+
+    def plan(self, chat_id: Hashable) -> bool:
+        """Mette nell'heap le azioni della giornata corrente del gruppo (se ha orari e non è già finita)."""
+        store = self.get_store(chat_id)
+        g_key = store.current_giornata()
+        if g_key is None or (chat_id, g_key) in self._planned:
+            return False
+        giornata = store.data["bets"][g_key]
+        if giornata.status == "finished":
+            return False
+        piano = piano_giornata(self.kickoff_for(store, g_key), giornata.assignments,
+                               store.data.get("roster", {}))
+        if not piano:
+            return False
+        now = self.clock()
+        for when, action, usernames in piano:
+            if action == "promemoria" and when <= now:
+                continue  # un promemoria in ritardo (es. dopo un riavvio) non serve più
+            heapq.heappush(self._heap, (when, next(self._seq), chat_id, g_key, action, usernames))
+        self._planned.add((chat_id, g_key))
+        self.stats["planned"] += 1
+        self._arm()
+        return True
+
+    def forget(self, chat_id: Hashable) -> None:
+        """Toglie le azioni del gruppo (passato a un altro worker): se torna qui viene ripianificato."""
+        self._heap = [t for t in self._heap if t[2] != chat_id]
+        heapq.heapify(self._heap)
+        self._planned = {p for p in self._planned if p[0] != chat_id}
+
+    def _arm(self) -> None:
+        if self._job_queue is None or not self._heap:
+            return
+        when = self._heap[0][0]
+        if self._job is not None:
+            if self._armed_at is not None and self._armed_at <= when:
+                return  # il job già armato scatta prima
+            self._job.schedule_removal()
+        self._job = self._job_queue.run_once(self._fire, when=max(0.0, when - self.clock()), name="kickoff")
+        self._armed_at = when
+
+    async def _fire(self, context: Any) -> None:
+        self._job = self._armed_at = None
+        due = []
+        now = self.clock()
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+        self._arm()
+        # gruppi diversi in parallelo (es. tutti quelli di Serie A al calcio d'inizio delle 15:00);
+        # nello stesso gruppo l'ordine resta quello dell'heap grazie al lock FIFO per chat
+        await asyncio.gather(*(self._run(context.bot, *timer[2:]) for timer in due))
+
+    async def _run(self, bot: Any, chat_id: Hashable, g_key: str, action: str, usernames: Tuple[str, ...]) -> None:
+        try:
+            await self._run_locked(bot, chat_id, g_key, action, usernames)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"⚠️ Calendario: {action} G{g_key} per chat {chat_id} fallito: {e}", flush=True)
+
+    async def _run_locked(self, bot: Any, chat_id: Hashable, g_key: str, action: str,
+                          usernames: Tuple[str, ...]) -> None:
+        async with CHAT_LOCKS.hold(chat_id):
+            if not self.owns(chat_id):
+                self.stats["stale"] += 1
+                return
+            store = self.get_store(chat_id)
+            giornata = store.data.get("bets", {}).get(g_key)
+            if store.current_giornata() != g_key or giornata is None or giornata.status == "finished":
+                self.stats["stale"] += 1
+                self._planned.discard((chat_id, g_key))
+                return
+            self.stats["fired"] += 1
+            if action == "fine":
+                self._planned.discard((chat_id, g_key))
+            try:
+                await self.actions[action](bot, chat_id, store, g_key, usernames)
+            except TelegramError as e:
+                # lo stato è già aggiornato: manca solo il messaggio
+                print(f"⚠️ Calendario: messaggio {action} G{g_key} per chat {chat_id} non inviato: {e}", flush=True)
@@ -0,0 +1,138 @@
+from __future__ import annotations
+import bisect
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from model import Movimento
+
+# Descrizione dei tipi di movimento nell'estratto conto
+ETICHETTE: Dict[str, str] = {
+    "persa": "❌ Giocata persa",
+    "penale_jolly": "🃏 Penale jolly",
+    "versamento": "💳 Versamento",
+    "rettifica_debito": "✏️ Rettifica debito",
+    "rettifica_versato": "✏️ Rettifica versato",
+    "apertura_debito": "📂 Debito prima del registro",
+    "apertura_versato": "📂 Versato prima del registro",
+}
+
+
+class _Fenwick:
+    """Somme prefisse con aggiornamento e query in O(log n) (indici 0..n-1)."""
+
+    __slots__ = ("tree",)
+
+    def __init__(self, n: int):
+        self.tree = [0] * (n + 1)
+
+    def __len__(self) -> int:
+        return len(self.tree) - 1
+
+    def add(self, i: int, v: int) -> None:
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += v
+            i += i & -i
+
+    def prefix(self, i: int) -> int:
+        """Somma degli indici 0..i (compresi)."""
+        i = min(i + 1, len(self.tree) - 1)
+        s = 0
+        while i > 0:
+            s += self.tree[i]
+            i -= i & -i
+        return s
+
+
+class _Conto:
+    """Movimenti di un giocatore, con i saldi come somme prefisse per giornata e per data."""
+
+    __slots__ = ("indici", "giornate", "per_giornata", "ts", "cumulato")
+
+    def __init__(self):
+        self.indici: List[int] = []        # posizioni in data["movimenti"], in ordine di registrazione
+        self.giornate: List[int] = []      # giornata di ogni movimento (0: prima del registro)
+        self.per_giornata = _Fenwick(64)   # giornata -> somma delle variazioni
+        self.ts: List[int] = []            # ora di registrazione, resa non decrescente per la bisezione
+        self.cumulato: List[int] = []      # saldo dopo ogni movimento, in ordine di registrazione
+
+    def append(self, i: int, m: Movimento) -> None:
+        g = m.giornata or 0
+        if g >= len(self.per_giornata):
+            # raddoppio: si ricostruisce l'albero dalle variazioni già registrate
+            old = self.per_giornata
+            self.per_giornata = _Fenwick(max(2 * len(old), g + 1))
+            for gg in range(len(old)):
+                v = old.prefix(gg) - (old.prefix(gg - 1) if gg else 0)
+                if v:
+                    self.per_giornata.add(gg, v)
+        self.per_giornata.add(g, m.variazione)
+        self.indici.append(i)
+        self.giornate.append(g)
+        self.ts.append(max(m.ts or 0, self.ts[-1] if self.ts else 0))
+        self.cumulato.append((self.cumulato[-1] if self.cumulato else 0) + m.variazione)
+
+
+class Ledger:
+    """
+    Indice del registro in sola aggiunta data["movimenti"] (vedi model.Movimento), costruito al primo
+    uso e poi aggiornato con i movimenti nuovi (sync). Per ogni giocatore il saldo (quanto deve) dopo
+    una giornata è una somma prefissa su un Fenwick tree indicizzato per giornata, e il saldo a una
+    data una bisezione sui saldi cumulati: entrambi O(log n), anche con giornate storiche importate
+    fuori ordine.
+    """
+
+    def __init__(self):
+        self.conti: Dict[str, _Conto] = {}
+        self.n = 0
+
+    @classmethod
+    def from_data(cls, data) -> "Ledger":
+        ledger = cls()
+        ledger.sync(data["movimenti"])
+        return ledger
+
+    def sync(self, movimenti: List[Movimento]) -> None:
+        """Indicizza i movimenti aggiunti dall'ultima chiamata."""
+        for i in range(self.n, len(movimenti)):
+            m = movimenti[i]
+            conto = self.conti.get(m.giocatore)
+            if conto is None:
+                conto = self.conti[m.giocatore] = _Conto()
+            conto.append(i, m)
+        self.n = len(movimenti)
+
+    def saldo(self, giocatore: str, giornata: Optional[int] = None) -> int:
+        """Quanto deve il giocatore dopo la giornata indicata (None: adesso)."""
+        conto = self.conti.get(giocatore)
+        if conto is None:
+            return 0
+        if giornata is None:
+            return conto.cumulato[-1]
+        return conto.per_giornata.prefix(giornata) if giornata >= 0 else 0
+
+    def saldo_al(self, giocatore: str, ts: int) -> int:
+        """Quanto doveva il giocatore all'istante ts (unix time)."""
+        conto = self.conti.get(giocatore)
+        if conto is None:
+            return 0
+        k = bisect.bisect_right(conto.ts, ts)
+        return conto.cumulato[k - 1] if k else 0
+
+    def variazione(self, giocatore: str, da: int, a: int) -> int:
+        """Variazione del saldo nelle giornate da..a comprese."""
+        return self.saldo(giocatore, a) - self.saldo(giocatore, da - 1)
+
+    def estratto(self, movimenti: List[Movimento], giocatore: str, da: Optional[int] = None,
+                 a: Optional[int] = None) -> Iterator[Tuple[Movimento, int]]:
+        """(movimento, saldo dopo il movimento) delle giornate da..a, in ordine di giornata e registrazione."""
+        conto = self.conti.get(giocatore)
+        if conto is None:
+            return
+        lo = 0 if da is None else da
+        hi = max(conto.giornate, default=0) if a is None else a
+        saldo = self.saldo(giocatore, lo - 1)
+        scelti = sorted((g, i) for g, i in zip(conto.giornate, conto.indici) if lo <= g <= hi)
+        for _, i in scelti:
+            m = movimenti[i]
+            saldo += m.variazione
+            yield m, saldo
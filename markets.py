@@ -0,0 +1,160 @@
+from __future__ import annotations
+import functools, re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from model import Bet, Giornata
+
+# Mercati riconosciuti nel testo di /gioca (maiuscole/minuscole indifferenti):
+#   1  X  2                 esito finale
+#   1X  X2  12              doppia chance
+#   Over 2.5  Under 3.5     gol totali (anche "O2.5", "U 3,5")
+#   GG  NG                  entrambe segnano / almeno una non segna (anche "Goal", "No Goal")
+#   Multigol 2-4            gol totali tra 2 e 4 compresi
+#   Pari  Dispari           gol totali
+#   2-1                     risultato esatto
+# Più mercati uniti da "+" formano una combo: vince solo se vincono tutti.
+
+Score = Tuple[int, int]
+
+
+class Market(NamedTuple):
+    kind: str                   # "esito", "doppia", "over", "under", "gg", "ng", "multigol", "pari", "dispari", "esatto"
+    args: Tuple[Any, ...] = ()
+
+    def __str__(self) -> str:
+        if self.kind in ("esito", "doppia"):
+            return self.args[0]
+        if self.kind in ("over", "under"):
+            return f"{self.kind.capitalize()} {self.args[0]:g}"
+        if self.kind == "multigol":
+            return f"Multigol {self.args[0]}-{self.args[1]}"
+        if self.kind == "esatto":
+            return f"{self.args[0]}-{self.args[1]}"
+        return self.kind.upper() if self.kind in ("gg", "ng") else self.kind.capitalize()
+
+
+Combo = Tuple[Market, ...]
+
+_NUM = r"(\d+(?:[.,]\d+)?)"
+_PATTERNS: List[Tuple[re.Pattern, Any]] = [
+    (re.compile(r"^(1X|X2|12)$"), lambda m: Market("doppia", (m.group(1),))),
+    (re.compile(r"^(1|X|2)$"), lambda m: Market("esito", (m.group(1),))),
+    (re.compile(rf"^(?:OVER|O)\s*{_NUM}$"), lambda m: Market("over", (_float(m.group(1)),))),
+    (re.compile(rf"^(?:UNDER|U)\s*{_NUM}$"), lambda m: Market("under", (_float(m.group(1)),))),
+    (re.compile(r"^(?:GG|GOAL|GOL)$"), lambda m: Market("gg")),
+    (re.compile(r"^(?:NG|NOGOAL|NO\s+GOAL|NOGOL|NO\s+GOL)$"), lambda m: Market("ng")),
+    (re.compile(r"^MULTI\s*GOL\s*(\d+)\s*-\s*(\d+)$"), lambda m: _multigol(int(m.group(1)), int(m.group(2)))),
+    (re.compile(r"^PARI$"), lambda m: Market("pari")),
+    (re.compile(r"^DISPARI$"), lambda m: Market("dispari")),
+    (re.compile(r"^(\d+)\s*-\s*(\d+)$"), lambda m: Market("esatto", (int(m.group(1)), int(m.group(2))))),
+]
+
+
+def _float(s: str) -> float:
+    return float(s.replace(",", "."))
+
+
+def _multigol(lo: int, hi: int) -> Optional[Market]:
+    return Market("multigol", (lo, hi)) if lo <= hi else None
+
+
+def _parse_leg(text: str) -> Optional[Market]:
+    leg = re.sub(r"\s+", " ", text.strip().upper())
+    for pattern, build in _PATTERNS:
+        m = pattern.match(leg)
+        if m:
+            return build(m)
+    return None
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_giocata(text: str) -> Optional[Combo]:
+    """Mercati della giocata, o None se anche un solo pezzo non è riconosciuto (esito da dare a mano)."""
+    legs = [_parse_leg(part) for part in text.split("+")]
+    if not legs or any(leg is None for leg in legs):
+        return None
+    return tuple(legs)
+
+
+def canonical(combo: Combo) -> str:
+    return " + ".join(str(m) for m in combo)
+
+
+def to_dati(combo: Combo) -> Dict[str, Any]:
+    """Forma serializzabile salvata nella giocata come dati_verifica."""
+    return {"mercati": [[m.kind, *m.args] for m in combo]}
+
+
+def from_dati(dati: Dict[str, Any]) -> Optional[Combo]:
+    mercati = dati.get("mercati") if dati else None
+    if not mercati:
+        return None
+    return tuple(Market(row[0], tuple(row[1:])) for row in mercati)
+
+
+def vince(market: Market, score: Score) -> bool:
+    home, away = score
+    total = home + away
+    k = market.kind
+    if k == "esito":
+        return market.args[0] == ("1" if home > away else "2" if away > home else "X")
+    if k == "doppia":
+        esito = "1" if home > away else "2" if away > home else "X"
+        return esito in market.args[0]
+    if k == "over":
+        return total > market.args[0]
+    if k == "under":
+        return total < market.args[0]
+    if k == "gg":
+        return home > 0 and away > 0
+    if k == "ng":
+        return home == 0 or away == 0
+    if k == "multigol":
+        return market.args[0] <= total <= market.args[1]
+    if k == "pari":
+        return total % 2 == 0
+    if k == "dispari":
+        return total % 2 == 1
+    if k == "esatto":
+        return (home, away) == tuple(market.args)
+    raise ValueError(f"Mercato sconosciuto: {k}")
+
+
+def combo_vince(combo: Combo, score: Score) -> bool:
+    return all(vince(m, score) for m in combo)
+
+
+def combo_of(bet: Bet) -> Optional[Combo]:
+    """Mercati di una giocata salvata: dati_verifica se c'è, altrimenti il testo."""
+    combo = from_dati(bet.dati_verifica or {})
+    return combo if combo is not None else parse_giocata(bet.giocata)
+
+
+def regola_giornata(giornata: Giornata, username_to_name: Dict[str, str]
+                    ) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Esiti automatici di una giornata dai risultati salvati in giornata.risultati.
+    Ritorna (perdenti, da_decidere) dove da_decidere è {'@username': motivo}
+    per chi non si può regolare da solo (niente giocata, testo non riconosciuto, risultato mancante).
+    """
+    assignments = giornata.assignments
+    risultati = giornata.risultati
+    bets = giornata.bets
+    losers: List[str] = []
+    pending: Dict[str, str] = {}
+    for username, name in username_to_name.items():
+        bet = bets.get(username)
+        fixture = assignments.get(name)
+        if bet is None or bet.giocata == "(nessuna)":
+            pending[username] = "nessuna giocata"
+            continue
+        combo = combo_of(bet)
+        if combo is None:
+            pending[username] = f"giocata non riconosciuta: {bet.giocata}"
+            continue
+        if fixture is None or fixture not in risultati:
+            pending[username] = f"manca il risultato di {fixture or '(nessuna partita)'}"
+            continue
+        if not combo_vince(combo, tuple(risultati[fixture])):
+            losers.append(username)
+    return losers, pending
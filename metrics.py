@@ -0,0 +1,256 @@
+from __future__ import annotations
+import contextvars, functools, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Percorso servito accanto al webhook (e dal server dedicato con METRICS_PORT in polling)
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+API_CALLS_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+# Contatore delle chiamate alla Bot API fatte dall'update in corso (vedi Metrics.instrument)
+_update_api_calls: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar(
+    "update_api_calls", default=None)
+
+
+class Histogram:
+    """Istogramma a bucket fissi (cumulativi solo in output, come vuole Prometheus)."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # l'ultimo è +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Stima del quantile q per interpolazione lineare dentro il bucket."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else lo
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def lines(self, name: str, labels: str) -> List[str]:
+        out, acc = [], 0
+        sep = "," if labels else ""
+        for le, c in zip(self.buckets, self.counts):
+            acc += c
+            out.append(f'{name}_bucket{{{labels}{sep}le="{le:g}"}} {acc}')
+        out.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        braces = f"{{{labels}}}" if labels else ""
+        out.append(f"{name}_sum{braces} {self.sum:.6f}")
+        out.append(f"{name}_count{braces} {self.count}")
+        return out
+
+
+class Metrics:
+    """
+    Metriche del processo:
+    - latenza ed errori per handler, chiamate alla Bot API per update (instrument);
+    - durata delle operazioni sullo stato (timed) e byte scritti (wrote);
+    - gauge calcolati al momento della lettura (add_gauge), es. dimensione dei file di stato.
+    render() produce il formato testuale di Prometheus.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.latency: Dict[str, Histogram] = {}
+        self.api_per_update: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = {}
+        self.api_calls: Dict[str, int] = {}
+        self.ops: Dict[str, Histogram] = {}
+        self.bytes_written: Dict[str, int] = {}
+        self._gauges: List[Tuple[str, str, Callable[[], float]]] = []
+
+    # ---- registrazione ----
+    def observe_handler(self, name: str, seconds: float, api_calls: int, error: bool) -> None:
+        with self._lock:
+            if name not in self.latency:
+                self.latency[name] = Histogram(LATENCY_BUCKETS)
+                self.api_per_update[name] = Histogram(API_CALLS_BUCKETS)
+                self.errors[name] = 0
+            self.latency[name].observe(seconds)
+            self.api_per_update[name].observe(api_calls)
+            if error:
+                self.errors[name] += 1
+
+    def api_call(self, method: str) -> None:
+        with self._lock:
+            self.api_calls[method] = self.api_calls.get(method, 0) + 1
+        counter = _update_api_calls.get()
+        if counter is not None:
+            counter[0] += 1
+
+    def observe_op(self, op: str, seconds: float) -> None:
+        with self._lock:
+            h = self.ops.get(op)
+            if h is None:
+                h = self.ops[op] = Histogram(LATENCY_BUCKETS)
+            h.observe(seconds)
+
+    def wrote(self, kind: str, nbytes: int) -> None:
+        with self._lock:
+            self.bytes_written[kind] = self.bytes_written.get(kind, 0) + nbytes
+
+    def add_gauge(self, name: str, help_text: str, fn: Callable[[], float]) -> None:
+        self._gauges.append((name, help_text, fn))
+
+    # ---- decoratori ----
+    def instrument(self, name: str) -> Callable:
+        """Decoratore per handler async: latenza, errori e chiamate API dell'update."""
+        def deco(handler: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+            @functools.wraps(handler)
+            async def wrapper(*args, **kwargs):
+                counter = [0]
+                token = _update_api_calls.set(counter)
+                t0 = time.perf_counter()
+                error = False
+                try:
+                    return await handler(*args, **kwargs)
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    _update_api_calls.reset(token)
+                    self.observe_handler(name, time.perf_counter() - t0, counter[0], error)
+            return wrapper
+        return deco
+
+    def timed(self, op: str) -> Callable:
+        """Decoratore per funzioni sincrone (es. load_data/save_data)."""
+        def deco(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe_op(op, time.perf_counter() - t0)
+            return wrapper
+        return deco
+
+    # ---- lettura ----
+    def hottest(self, n: int = 10) -> List[Tuple[str, Histogram, int, float]]:
+        """[(handler, latenza, errori, chiamate API medie per update)] per tempo totale decrescente."""
+        with self._lock:
+            rows = [(name, h, self.errors[name],
+                     self.api_per_update[name].sum / h.count if h.count else 0.0)
+                    for name, h in self.latency.items()]
+        rows.sort(key=lambda r: r[1].sum, reverse=True)
+        return rows[:n]
+
+    def render(self) -> str:
+        out: List[str] = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            header("bot_handler_latency_seconds", "histogram", "Durata degli handler, lock per chat incluso.")
+            for name, h in sorted(self.latency.items()):
+                out += h.lines("bot_handler_latency_seconds", f'handler="{name}"')
+            header("bot_handler_errors_total", "counter", "Eccezioni sollevate dagli handler.")
+            for name, n in sorted(self.errors.items()):
+                out.append(f'bot_handler_errors_total{{handler="{name}"}} {n}')
+            header("bot_api_calls_per_update", "histogram", "Chiamate alla Bot API fatte da un update.")
+            for name, h in sorted(self.api_per_update.items()):
+                out += h.lines("bot_api_calls_per_update", f'handler="{name}"')
+            header("bot_api_calls_total", "counter", "Chiamate alla Bot API per metodo (getUpdates escluso).")
+            for method, n in sorted(self.api_calls.items()):
+                out.append(f'bot_api_calls_total{{method="{method}"}} {n}')
+            header("bot_state_op_seconds", "histogram", "Durata delle operazioni sullo stato.")
+            for op, h in sorted(self.ops.items()):
+                out += h.lines("bot_state_op_seconds", f'op="{op}"')
+            header("bot_state_bytes_written_total", "counter", "Byte scritti su disco per tipo (snapshot, journal).")
+            for kind, n in sorted(self.bytes_written.items()):
+                out.append(f'bot_state_bytes_written_total{{kind="{kind}"}} {n}')
+        header("bot_uptime_seconds", "gauge", "Secondi dall'avvio del processo.")
+        out.append(f"bot_uptime_seconds {time.time() - self.started:.0f}")
+        for name, help_text, fn in self._gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            header(name, "gauge", help_text)
+            out.append(f"{name} {value:g}")
+        return "\n".join(out) + "\n"
+
+
+METRICS = Metrics()
+
+
+class StartupTimer:
+    """Fasi dell'avvio: per ognuna i secondi da t0 (es. l'inizio dell'import di bot.py) la prima volta che si raggiunge."""
+
+    def __init__(self, t0: Optional[float] = None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.fasi: Dict[str, float] = {}
+
+    def fase(self, nome: str) -> bool:
+        """Segna la fase; False se era già segnata."""
+        if nome in self.fasi:
+            return False
+        self.fasi[nome] = time.perf_counter() - self.t0
+        return True
+
+    def riepilogo(self) -> str:
+        """"import 390 ms + app 20 ms + init 150 ms = 560 ms": durata di ogni fase e totale."""
+        parti, prima = [], 0.0
+        for nome, t in self.fasi.items():
+            parti.append(f"{nome} {(t - prima) * 1000:.0f} ms")
+            prima = t
+        return " + ".join(parti) + f" = {prima * 1000:.0f} ms"
+
+
+def tornado_handler() -> type:
+    """RequestHandler di tornado per /metrics (tornado arriva con python-telegram-bot[webhooks])."""
+    import tornado.web
+
+    class MetricsHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header("Content-Type", CONTENT_TYPE)
+            self.write(METRICS.render())
+
+    return MetricsHandler
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Server HTTP dedicato a /metrics, in un thread (per la modalità polling)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != METRICS_PATH:
+                self.send_error(404)
+                return
+            body = METRICS.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
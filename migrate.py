@@ -0,0 +1,184 @@
+"""
+Operazioni amministrative in blocco sullo stato di un gruppo, da lanciare a bot fermo.
+Ogni comando applica tutte le sue modifiche come una sola transazione (vedi applica_lotto):
+un caricamento, un'unica scrittura atomica, e se un invariante dei totali salta non cambia nulla.
+
+- migra: esegue le migrazioni di migrazioni/NNNN_*.py non ancora applicate. Ogni modulo ha
+  DESCRIZIONE ed eventi(data) -> [evento]; quelle applicate restano in data["migrazioni"]
+  e non vengono più rieseguite;
+- versamenti: CSV username,euro;
+- giornate: CSV giornata,username,giocata,quota,esito di giornate storiche.
+
+Lo stato è il chat_id del gruppo oppure il percorso di un data.json / data.sqlite.
+
+    python migrate.py -1001234567890 migra --dry-run
+    python migrate.py data.json migra
+    python migrate.py -1001234567890 versamenti versamenti.csv
+    python migrate.py -1001234567890 giornate storico.csv --solo-storico
+"""
+from __future__ import annotations
+import argparse, copy, csv, glob, importlib.util, os
+from typing import Any, Dict, List, Optional, Tuple
+
+from events import Event, apply_event
+from game_utils import LEGACY, applica_lotto, get_store, roster
+from sqlite_store import SqliteStore
+from state_store import BaseStore, StateStore
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRAZIONI_DIR = os.path.join(_BASE_DIR, "migrazioni")
+
+
+def apri(stato: str) -> BaseStore:
+    if not os.path.exists(stato) and stato.lstrip("-").isdigit():
+        return get_store(int(stato))
+    if not os.path.exists(stato):
+        raise SystemExit(f"❌ {stato}: né un file di stato né un chat_id")
+    # come get_store: un data.json storico riceve la rosa prima dell'aggiornamento dello schema
+    return (SqliteStore if stato.endswith(".sqlite") else StateStore)(stato, legacy=LEGACY)
+
+
+def migrazioni(folder: str = MIGRAZIONI_DIR) -> List[Tuple[str, Any]]:
+    """[(id, modulo)] in ordine di nome file; l'id è il nome senza .py (es. "0001_g1_storica")."""
+    out = []
+    for path in sorted(glob.glob(os.path.join(folder, "[0-9][0-9][0-9][0-9]_*.py"))):
+        mig_id = os.path.splitext(os.path.basename(path))[0]
+        spec = importlib.util.spec_from_file_location(f"migrazioni.{mig_id}", path)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        out.append((mig_id, mod))
+    return out
+
+
+def eventi_migra(data: Dict[str, Any]) -> Tuple[List[Event], List[str]]:
+    """Eventi delle migrazioni da applicare, ognuna vista sullo stato lasciato dalle precedenti."""
+    fatte = set(data.get("migrazioni", []))
+    prova = copy.deepcopy(data)
+    events: List[Event] = []
+    righe = []
+    for mig_id, mod in migrazioni():
+        if mig_id in fatte:
+            continue
+        evs = list(mod.eventi(prova)) + [{"type": "migration_applied", "id": mig_id,
+                                          "descrizione": getattr(mod, "DESCRIZIONE", "")}]
+        for ev in evs:
+            apply_event(prova, ev)
+        events += evs
+        righe.append(f"{mig_id}: {getattr(mod, 'DESCRIZIONE', '')} ({len(evs) - 1} modifiche)")
+    return events, righe
+
+
+def _username(data: Dict[str, Any], chi: str) -> Optional[str]:
+    """'@username' dal CSV, che può contenere '@username' o il nome in classifica."""
+    r = roster(data)
+    if chi in r:
+        return chi
+    for u, name in r.items():
+        if name == chi:
+            return u
+    return None
+
+
+def _leggi_csv(path: str, colonne: List[str]) -> List[Dict[str, str]]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+    mancanti = [c for c in colonne if rows and c not in rows[0]]
+    if mancanti:
+        raise SystemExit(f"❌ {path}: colonne mancanti {', '.join(mancanti)}")
+    return rows
+
+
+def eventi_versamenti(data: Dict[str, Any], path: str) -> Tuple[List[Event], List[str]]:
+    events: List[Event] = []
+    errori = []
+    for i, row in enumerate(_leggi_csv(path, ["username", "euro"]), 2):
+        u = _username(data, row["username"].strip())
+        if u is None:
+            errori.append(f"riga {i}: giocatore sconosciuto {row['username']!r}")
+            continue
+        try:
+            euro = int(row["euro"])
+        except ValueError:
+            errori.append(f"riga {i}: importo non valido {row['euro']!r}")
+            continue
+        events.append({"type": "payment_recorded", "player": roster(data)[u], "euro": euro})
+    return events, errori
+
+
+def eventi_giornate(data: Dict[str, Any], path: str, solo_storico: bool) -> Tuple[List[Event], List[str]]:
+    """
+    Una giornata conclusa per ogni valore di "giornata". Senza solo_storico applica anche gli
+    esiti ai totali (punti, debiti, malloppo) come /esiti; con solo_storico i totali li contengono già.
+    """
+    per_giornata: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    errori = []
+    for i, row in enumerate(_leggi_csv(path, ["giornata", "username", "giocata", "quota", "esito"]), 2):
+        u = _username(data, row["username"].strip())
+        esito = row["esito"].strip().lower()
+        if u is None:
+            errori.append(f"riga {i}: giocatore sconosciuto {row['username']!r}")
+            continue
+        if esito not in ("vinta", "persa"):
+            errori.append(f"riga {i}: esito {row['esito']!r} (vinta o persa)")
+            continue
+        try:
+            quota = float(row["quota"].replace(",", "."))
+        except ValueError:
+            errori.append(f"riga {i}: quota non valida {row['quota']!r}")
+            continue
+        per_giornata.setdefault(str(int(row["giornata"])), {})[u] = {
+            "giocata": row["giocata"].strip(), "quota": quota, "jolly": False, "esito": esito}
+
+    events: List[Event] = []
+    for g, bets in sorted(per_giornata.items(), key=lambda kv: int(kv[0])):
+        events.append({"type": "giornata_imported", "g": g, "bets": bets})
+        if not solo_storico:
+            events.append({"type": "outcomes_applied", "g": g,
+                           "losers": [u for u, b in bets.items() if b["esito"] == "persa"],
+                           "roster": {u: roster(data)[u] for u in bets}})
+    return events, errori
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Operazioni in blocco sullo stato di un gruppo (a bot fermo)")
+    ap.add_argument("stato", help="chat_id del gruppo oppure percorso di data.json / data.sqlite")
+    comune = argparse.ArgumentParser(add_help=False)
+    comune.add_argument("--dry-run", action="store_true", help="controlla senza scrivere nulla")
+    sub = ap.add_subparsers(dest="comando", required=True)
+    sub.add_parser("migra", parents=[comune], help="applica le migrazioni non ancora applicate")
+    p = sub.add_parser("versamenti", parents=[comune], help="CSV username,euro")
+    p.add_argument("csv")
+    p = sub.add_parser("giornate", parents=[comune], help="CSV giornata,username,giocata,quota,esito")
+    p.add_argument("csv")
+    p.add_argument("--solo-storico", action="store_true", help="non aggiornare punti, debiti e malloppo")
+    args = ap.parse_args()
+
+    store = apri(args.stato)
+    try:
+        if args.comando == "migra":
+            events, righe = eventi_migra(store.data)
+        elif args.comando == "versamenti":
+            events, righe = eventi_versamenti(store.data, args.csv)
+        else:
+            events, righe = eventi_giornate(store.data, args.csv, args.solo_storico)
+        if args.comando != "migra" and righe:
+            raise SystemExit("❌ Nessuna modifica applicata:\n" + "\n".join(f"- {r}" for r in righe))
+        if not events:
+            print("Niente da applicare.")
+            return
+        n, err = applica_lotto(store, events, dry_run=args.dry_run)
+        if err:
+            raise SystemExit(f"❌ Nessuna modifica applicata.\n{err}")
+        for r in righe:
+            print(f"- {r}")
+        if args.dry_run:
+            print(f"Dry run: {n} modifiche valide, nulla è stato scritto.")
+        else:
+            store.flush()
+            print(f"✅ {n} modifiche applicate in una sola transazione.")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+G1 giocata prima del bot (era "# hotfix_g1.py"): la inserisce conclusa nello storico con chi
+ha sbagliato e porta a 1 i loro punti in classifica. Il malloppo non cambia: i 25€ della G1
+c'erano già. Se la G1 esiste già non fa nulla.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List
+
+from events import Event
+from game_utils import LEGACY_ROSTER
+
+DESCRIZIONE = "G1 storica con i cinque che hanno sbagliato"
+
+LOSERS = ["Fruca", "Pavi", "Chri", "Gio", "Gargiu"]
+
+
+def eventi(data: Dict[str, Any]) -> List[Event]:
+    if "1" in data["bets"]:
+        return []
+    name_to_username = {v: k for k, v in (data.get("roster") or LEGACY_ROSTER).items()}
+    bets = {
+        name_to_username[name]: {
+            "giocata": "import-manuale",
+            "quota": 1.50,
+            "jolly": False,
+            "tipo_verifica": "combo_esito",
+            "dati_verifica": {},
+            "esito": "persa"
+        }
+        for name in LOSERS
+    }
+    out: List[Event] = [{"type": "giornata_imported", "g": "1", "bets": bets}]
+    for name in LOSERS:
+        player = data["players"].get(name)
+        if player is not None and player.points < 1:
+            out.append({"type": "player_adjusted", "player": name, "points": 1 - player.points,
+                        "motivo": "G1 storica sbagliata"})
+    return out
@@ -0,0 +1,359 @@
+from __future__ import annotations
+from dataclasses import dataclass, field, fields
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
+
+# Modello tipizzato dello stato di un gruppo.
+# Il documento resta un dict di primo livello (rosa, admin, impostazioni, ...), ma giocatori,
+# giornate, giocate e malloppo sono dataclass con __slots__: meno memoria per gruppo e accesso
+# ai campi senza .get(..., default). Lo schema è validato una volta sola, al caricamento
+# (load); i file scritti da versioni precedenti vengono aggiornati da upgrade().
+
+# 1: dict senza tipi (data.json storico, con "games", "jornate_status", "giornate" lista o dict)
+# 2: giocatori, giornate, giocate e malloppo tipizzati; "bets" è l'unico elenco delle giornate
+# 3: registro dei movimenti di denaro ("movimenti"), in sola aggiunta
+SCHEMA_VERSION = 3
+
+STATI_GIORNATA = ("assigned", "started", "finished")
+ESITI = ("vinta", "persa")
+
+# Euro per ogni giocata persa
+QUOTA_PERSA_EUR = 5
+
+# Movimenti del registro: i debiti aumentano quanto il giocatore deve, i crediti lo riducono
+DEBITI = ("persa", "penale_jolly", "rettifica_debito", "apertura_debito")
+CREDITI = ("versamento", "rettifica_versato", "apertura_versato")
+
+_INTERN: Dict[str, str] = {s: s for s in STATI_GIORNATA + ESITI + DEBITI + CREDITI}
+
+# Chiavi del data.json storico che non usa più nessuno
+_LEGACY_KEYS = ("games", "jornate_status", "giornate")
+
+
+class SchemaError(ValueError):
+    """Documento che non rispetta lo schema: `path` indica dove (es. bets.3.bets.@user.quota)."""
+
+    def __init__(self, path: str, msg: str):
+        super().__init__(f"{path}: {msg}")
+        self.path = path
+
+
+_NULL = type(None)
+
+
+def _check(path: str, value: Any, types: Tuple[type, ...]) -> Any:
+    # bool è un int: un contatore True/False è quasi sempre un errore
+    if not isinstance(value, types) or (value.__class__ is bool and bool not in types):
+        raise SchemaError(path, f"atteso {'/'.join(t.__name__ for t in types)}, trovato {value!r}")
+    return value
+
+
+def _build(cls, d: Any, path: str):
+    """Istanza di cls dai campi di d, con i tipi di cls._TIPI (il percorso dell'errore solo se serve)."""
+    _check(path, d, (dict,))
+    try:
+        obj = cls(**d)
+    except TypeError:
+        raise SchemaError(path, f"campi sconosciuti {sorted(set(d) - set(cls.__slots__))}") from None
+    for k, types in cls._TIPI:
+        v = getattr(obj, k)
+        if not isinstance(v, types) or (v.__class__ is bool and bool not in types):
+            _check(f"{path}.{k}", v, types)
+    return obj
+
+
+def _mappa(d: Any, path: str, types: Tuple[type, ...]) -> Dict[str, Any]:
+    _check(path, d, (dict,))
+    for k, v in d.items():
+        if not isinstance(v, types) or (v.__class__ is bool and bool not in types):
+            _check(f"{path}.{k}", v, types)
+    return d
+
+
+@dataclass(slots=True)
+class Player:
+    points: int = 0
+    jolly_used: int = 0
+    debt: int = 0
+    paid: int = 0
+
+    _TIPI: ClassVar = (("points", (int,)), ("jolly_used", (int,)), ("debt", (int,)), ("paid", (int,)))
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], path: str = "player") -> "Player":
+        return _build(cls, d, path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"points": self.points, "jolly_used": self.jolly_used, "debt": self.debt, "paid": self.paid}
+
+
+@dataclass(slots=True)
+class Malloppo:
+    giocate_sbagliate: int = 0
+    penali_jolly: int = 0
+    giocate_gruppo: int = 0
+
+    _TIPI: ClassVar = (("giocate_sbagliate", (int,)), ("penali_jolly", (int,)), ("giocate_gruppo", (int,)))
+
+    @property
+    def totale(self) -> int:
+        return self.giocate_sbagliate + self.penali_jolly + self.giocate_gruppo
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], path: str = "malloppo") -> "Malloppo":
+        return _build(cls, d, path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"giocate_sbagliate": self.giocate_sbagliate, "penali_jolly": self.penali_jolly,
+                "giocate_gruppo": self.giocate_gruppo}
+
+
+@dataclass(slots=True)
+class Bet:
+    giocata: str = "(nessuna)"
+    quota: float = 0.0
+    jolly: bool = False
+    esito: Optional[str] = None                     # "vinta" / "persa" dopo gli esiti
+    tipo_verifica: Optional[str] = None             # "mercato" se il testo è stato riconosciuto
+    dati_verifica: Optional[Dict[str, Any]] = None  # markets.to_dati, per l'esito automatico
+
+    _TIPI: ClassVar = (("giocata", (str,)), ("quota", (float, int)), ("jolly", (bool,)),
+                       ("esito", (str, _NULL)), ("tipo_verifica", (str, _NULL)), ("dati_verifica", (dict, _NULL)))
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], path: str = "bet") -> "Bet":
+        b = _build(cls, d, path)
+        if b.esito is not None and b.esito not in ESITI:
+            raise SchemaError(f"{path}.esito", f"esito {b.esito!r} non valido")
+        if b.quota.__class__ is int:
+            b.quota = float(b.quota)
+        # un oggetto per valore invece di una stringa per giocata letta dal JSON
+        if b.esito is not None:
+            b.esito = _INTERN.get(b.esito, b.esito)
+        if b.tipo_verifica is not None:
+            b.tipo_verifica = _INTERN.setdefault(b.tipo_verifica, b.tipo_verifica)
+        return b
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"giocata": self.giocata, "quota": self.quota, "jolly": self.jolly}
+        for k in ("tipo_verifica", "dati_verifica", "esito"):
+            v = getattr(self, k)
+            if v is not None:
+                out[k] = v
+        return out
+
+
+@dataclass(slots=True)
+class Giornata:
+    status: str = "assigned"
+    settled: bool = False
+    assignments: Dict[str, str] = field(default_factory=dict)  # Nome -> partita
+    leftover: List[str] = field(default_factory=list)          # partite non assegnate
+    bets: Dict[str, Bet] = field(default_factory=dict)         # '@username' -> giocata
+    bloccate: List[str] = field(default_factory=list)          # '@username' con la partita già iniziata
+    penali: Dict[str, int] = field(default_factory=dict)       # '@username' -> penali jolly in euro
+    risultati: Dict[str, List[int]] = field(default_factory=dict)  # partita -> [gol casa, gol ospite]
+    summary_message_id: Optional[int] = None
+    pinned_summary_id: Optional[int] = None
+    stagione: Optional[str] = None  # stagione del calendario da cui è stata estratta
+
+    _TIPI: ClassVar = (("status", (str,)), ("settled", (bool,)), ("leftover", (list,)), ("bloccate", (list,)),
+                       ("summary_message_id", (int, _NULL)), ("pinned_summary_id", (int, _NULL)),
+                       ("stagione", (str, _NULL)))
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], path: str = "giornata") -> "Giornata":
+        # le giornate scritte prima degli stati erano tutte concluse
+        if "status" not in _check(path, d, (dict,)) or "settled" not in d:
+            status = d.get("status", "finished")
+            d = dict(d, status=status, settled=d.get("settled", status == "finished"))
+        g = _build(cls, d, path)
+        if g.status not in STATI_GIORNATA:
+            raise SchemaError(f"{path}.status", f"stato {g.status!r} non valido")
+        g.status = _INTERN[g.status]
+        _mappa(g.assignments, f"{path}.assignments", (str,))
+        _mappa(g.penali, f"{path}.penali", (int,))
+        _mappa(g.risultati, f"{path}.risultati", (list,))
+        g.bets = {u: Bet.from_dict(b, f"{path}.bets.{u}") for u, b in _mappa(g.bets, f"{path}.bets", (dict,)).items()}
+        return g
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "assignments": self.assignments,
+            "leftover": self.leftover,
+            "bets": {u: b.to_dict() for u, b in self.bets.items()},
+            "status": self.status,
+            "settled": self.settled,
+        }
+        for k in ("bloccate", "penali", "risultati", "summary_message_id", "pinned_summary_id", "stagione"):
+            v = getattr(self, k)
+            if v:
+                out[k] = v
+        return out
+
+
+@dataclass(slots=True)
+class Movimento:
+    giocatore: str
+    tipo: str                       # uno di DEBITI o CREDITI
+    euro: int
+    giornata: Optional[int] = None  # giornata corrente quando è avvenuto (None: prima del registro)
+    ts: Optional[int] = None        # unix time (None: ricostruito dallo storico)
+    da: Optional[str] = None        # '@username' di chi l'ha registrato (versamenti)
+
+    _TIPI: ClassVar = (("giocatore", (str,)), ("tipo", (str,)), ("euro", (int,)), ("giornata", (int, _NULL)),
+                       ("ts", (int, _NULL)), ("da", (str, _NULL)))
+
+    @property
+    def variazione(self) -> int:
+        """Effetto sul saldo (quanto il giocatore deve): positivo per i debiti, negativo per i crediti."""
+        return self.euro if self.tipo in DEBITI else -self.euro
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], path: str = "movimento") -> "Movimento":
+        m = _build(cls, d, path)
+        if m.tipo not in DEBITI and m.tipo not in CREDITI:
+            raise SchemaError(f"{path}.tipo", f"tipo {m.tipo!r} non valido")
+        m.tipo = _INTERN[m.tipo]
+        return m
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"giocatore": self.giocatore, "tipo": self.tipo, "euro": self.euro}
+        for k in ("giornata", "ts", "da"):
+            v = getattr(self, k)
+            if v is not None:
+                out[k] = v
+        return out
+
+
+# Forma delle dataclass (nomi dei campi, in ordine): cambia anche se si aggiunge o rinomina un campo
+# senza toccare SCHEMA_VERSION. Gli snapshot binari (vedi state_store) valgono solo con la stessa impronta
+IMPRONTA = (SCHEMA_VERSION,) + tuple((cls.__name__,) + tuple(f.name for f in fields(cls))
+                                     for cls in (Player, Malloppo, Bet, Giornata, Movimento))
+
+
+def to_json(o: Any) -> Any:
+    """`default` di json.dumps per i documenti con le dataclass del modello."""
+    try:
+        return o.to_dict()
+    except AttributeError:
+        raise TypeError(f"{type(o).__name__} non serializzabile") from None
+
+
+def upgrade(raw: Dict[str, Any]) -> bool:
+    """
+    Porta (sul posto) un documento JSON allo schema corrente. Ritorna True se ha cambiato qualcosa.
+    Da 1 a 2: le giornate della vecchia "giornate" (lista di numeri o dict {"1": {"errors": [nomi]}})
+    che mancano in "bets" diventano giornate finite con i perdenti segnati; "games",
+    "jornate_status" e "giornate" (ora ricavabile da "bets") spariscono; ai giocatori si aggiunge "paid".
+    Da 2 a 3: il registro "movimenti" viene ricostruito dallo storico (vedi _registro_iniziale).
+    """
+    version = raw.get("schema", 1)
+    if version > SCHEMA_VERSION:
+        raise SchemaError("schema", f"versione {version} più recente di questo bot ({SCHEMA_VERSION})")
+    if version == SCHEMA_VERSION:
+        return False
+    if version < 2:
+        _upgrade_2(raw)
+    if version < 3:
+        raw["movimenti"] = _registro_iniziale(raw)
+    raw["schema"] = SCHEMA_VERSION
+    return True
+
+
+def _upgrade_2(raw: Dict[str, Any]) -> None:
+    bets = raw.setdefault("bets", {})
+    legacy = raw.get("giornate")
+    # ogni giornata della vecchia "giornate" manca in "bets" solo se è precedente al bot:
+    # la si aggiunge conclusa, così la numerazione (next_giornata) non cambia
+    if isinstance(legacy, list):
+        legacy = {str(g): {} for g in legacy}
+    if isinstance(legacy, dict):
+        name_to_username = {v: k for k, v in raw.get("roster", {}).items()}
+        for g_key, info in legacy.items():
+            if g_key in bets:
+                continue
+            errors = info.get("errors", []) if isinstance(info, dict) else []
+            bets[g_key] = {"status": "finished", "settled": True, "bets": {
+                name_to_username.get(name, name): {"giocata": "import-manuale", "quota": 0.0,
+                                                   "jolly": False, "esito": "persa"}
+                for name in errors}}
+    for k in _LEGACY_KEYS:
+        raw.pop(k, None)
+    for p in raw.get("players", {}).values():
+        if isinstance(p, dict):
+            p.setdefault("paid", 0)
+
+
+def _registro_iniziale(raw: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Movimenti che spiegano i debiti/versati già presenti: giocate perse e penali jolly dello
+    storico (per i giocatori in rosa) e, per quello che lo storico non spiega, un saldo di
+    apertura. I versamenti fatti prima del registro restano un unico "apertura_versato".
+    """
+    roster = raw.get("roster", {})
+    players = raw.get("players", {})
+    movimenti: List[Dict[str, Any]] = []
+    spiegato: Dict[str, int] = {}
+    bets = raw.get("bets", {})
+    for g_key in sorted(bets, key=int):
+        g = bets[g_key]
+        for u, b in g.get("bets", {}).items():
+            if b.get("esito") == "persa" and roster.get(u) in players:
+                movimenti.append({"giocatore": roster[u], "tipo": "persa", "euro": QUOTA_PERSA_EUR,
+                                  "giornata": int(g_key)})
+        for u, eur in g.get("penali", {}).items():
+            if roster.get(u) in players:
+                movimenti.append({"giocatore": roster[u], "tipo": "penale_jolly", "euro": eur,
+                                  "giornata": int(g_key)})
+    for m in movimenti:
+        spiegato[m["giocatore"]] = spiegato.get(m["giocatore"], 0) + m["euro"]
+    apertura = []
+    for name, p in players.items():
+        resto = p.get("debt", 0) - spiegato.get(name, 0)
+        if resto:
+            apertura.append({"giocatore": name, "tipo": "apertura_debito", "euro": resto})
+        if p.get("paid"):
+            apertura.append({"giocatore": name, "tipo": "apertura_versato", "euro": p["paid"]})
+    return apertura + movimenti
+
+
+def load(raw: Dict[str, Any], legacy: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Documento JSON -> documento tipizzato (sul posto), dopo upgrade() e con la validazione
+    dello schema. Ritorna (documento, aggiornato) dove aggiornato dice se va riscritto su disco.
+    legacy ({"roster": ..., "admins": ...}) completa un data.json antecedente alle rose per gruppo:
+    va messo prima di upgrade(), che dalla rosa ricostruisce giocate perse e registro dei movimenti.
+    """
+    _check("documento", raw, (dict,))
+    seeded = legacy is not None and "roster" not in raw
+    if seeded:
+        raw["roster"] = dict(legacy["roster"])
+        raw["admins"] = list(legacy["admins"])
+    upgraded = upgrade(raw) or seeded
+    raw["players"] = {name: Player.from_dict(p, f"players.{name}")
+                      for name, p in _check("players", raw.get("players", {}), (dict,)).items()}
+    raw["malloppo"] = Malloppo.from_dict(raw.get("malloppo", {}))
+    bets = _check("bets", raw.get("bets", {}), (dict,))
+    for g_key in bets:
+        if not str(g_key).isdigit():
+            raise SchemaError(f"bets.{g_key}", "la chiave di una giornata è il suo numero")
+    raw["bets"] = {g_key: Giornata.from_dict(g, f"bets.{g_key}") for g_key, g in bets.items()}
+    raw["movimenti"] = [Movimento.from_dict(m, f"movimenti.{i}")
+                        for i, m in enumerate(_check("movimenti", raw.get("movimenti", []), (list,)))]
+    for k in ("roster", "user_ids"):
+        _check(k, raw.get(k, {}), (dict,))
+    _check("admins", raw.get("admins", []), (list,))
+    return raw, upgraded
+
+
+def new_group() -> Dict[str, Any]:
+    """Documento JSON di un gruppo appena creato (passa comunque da load)."""
+    return {
+        "schema": SCHEMA_VERSION,
+        "players": {},
+        "malloppo": Malloppo().to_dict(),
+        "bets": {},
+        "movimenti": [],
+        "roster": {},
+        "admins": []
+    }
@@ -0,0 +1,181 @@
+from __future__ import annotations
+import asyncio, os
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Hashable, List, Optional, Set
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from rate_limit import IN_BLOCCO, BucketPool, TokenBucket
+from summary import CHAT_MSG_PER_MIN, MAX_RETRIES, _seconds
+
+# Limite globale di Telegram: ~30 messaggi al secondo per bot, in tutte le chat (teniamo un margine)
+OUTBOX_GLOBAL_PER_SEC = float(os.getenv("OUTBOX_GLOBAL_PER_SEC", "25"))
+# Gettoni del bucket globale che i messaggi in coda lasciano alle risposte ai comandi
+OUTBOX_RISERVA = float(os.getenv("OUTBOX_RISERVA", "3"))
+# Chat private: ~1 messaggio al secondo per chat
+OUTBOX_PRIVATE_PER_SEC = float(os.getenv("OUTBOX_PRIVATE_PER_SEC", "1"))
+# Attesa prima di riprovare dopo un errore di rete (raddoppia a ogni tentativo)
+OUTBOX_BACKOFF = float(os.getenv("OUTBOX_BACKOFF", "1"))
+# Menzioni per messaggio: oltre, Telegram non notifica tutti i menzionati
+OUTBOX_MENTIONS_PER_MSG = int(os.getenv("OUTBOX_MENTIONS_PER_MSG", "20"))
+MAX_MSG_LEN = 4096
+
+
+def mention_batches(header: str, usernames: List[str],
+                    per_msg: int = OUTBOX_MENTIONS_PER_MSG, max_len: int = MAX_MSG_LEN) -> List[str]:
+    """Testi "header + menzioni" con tutte le menzioni nel minor numero di messaggi."""
+    out: List[str] = []
+    batch: List[str] = []
+    for u in usernames:
+        if batch and (len(batch) >= per_msg or len(header) + len(", ".join(batch + [u])) > max_len):
+            out.append(header + ", ".join(batch))
+            batch = []
+        batch.append(u)
+    if batch:
+        out.append(header + ", ".join(batch))
+    return out
+
+
+class _Msg:
+    __slots__ = ("chat_id", "text", "kwargs", "key", "future")
+
+    def __init__(self, chat_id: Hashable, text: str, kwargs: Dict[str, Any], key: Optional[Hashable]):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.key = key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class Outbox:
+    """
+    Coda condivisa dei messaggi in uscita (solleciti, avvisi del calendario).
+    - una coda e un task per chat, così una chat lenta non ferma le altre;
+    - ogni invio prende un gettone dal bucket della chat (gruppi ~20/min, privati ~1/s);
+      il bucket globale (~30/s) lo applica la richiesta HTTP ai messaggi del bot (acquire_global,
+      vedi bot._CountingRequest): code e riepiloghi lo aspettano, le risposte ai comandi lo
+      consumano senza aspettare, così restano immediate e il traffico in blocco rallenta;
+    - su RetryAfter sospende la chat per il tempo chiesto, sugli errori di rete riprova con backoff;
+      BadRequest e Forbidden falliscono subito;
+    - un messaggio con la stessa `key` di uno ancora in coda lo sostituisce invece di accodarsi.
+    I contatori sono in `stats`.
+    """
+
+    def __init__(self, chat_buckets: Optional[BucketPool] = None,
+                 private_buckets: Optional[BucketPool] = None,
+                 global_bucket: Optional[TokenBucket] = None):
+        self.chat_buckets = chat_buckets or BucketPool(rate=CHAT_MSG_PER_MIN / 60, capacity=3)
+        self.private_buckets = private_buckets or BucketPool(rate=OUTBOX_PRIVATE_PER_SEC, capacity=1)
+        self.global_bucket = global_bucket or TokenBucket(OUTBOX_GLOBAL_PER_SEC, capacity=OUTBOX_RISERVA + 1)
+        self._queues: Dict[Hashable, Deque[_Msg]] = {}
+        self._keys: Dict[Hashable, _Msg] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats: Dict[str, int] = {"queued": 0, "sent": 0, "coalesced": 0,
+                                      "retry_after": 0, "retries": 0, "errors": 0}
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def bucket(self, chat_id: Hashable) -> TokenBucket:
+        # gli id delle chat private sono positivi, quelli dei gruppi negativi
+        private = isinstance(chat_id, int) and chat_id > 0
+        return (self.private_buckets if private else self.chat_buckets).get(chat_id)
+
+    def send(self, bot: Any, chat_id: Hashable, text: str, key: Optional[Hashable] = None,
+             **kwargs) -> asyncio.Future:
+        """Accoda un messaggio; il future si risolve col Message inviato (o con l'errore)."""
+        old = self._keys.get(key) if key is not None else None
+        if old is not None and not old.future.done():
+            old.text, old.kwargs = text, kwargs
+            self.stats["coalesced"] += 1
+            return old.future
+        msg = _Msg(chat_id, text, kwargs, key)
+        if key is not None:
+            self._keys[key] = msg
+        self._queues.setdefault(chat_id, deque()).append(msg)
+        self.stats["queued"] += 1
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.get_running_loop().create_task(self._worker(bot, chat_id))
+        return msg.future
+
+    def spawn(self, coro: Awaitable) -> asyncio.Task:
+        """Lancia in background un lavoro che usa la coda (aspettato da drain)."""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def acquire_global(self) -> None:
+        """
+        Gettone del bucket globale per una chiamata che manda o modifica un messaggio. Solo il
+        traffico in blocco (IN_BLOCCO) aspetta, lasciando OUTBOX_RISERVA gettoni; le risposte ai
+        comandi non aspettano mai: prendono il gettone anche a debito e il blocco rallenta.
+        """
+        if IN_BLOCCO.get():
+            await self.global_bucket.acquire(reserve=OUTBOX_RISERVA)
+        else:
+            self.global_bucket.spend()
+
+    async def _worker(self, bot: Any, chat_id: Hashable) -> None:
+        IN_BLOCCO.set(True)  # il task ha un suo contesto: vale solo per i suoi invii
+        queue = self._queues[chat_id]
+        bucket = self.bucket(chat_id)
+        try:
+            while queue:
+                await bucket.acquire()
+                msg = queue.popleft()  # dopo l'attesa: nel frattempo il testo può essere stato sostituito
+                if msg.key is not None and self._keys.get(msg.key) is msg:
+                    del self._keys[msg.key]
+                await self._deliver(bot, bucket, msg)
+        finally:
+            del self._workers[chat_id]
+            self._queues.pop(chat_id, None)
+            for msg in queue:  # rimasti in coda solo se il worker è stato cancellato (drain)
+                msg.future.cancel()
+
+    async def _deliver(self, bot: Any, bucket: TokenBucket, msg: _Msg) -> None:
+        for attempt in range(MAX_RETRIES):
+            try:
+                m = await bot.send_message(chat_id=msg.chat_id, text=msg.text, **msg.kwargs)
+            except RetryAfter as e:
+                self.stats["retry_after"] += 1
+                bucket.block_for(_seconds(e.retry_after))
+                error = e
+            except (BadRequest, Forbidden) as e:
+                # definitivi (chat inesistente, bot mai avviato o bloccato): riprovare consuma
+                # solo gettoni e ritarda il ripiego (es. la menzione nel gruppo dei solleciti)
+                error = e
+                break
+            except (TimedOut, NetworkError) as e:
+                self.stats["retries"] += 1
+                await asyncio.sleep(OUTBOX_BACKOFF * 2 ** attempt)
+                error = e
+            except Exception as e:
+                error = e
+                break
+            else:
+                self.stats["sent"] += 1
+                if not msg.future.done():
+                    msg.future.set_result(m)
+                return
+            if attempt < MAX_RETRIES - 1:
+                await bucket.acquire()
+        self.stats["errors"] += 1
+        if not msg.future.done():
+            msg.future.set_exception(error)
+            msg.future.exception()  # chi non aspetta il risultato non deve far comparire warning
+
+    async def drain(self, timeout: float = 10) -> None:
+        """Allo shutdown: aspetta (al massimo timeout secondi) i messaggi in coda, poi rinuncia."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            # i lavori in background possono accodare nuovi messaggi (e far partire nuovi worker)
+            pending = self._tasks | set(self._workers.values())
+            if not pending or loop.time() >= deadline:
+                break
+            await asyncio.wait(pending, timeout=deadline - loop.time())
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
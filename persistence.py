@@ -0,0 +1,141 @@
+from __future__ import annotations
+import asyncio, json, os
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from state_store import BaseStore
+
+# Ogni quanti secondi PTB passa alla persistenza i chat_data/user_data toccati
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+class StorePersistence(BasePersistence):
+    """
+    Persistenza di PTB (chat_data, user_data, bot_data, conversazioni) dentro lo stato del bot:
+    ogni voce sta in data["persistenza"][tipo][chiave] dello store restituito da get_store(),
+    e ogni modifica è un evento "persistence_updated" nel journal.
+
+    A differenza di PicklePersistence non riscrive tutto a ogni giro: per ogni voce tiene
+    il JSON dell'ultima versione salvata e scrive solo quelle cambiate, tutte quelle di uno
+    stesso giro di update_persistence in un unico evento. I valori devono essere JSON
+    (niente set: usare liste).
+    """
+
+    def __init__(self, get_store: Callable[[], BaseStore], update_interval: float = PERSISTENCE_INTERVAL):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.get_store = get_store
+        self._last: Dict[Tuple[str, str], str] = {}          # ultima versione scritta, come JSON
+        self._pending: Dict[Tuple[str, str], Any] = {}
+        self.stats: Dict[str, int] = {"updates": 0, "skipped": 0, "written": 0, "batches": 0}
+
+    # ---- lettura (all'avvio) ----
+    def _bucket(self, kind: str) -> Dict[str, Any]:
+        return self.get_store().data.get("persistenza", {}).get(kind, {})
+
+    def _load(self, kind: str) -> Dict[str, Any]:
+        out = {}
+        for key, value in self._bucket(kind).items():
+            self._last[(kind, key)] = _dumps(value)
+            out[key] = json.loads(self._last[(kind, key)])  # copia: PTB la modifica in place
+        return out
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {int(k): v for k, v in self._load("chat_data").items()}
+
+    async def get_user_data(self) -> Dict[int, Any]:
+        return {int(k): v for k, v in self._load("user_data").items()}
+
+    async def get_bot_data(self) -> Any:
+        return self._load("bot_data").get("", {})
+
+    async def get_callback_data(self) -> Optional[Any]:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[Any, ...], object]:
+        return {tuple(json.loads(k)): v for k, v in self._load(f"conversations:{name}").items()}
+
+    # ---- scrittura (solo le voci cambiate, a lotti) ----
+    def _serializable(self, kind: str, key: str, value: Any) -> Tuple[Any, str]:
+        try:
+            return value, _dumps(value)
+        except TypeError:
+            pass
+        # tengo le chiavi serializzabili e segnalo le altre
+        kept = {}
+        for k, v in (value or {}).items():
+            try:
+                _dumps(v)
+                kept[k] = v
+            except TypeError:
+                print(f"⚠️ Persistenza: {kind}[{key}][{k!r}] non è JSON, non viene salvato", flush=True)
+        return kept, _dumps(kept)
+
+    async def _queue(self, kind: str, key: str, value: Any) -> None:
+        self.stats["updates"] += 1
+        if value is None or value == {}:
+            value = text = None  # vuoto = niente da salvare
+        else:
+            value, text = self._serializable(kind, key, value)
+        if self._last.get((kind, key)) == text:
+            self.stats["skipped"] += 1
+            return
+        self._pending[(kind, key)] = value
+        # PTB lancia gli update_* di un giro con asyncio.gather: aspettando un giro di loop
+        # arrivano tutti in _pending e il primo che riprende li scrive in un solo evento
+        await asyncio.sleep(0)
+        self._write_pending()
+
+    def _write_pending(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self.get_store().apply({
+            "type": "persistence_updated",
+            "entries": [[kind, key, value] for (kind, key), value in pending.items()]
+        })
+        for (kind, key), value in pending.items():
+            if value is None:
+                self._last.pop((kind, key), None)
+            else:
+                self._last[(kind, key)] = _dumps(value)
+        self.stats["written"] += len(pending)
+        self.stats["batches"] += 1
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        await self._queue("chat_data", str(chat_id), data)
+
+    async def update_user_data(self, user_id: int, data: Any) -> None:
+        await self._queue("user_data", str(user_id), data)
+
+    async def update_bot_data(self, data: Any) -> None:
+        await self._queue("bot_data", "", data)
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: Tuple[Any, ...], new_state: Optional[object]) -> None:
+        await self._queue(f"conversations:{name}", _dumps(list(key)), new_state)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self._queue("chat_data", str(chat_id), None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._queue("user_data", str(user_id), None)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Any) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
+
+    async def flush(self) -> None:
+        self._write_pending()
+        await self.get_store().flush_async()
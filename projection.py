@@ -0,0 +1,89 @@
+from __future__ import annotations
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from events import QUOTA_PERSA_EUR
+from model import Player
+
+PROIEZIONE_SIMULAZIONI = int(os.getenv("PROIEZIONE_SIMULAZIONI", "100000"))
+QUANTILI = (0.1, 0.5, 0.9)
+# Quota usata per chi non ha ancora giocato nulla (e nessuno nel gruppo ha storico)
+QUOTA_DEFAULT = 1.8
+
+
+def giornate_rimaste(data: Dict[str, Any], calendario: Dict[str, List[str]]) -> int:
+    """Giornate del calendario dopo l'ultima con gli esiti già applicati."""
+    regolate = [int(g) for g, entry in data.get("bets", {}).items()
+                if any(b.esito is not None for b in entry.bets.values())]
+    ultima = max(regolate, default=0)
+    return sum(1 for g in calendario if int(g) > ultima)
+
+
+def _quote(data: Dict[str, Any], username: str) -> List[float]:
+    out = []
+    for g in data.get("bets", {}).values():
+        b = g.bets.get(username)
+        if b is not None and b.quota > 1:
+            out.append(b.quota)
+    return out
+
+
+def proiezione(data: Dict[str, Any], n_giornate: int, min_quota: float, tot_jolly: int, penale: float,
+               n_sim: int = PROIEZIONE_SIMULAZIONI, rng: Optional[np.random.Generator] = None
+               ) -> Dict[str, Dict[str, Any]]:
+    """
+    Monte Carlo del resto della stagione, tutte le simulazioni insieme (array n_sim × giocatori).
+
+    Per ogni giocatore le quote giocate finora danno, con probabilità implicita 1/quota:
+    a = frazione di giornate giocate come jolly (quota < min_quota), lj e ln = probabilità di
+    perdere con e senza jolly. Allora, sulle n_giornate rimaste:
+      jolly ~ Bin(n, a), perse ~ Bin(jolly, lj) + Bin(n - jolly, ln)
+    e le penali del ciclo dei jolly (vedi /gioca) sono max(0, (jolly_usati + jolly - 1) // tot_jolly).
+    Ritorna per nome: punti e debito finali (quantili), penali medie, probabilità di finire col debito più alto.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    names = list(data.get("roster", {}).values())
+    usernames = list(data.get("roster", {}).keys())
+    if not names:
+        return {}
+    gruppo = [q for u in usernames for q in _quote(data, u)] or [QUOTA_DEFAULT]
+
+    a, lj, ln = np.zeros(len(names)), np.zeros(len(names)), np.zeros(len(names))
+    for i, u in enumerate(usernames):
+        q = np.array(_quote(data, u) or gruppo)
+        jolly = q < min_quota
+        perdita = 1 - np.minimum(1.0, 1 / q)
+        a[i] = jolly.mean()
+        lj[i] = perdita[jolly].mean() if jolly.any() else 0.0
+        ln[i] = perdita[~jolly].mean() if (~jolly).any() else 0.0
+
+    players = data.get("players", {})
+    vuoto = Player()
+    punti0 = np.array([players.get(n, vuoto).points for n in names])
+    debito0 = np.array([players.get(n, vuoto).debt for n in names], dtype=float)
+    usati0 = np.array([players.get(n, vuoto).jolly_used for n in names])
+
+    shape = (n_sim, len(names))
+    jolly = rng.binomial(n_giornate, a, size=shape)
+    perse = rng.binomial(jolly, lj) + rng.binomial(n_giornate - jolly, ln)
+    penali = np.maximum(0, (usati0 + jolly - 1) // tot_jolly)
+    punti = punti0 + perse
+    debito = debito0 + perse * QUOTA_PERSA_EUR + penali * penale
+
+    # chi finisce col debito più alto (a pari merito si divide)
+    top = debito == debito.max(axis=1, keepdims=True)
+    p_top = (top / top.sum(axis=1, keepdims=True)).mean(axis=0)
+    q_punti = np.quantile(punti, QUANTILI, axis=0)
+    q_debito = np.quantile(debito, QUANTILI, axis=0)
+
+    return {
+        n: {
+            "punti": q_punti[:, i].tolist(),
+            "debito": q_debito[:, i].tolist(),
+            "penali": float(penali[:, i].mean()),
+            "p_top": float(p_top[i]),
+        }
+        for i, n in enumerate(names)
+    }
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import asyncio, contextvars, time
+from collections import OrderedDict
+from typing import Hashable
+
+# True nei task del traffico in blocco (code dell'outbox, riepiloghi in pin): le loro chiamate
+# cedono il passo alle risposte ai comandi sul bucket globale (vedi outbox.Outbox.acquire_global)
+IN_BLOCCO: contextvars.ContextVar[bool] = contextvars.ContextVar("in_blocco", default=False)
+
+
+class TokenBucket:
+    """
+    Token bucket asincrono: `rate` gettoni al secondo, al massimo `capacity` accumulati.
+    block_for() sospende il bucket (es. dopo un RetryAfter di Telegram).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def block_for(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def idle(self) -> bool:
+        """True se il bucket è pieno e non bloccato (si può buttare senza perdere informazioni)."""
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self._blocked_until
+
+    def spend(self, n: float = 1) -> None:
+        """Prende n gettoni senza aspettare (chi ha la precedenza): il debito, al massimo `capacity`, lo paga acquire."""
+        self._refill(time.monotonic())
+        self.tokens = max(self.tokens - n, -self.capacity)
+
+    async def acquire(self, n: float = 1, reserve: float = 0) -> None:
+        """Prende n gettoni lasciandone almeno `reserve` nel bucket (per chi ha la precedenza)."""
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= n + reserve:
+                self.tokens -= n
+                return
+            await asyncio.sleep((n + reserve - self.tokens) / self.rate)
+
+
+class BucketPool:
+    """Un TokenBucket per chiave (es. chat_id); i bucket inattivi oltre max_size vengono scartati."""
+
+    def __init__(self, rate: float, capacity: float, max_size: int = 10_000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_size = max_size
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def get(self, key: Hashable) -> TokenBucket:
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self._buckets) > self.max_size:
+                for k in list(self._buckets.keys())[: len(self._buckets) // 10]:
+                    if self._buckets[k].idle():
+                        del self._buckets[k]
+        else:
+            self._buckets.move_to_end(key)
+        return b
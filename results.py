@@ -0,0 +1,246 @@
+"""
+Scarico dei risultati finali delle partite di una giornata.
+
+- una Source sa costruire l'URL di una partita ("Inter-Torino") e leggerne il punteggio dall'HTML;
+  HttpSource scarica da RESULTS_URL_TEMPLATE, DirSource legge file HTML locali (prove senza rete);
+- ResultsIngester scarica tutte le partite in parallelo con un client httpx condiviso
+  (pool di connessioni), richieste condizionali (ETag / Last-Modified) e una cache su disco:
+  un risultato finale non viene più richiesto.
+
+    python results.py 5                     # giornata 5 del calendario comune
+    python results.py 5 --dir risultati/    # da file locali <dir>/Inter-Torino.html
+"""
+from __future__ import annotations
+import argparse, asyncio, contextlib, importlib.util, json, os, re, tempfile, time, unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pagina di una partita; segnaposto: {home} {away} (slug), {fixture}, {giornata}, {competition}, {season}
+RESULTS_URL_TEMPLATE = os.getenv("RESULTS_URL_TEMPLATE", "")
+# Selettori CSS del punteggio ("2-1", "2 - 1") e dello stato della partita
+RESULTS_SCORE_SELECTOR = os.getenv("RESULTS_SCORE_SELECTOR", ".score")
+RESULTS_STATUS_SELECTOR = os.getenv("RESULTS_STATUS_SELECTOR", ".status")
+# Testi dello stato che indicano una partita conclusa (minuscolo)
+RESULTS_FINAL_WORDS = tuple(w.strip() for w in os.getenv(
+    "RESULTS_FINAL_WORDS", "finale,terminata,ft,full time,fine partita").split(","))
+RESULTS_CACHE_PATH = os.getenv("RESULTS_CACHE_PATH", os.path.join(_BASE_DIR, "risultati_cache.json"))
+RESULTS_CONCURRENCY = int(os.getenv("RESULTS_CONCURRENCY", "8"))
+RESULTS_TIMEOUT = float(os.getenv("RESULTS_TIMEOUT", "10"))
+
+Score = Tuple[int, int]
+_SCORE_RE = re.compile(r"(\d+)\s*[-–:]\s*(\d+)")
+
+
+def _html_parser() -> str:
+    # lxml (opzionale, non in requirements.txt) è più veloce di html.parser: si usa solo se installato
+    return "lxml" if importlib.util.find_spec("lxml") is not None else "html.parser"
+
+
+def _slug(name: str) -> str:
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def parse_score(text: str) -> Optional[Score]:
+    m = _SCORE_RE.search(text or "")
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+class Source:
+    """Da dove vengono le pagine delle partite e come si legge il risultato."""
+
+    needs_client = True  # False per le sorgenti che non usano la rete
+
+    def __init__(self, score_selector: str = RESULTS_SCORE_SELECTOR,
+                 status_selector: str = RESULTS_STATUS_SELECTOR,
+                 final_words: Iterable[str] = RESULTS_FINAL_WORDS):
+        self.score_selector = score_selector
+        self.status_selector = status_selector
+        self.final_words = tuple(final_words)
+        self.parser = _html_parser()
+
+    def url_for(self, fixture: str, g_key: str, competition: str, season: str) -> str:
+        raise NotImplementedError
+
+    async def fetch(self, client: Any, url: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], str]:
+        """(status HTTP, header di risposta, corpo)."""
+        raise NotImplementedError
+
+    def parse(self, html: str) -> Tuple[Optional[Score], bool]:
+        """(punteggio, partita conclusa) letti dalla pagina."""
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, self.parser)
+        score_el = soup.select_one(self.score_selector)
+        score = parse_score(score_el.get_text(" ", strip=True)) if score_el else None
+        status_el = soup.select_one(self.status_selector) if self.status_selector else None
+        status = status_el.get_text(" ", strip=True).lower() if status_el else ""
+        final = any(re.search(rf"\b{re.escape(w)}\b", status) for w in self.final_words if w)
+        return score, final
+
+
+class HttpSource(Source):
+    def __init__(self, url_template: str = RESULTS_URL_TEMPLATE, **kwargs):
+        super().__init__(**kwargs)
+        if not url_template:
+            raise ValueError("RESULTS_URL_TEMPLATE non impostato")
+        self.url_template = url_template
+
+    def url_for(self, fixture: str, g_key: str, competition: str, season: str) -> str:
+        home, _, away = fixture.partition("-")
+        return self.url_template.format(home=_slug(home), away=_slug(away), fixture=_slug(fixture),
+                                        giornata=g_key, competition=competition, season=season)
+
+    async def fetch(self, client: Any, url: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], str]:
+        r = await client.get(url, headers=headers)
+        return r.status_code, dict(r.headers), r.text if r.status_code == 200 else ""
+
+
+class DirSource(Source):
+    """Pagine HTML in una cartella (<dir>/<Casa-Ospite>.html): per prove e fixture locali."""
+
+    needs_client = False
+
+    def __init__(self, folder: str, **kwargs):
+        super().__init__(**kwargs)
+        self.folder = folder
+
+    def url_for(self, fixture: str, g_key: str, competition: str, season: str) -> str:
+        return os.path.join(self.folder, f"{fixture}.html")
+
+    async def fetch(self, client: Any, url: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], str]:
+        if not os.path.exists(url):
+            return 404, {}, ""
+        # la mtime fa da Last-Modified, così anche qui si provano le richieste condizionali
+        modified = str(os.stat(url).st_mtime)
+        if headers.get("If-Modified-Since") == modified:
+            return 304, {}, ""
+        with open(url, "r", encoding="utf-8") as f:
+            return 200, {"Last-Modified": modified}, f.read()
+
+
+class ResultCache:
+    """Cache su disco: url -> {etag, last_modified, score, final, checked}."""
+
+    def __init__(self, path: str = RESULTS_CACHE_PATH):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        self._dirty = False
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(url)
+
+    def put(self, url: str, entry: Dict[str, Any]) -> None:
+        self.entries[url] = entry
+        self._dirty = True
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(prefix=".risultati-", suffix=".tmp", dir=folder)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+
+class ResultsIngester:
+    """Scarica in parallelo i risultati delle partite; `stats` conta richieste, 304 e hit della cache."""
+
+    def __init__(self, source: Source, cache: Optional[ResultCache] = None,
+                 concurrency: int = RESULTS_CONCURRENCY, timeout: float = RESULTS_TIMEOUT):
+        self.source = source
+        self.cache = cache if cache is not None else ResultCache()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.stats: Dict[str, int] = {"requests": 0, "not_modified": 0, "cached_final": 0, "errors": 0}
+
+    def _client(self):
+        if not self.source.needs_client:
+            return contextlib.nullcontext()
+        import httpx  # arriva con python-telegram-bot
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        return httpx.AsyncClient(limits=limits, timeout=self.timeout, follow_redirects=True,
+                                 headers={"User-Agent": "autoscommesse-bot"})
+
+    async def _one(self, client: Any, sem: asyncio.Semaphore, fixture: str,
+                   g_key: str, competition: str, season: str) -> Tuple[str, Optional[Score], bool]:
+        url = self.source.url_for(fixture, g_key, competition, season)
+        cached = self.cache.get(url) or {}
+        if cached.get("final"):
+            self.stats["cached_final"] += 1
+            return fixture, tuple(cached["score"]), True
+        headers = {}
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        async with sem:
+            self.stats["requests"] += 1
+            try:
+                status, resp_headers, body = await self.source.fetch(client, url, headers)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"⚠️ {fixture}: {e}", flush=True)
+                return fixture, _score(cached), False
+        if status == 304:
+            self.stats["not_modified"] += 1
+            return fixture, _score(cached), bool(cached.get("final"))
+        if status != 200:
+            self.stats["errors"] += 1
+            return fixture, None, False
+        # il parsing è CPU: fuori dal loop, così le altre richieste proseguono
+        score, final = await asyncio.to_thread(self.source.parse, body)
+        self.cache.put(url, {
+            "etag": resp_headers.get("ETag") or resp_headers.get("etag"),
+            "last_modified": resp_headers.get("Last-Modified") or resp_headers.get("last-modified"),
+            "score": list(score) if score else None,
+            "final": bool(final and score),
+            "checked": int(time.time()),
+        })
+        return fixture, score, bool(final and score)
+
+    async def fetch(self, fixtures: List[str], g_key: str, competition: str, season: str
+                    ) -> Dict[str, Tuple[Optional[Score], bool]]:
+        """partita -> (punteggio o None, conclusa)."""
+        sem = asyncio.Semaphore(self.concurrency)
+        async with self._client() as client:
+            rows = await asyncio.gather(*(self._one(client, sem, f, g_key, competition, season) for f in fixtures))
+        await asyncio.to_thread(self.cache.save)
+        return {f: (score, final) for f, score, final in rows}
+
+
+def _score(entry: Dict[str, Any]) -> Optional[Score]:
+    return tuple(entry["score"]) if entry.get("score") else None
+
+
+def default_source() -> Source:
+    """HttpSource su RESULTS_URL_TEMPLATE, oppure DirSource se è "dir:<cartella>"."""
+    if RESULTS_URL_TEMPLATE.startswith("dir:"):
+        return DirSource(RESULTS_URL_TEMPLATE[4:])
+    return HttpSource()
+
+
+def main() -> None:
+    from schedule import ScheduleService
+    ap = argparse.ArgumentParser(description="Scarica i risultati di una giornata")
+    ap.add_argument("giornata")
+    ap.add_argument("--calendario", default=os.path.join(_BASE_DIR, "giornate.json"))
+    ap.add_argument("--dir", help="legge le pagine da <dir>/<Casa-Ospite>.html invece che dalla rete")
+    args = ap.parse_args()
+    cal = ScheduleService().calendar(args.calendario)
+    source = DirSource(args.dir) if args.dir else default_source()
+    ingester = ResultsIngester(source)
+    results = asyncio.run(ingester.fetch(cal.giornate[args.giornata], args.giornata, cal.competition, cal.season))
+    for fixture, (score, final) in results.items():
+        txt = f"{score[0]}-{score[1]}" if score else "?"
+        print(f"{fixture:<28} {txt}{'' if final else '  (non finale)'}")
+    print(ingester.stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+from __future__ import annotations
+import json, os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+from zoneinfo import ZoneInfo
+
+# Competizione e stagione assegnate ai calendari nel formato storico ({"1": ["Casa-Ospite", ...]})
+DEFAULT_COMPETITION = os.getenv("DEFAULT_COMPETITION", "serie-a")
+DEFAULT_SEASON = os.getenv("DEFAULT_SEASON", "2025-26")
+# Fuso orario dei calci d'inizio scritti senza offset (es. "2025-08-23T18:30")
+KICKOFF_TZ = ZoneInfo(os.getenv("KICKOFF_TZ", "Europe/Rome"))
+
+# Una partita nel file: "Casa-Ospite" oppure {"partita": "Casa-Ospite", "kickoff": "2025-08-23T18:30:00+02:00"}
+Fixture = Union[str, Dict[str, str]]
+
+
+def _teams(fixture: str) -> Tuple[str, str]:
+    home, _, away = fixture.partition("-")
+    return home.strip(), away.strip()
+
+
+def parse_kickoff(value: str) -> float:
+    """Calcio d'inizio ISO 8601 -> timestamp (senza offset vale KICKOFF_TZ)."""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=KICKOFF_TZ)
+    return dt.timestamp()
+
+
+class Calendar:
+    """
+    Calendario di una competizione in una stagione, con indici:
+    - giornate: g_key -> [partite] (nell'ordine del file)
+    - by_fixture: partita -> g_key
+    - by_team: squadra (minuscolo) -> [(g_key, partita)] in ordine di giornata
+    - kickoff: g_key -> {partita: timestamp} per le partite che hanno il calcio d'inizio nel file
+    """
+
+    def __init__(self, competition: str, season: str, giornate: Dict[str, List[Fixture]]):
+        self.competition = competition
+        self.season = season
+        self.giornate: Dict[str, List[str]] = {}
+        self.kickoff: Dict[str, Dict[str, float]] = {}
+        for g_key, fixtures in giornate.items():
+            names = self.giornate[g_key] = []
+            for f in fixtures:
+                if isinstance(f, dict):
+                    names.append(f["partita"])
+                    if f.get("kickoff"):
+                        self.kickoff.setdefault(g_key, {})[f["partita"]] = parse_kickoff(f["kickoff"])
+                else:
+                    names.append(f)
+        self.by_fixture: Dict[str, str] = {}
+        self.by_team: Dict[str, List[Tuple[str, str]]] = {}
+        self.team_names: Dict[str, str] = {}  # minuscolo -> nome come nel calendario
+        for g_key in sorted(giornate, key=int):
+            for fixture in self.giornate[g_key]:
+                self.by_fixture[fixture] = g_key
+                for team in _teams(fixture):
+                    if not team:
+                        continue
+                    self.team_names[team.lower()] = team
+                    self.by_team.setdefault(team.lower(), []).append((g_key, fixture))
+
+    def find_team(self, name: str) -> Optional[str]:
+        """Nome canonico della squadra: match esatto (senza maiuscole) o prefisso univoco."""
+        key = name.strip().lower()
+        if key in self.team_names:
+            return self.team_names[key]
+        hits = [t for k, t in self.team_names.items() if k.startswith(key)] if key else []
+        return hits[0] if len(hits) == 1 else None
+
+    def team_fixtures(self, team: str) -> List[Tuple[str, str]]:
+        return self.by_team.get(team.lower(), [])
+
+
+class ScheduleFile:
+    """
+    Un file di calendari, riletto solo se cambia la mtime. Formati accettati:
+    - storico: {"1": ["Atalanta-Pisa", ...], ...} → DEFAULT_COMPETITION / DEFAULT_SEASON
+    - più competizioni e stagioni: {"serie-a": {"2025-26": {"1": [...]}}, "coppa": {...}}
+    In entrambi una partita può essere {"partita": "Atalanta-Pisa", "kickoff": "<ISO 8601>"}:
+    con i calci d'inizio la giornata avanza da sola (vedi kickoff.KickoffScheduler).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime: Optional[float] = None
+        self.calendars: Dict[Tuple[str, str], Calendar] = {}
+
+    def _parse(self, raw: Dict[str, Any]) -> Dict[Tuple[str, str], Calendar]:
+        if all(isinstance(v, list) for v in raw.values()):
+            return {(DEFAULT_COMPETITION, DEFAULT_SEASON): Calendar(DEFAULT_COMPETITION, DEFAULT_SEASON, raw)}
+        out = {}
+        for comp, seasons in raw.items():
+            for season, giornate in seasons.items():
+                out[(comp, season)] = Calendar(comp, season, giornate)
+        return out
+
+    def refresh(self) -> None:
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self._mtime:
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.calendars = self._parse(json.load(f))
+        self._mtime = mtime
+
+    def get(self, competition: Optional[str] = None, season: Optional[str] = None) -> Calendar:
+        """Calendario richiesto; senza argomenti quello di default (o l'unico presente)."""
+        self.refresh()
+        if competition is None and season is None and len(self.calendars) == 1:
+            return next(iter(self.calendars.values()))
+        key = (competition or DEFAULT_COMPETITION, season or DEFAULT_SEASON)
+        if key not in self.calendars:
+            raise KeyError(f"Calendario {key[0]} {key[1]} non trovato in {self.path}")
+        return self.calendars[key]
+
+
+class ScheduleService:
+    """Cache dei file di calendario per percorso (quello comune e quelli propri dei gruppi)."""
+
+    def __init__(self):
+        self._files: Dict[str, ScheduleFile] = {}
+
+    def file(self, path: str) -> ScheduleFile:
+        f = self._files.get(path)
+        if f is None:
+            f = self._files[path] = ScheduleFile(path)
+        return f
+
+    def calendar(self, path: str, competition: Optional[str] = None, season: Optional[str] = None) -> Calendar:
+        return self.file(path).get(competition, season)
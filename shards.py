@@ -0,0 +1,111 @@
+from __future__ import annotations
+import asyncio
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional
+
+from state_store import FLUSH_INTERVAL, BaseStore, StateStore
+
+
+class ShardManager:
+    """
+    Uno store di stato per gruppo (chat_id), caricato al primo accesso.
+    Al massimo max_loaded shard restano in memoria: oltre, quelli usati meno di
+    recente vengono salvati e scaricati (LRU). Gli shard per cui is_busy(chat_id)
+    è vero (un handler li sta usando) non vengono mai scaricati.
+    Un solo flusher in background serve tutti gli shard caricati.
+    store_factory(path, default) costruisce il backend (StateStore o SqliteStore); default()
+    è il documento iniziale di un gruppo che non ha ancora uno stato su disco.
+    Gli shard per cui may_write(chat_id) è falso (con più worker: chat non più di questo
+    processo) non vengono salvati e rifiutano gli eventi (state_store.ChatNonMia): vedi workers.py.
+    """
+
+    def __init__(self, path_for: Callable[[Hashable], str],
+                 default: Callable[[], Dict[str, Any]],
+                 max_loaded: int = 256,
+                 store_factory: Callable[..., BaseStore] = StateStore,
+                 is_busy: Callable[[Hashable], bool] = lambda key: False,
+                 flush_interval: float = FLUSH_INTERVAL,
+                 may_write: Callable[[Hashable], bool] = lambda key: True):
+        self.path_for = path_for
+        self.default = default
+        self.max_loaded = max_loaded
+        self.is_busy = is_busy
+        self.may_write = may_write
+        self.flush_interval = flush_interval
+        self.store_factory = store_factory
+        self._shards: "OrderedDict[Hashable, BaseStore]" = OrderedDict()
+        self._flusher: Optional[asyncio.Task] = None
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+    def __iter__(self) -> Iterator[BaseStore]:
+        return iter(list(self._shards.values()))
+
+    def get(self, key: Hashable) -> BaseStore:
+        store = self._shards.get(key)
+        if store is not None:
+            self._shards.move_to_end(key)
+            return store
+        path = self.path_for(key)
+        store = self.store_factory(path, default=self.default)
+        store.scrivibile = lambda: self.may_write(key)
+        self._shards[key] = store
+        self._evict()
+        return store
+
+    def _evict(self) -> None:
+        if len(self._shards) <= self.max_loaded:
+            return
+        for key in list(self._shards.keys()):
+            if len(self._shards) <= self.max_loaded:
+                break
+            if self.is_busy(key):
+                continue
+            self.unload(key)
+
+    def unload(self, key: Hashable) -> None:
+        store = self._shards.pop(key, None)
+        if store is None:
+            return
+        if self.may_write(key):
+            store.flush()
+        store.close()
+        self.evictions += 1
+
+    def discard(self, key: Hashable) -> None:
+        """Butta lo shard senza salvarlo (la copia su disco è più recente): al prossimo get() si rilegge."""
+        store = self._shards.pop(key, None)
+        if store is not None:
+            store.close()
+
+    async def flush_all(self, force: bool = False) -> None:
+        for key, store in list(self._shards.items()):
+            if not self.may_write(key):
+                continue
+            try:
+                await store.flush_async(force=force)
+            except Exception as e:
+                print(f"⚠️ Snapshot di {store.path} fallito: {e}", flush=True)
+
+    async def _run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_all()
+
+    def start_flusher(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._run_flusher())
+
+    async def stop_flusher(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush_all(force=True)
+        for store in self:
+            store.close()
@@ -0,0 +1,404 @@
+from __future__ import annotations
+import copy, json, os, sqlite3, sys
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from events import ALL_VIEWS, Event, apply_event, flatten, touched_keys
+from model import load, to_json
+from state_store import BaseStore
+
+# Chiavi di primo livello che hanno una tabella loro; tutto il resto finisce in "meta"
+_TABLE_KEYS = {"players", "bets", "roster", "admins", "movimenti"}
+# Campi del modello senza una colonna loro: finiscono in JSON nella colonna extra
+_GIORNATA_EXTRA = ("bloccate", "penali", "risultati", "stagione")
+_BET_EXTRA = ("tipo_verifica", "dati_verifica")
+
+SCHEMA = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS players (
+    name       TEXT PRIMARY KEY,
+    points     INTEGER NOT NULL DEFAULT 0,
+    jolly_used INTEGER NOT NULL DEFAULT 0,
+    debt       INTEGER NOT NULL DEFAULT 0,
+    paid       INTEGER,
+    extra      TEXT
+);
+CREATE TABLE IF NOT EXISTS roster (
+    username TEXT PRIMARY KEY,
+    player   TEXT NOT NULL,
+    pos      INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS admins (
+    username TEXT PRIMARY KEY,
+    pos      INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS giornate (
+    num                INTEGER PRIMARY KEY,
+    status             TEXT NOT NULL,
+    settled            INTEGER NOT NULL DEFAULT 0,
+    leftover           TEXT NOT NULL DEFAULT '[]',
+    summary_message_id INTEGER,
+    pinned_summary_id  INTEGER,
+    extra              TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_giornate_status ON giornate(status, num);
+CREATE TABLE IF NOT EXISTS assignments (
+    giornata INTEGER NOT NULL,
+    player   TEXT NOT NULL,
+    match    TEXT NOT NULL,
+    PRIMARY KEY (giornata, player)
+);
+CREATE TABLE IF NOT EXISTS bets (
+    giornata INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    giocata  TEXT NOT NULL,
+    quota    REAL NOT NULL,
+    jolly    INTEGER NOT NULL DEFAULT 0,
+    esito    TEXT,
+    extra    TEXT,
+    PRIMARY KEY (giornata, username)
+);
+CREATE INDEX IF NOT EXISTS idx_bets_esito ON bets(esito, giornata);
+CREATE INDEX IF NOT EXISTS idx_bets_username ON bets(username, giornata);
+CREATE TABLE IF NOT EXISTS payments (
+    id     INTEGER PRIMARY KEY AUTOINCREMENT,
+    player TEXT NOT NULL,
+    euro   INTEGER NOT NULL,
+    seq    INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_payments_player ON payments(player);
+CREATE TABLE IF NOT EXISTS movimenti (
+    id        INTEGER PRIMARY KEY,
+    giocatore TEXT NOT NULL,
+    tipo      TEXT NOT NULL,
+    euro      INTEGER NOT NULL,
+    giornata  INTEGER,
+    ts        INTEGER,
+    da        TEXT
+);
+"""
+
+
+def _extra(obj: Any, fields: Iterable[str]) -> Optional[str]:
+    d = obj.to_dict()  # omette i campi vuoti come nello snapshot JSON
+    rest = {k: d[k] for k in fields if k in d}
+    return json.dumps(rest, ensure_ascii=False) if rest else None
+
+
+class SqliteStore(BaseStore):
+    """
+    Backend SQLite: una tabella per giocatori, rosa, giornate, assegnazioni, giocate e
+    versamenti, più il registro dei movimenti (solo INSERT), con indici su numero giornata,
+    stato, giocatore ed esito.
+    Il documento in memoria (data) resta disponibile per gli handler; ogni apply()
+    aggiorna in una transazione solo le righe toccate dall'evento, e
+    current_giornata()/storico_perdenti() diventano query sugli indici.
+    """
+
+    def __init__(self, path: str, default: Optional[Callable[[], Dict[str, Any]]] = None,
+                 legacy: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.path = path
+        self.default = default
+        self.legacy = legacy  # come StateStore (le tabelle hanno sempre la rosa: serve solo per uniformità)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data: Optional[Dict[str, Any]] = None
+        self._seq = 0
+        self._dirty = False
+        self._movimenti_scritti = 0  # righe di data["movimenti"] già nella tabella
+
+    # ---- connessione / caricamento ----
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        if self._data is None:
+            if self.default is not None and not os.path.exists(self.path):
+                self._data, _ = load(self.default())
+            else:
+                self._data, upgraded = self._materialize()
+                self._seq = self._data.get("journal_seq", 0)
+                self._movimenti_scritti = len(self._data["movimenti"])
+                if upgraded:
+                    self.mark_dirty()  # riscritto col nuovo schema al prossimo apply/flush
+        return self._data
+
+    def _materialize(self) -> Tuple[Dict[str, Any], bool]:
+        """Documento dalle tabelle, validato e aggiornato allo schema corrente da model.load."""
+        c = self._connect()
+        data: Dict[str, Any] = {}
+        for key, value in c.execute("SELECT key, value FROM meta"):
+            data[key] = json.loads(value)
+
+        players = data["players"] = {}
+        for name, points, jolly_used, debt, paid, extra in c.execute(
+                "SELECT name, points, jolly_used, debt, paid, extra FROM players ORDER BY rowid"):
+            p = {"points": points, "jolly_used": jolly_used, "debt": debt}
+            if paid is not None:
+                p["paid"] = paid
+            if extra:
+                p.update(json.loads(extra))
+            players[name] = p
+
+        data["roster"] = {u: p for u, p in c.execute("SELECT username, player FROM roster ORDER BY pos")}
+        data["admins"] = [u for (u,) in c.execute("SELECT username FROM admins ORDER BY pos")]
+        if data.get("schema", 1) >= 3:
+            cols = ("giocatore", "tipo", "euro", "giornata", "ts", "da")
+            data["movimenti"] = [{k: v for k, v in zip(cols, row) if v is not None} for row in c.execute(
+                "SELECT giocatore, tipo, euro, giornata, ts, da FROM movimenti ORDER BY id")]
+
+        bets = data["bets"] = {}
+        for num, status, settled, leftover, summary_id, pinned_id, extra in c.execute(
+                "SELECT num, status, settled, leftover, summary_message_id, pinned_summary_id, extra "
+                "FROM giornate ORDER BY num"):
+            bets[str(num)] = self._giornata_dict(num, status, settled, leftover, summary_id, pinned_id, extra)
+        return load(data, self.legacy)
+
+    def _giornata_dict(self, num, status, settled, leftover, summary_id, pinned_id, extra) -> Dict[str, Any]:
+        c = self._connect()
+        g = {
+            "assignments": {p: m for p, m in c.execute(
+                "SELECT player, match FROM assignments WHERE giornata = ? ORDER BY rowid", (num,))},
+            "leftover": json.loads(leftover),
+            "bets": {},
+            "status": status,
+            "settled": bool(settled)
+        }
+        for username, giocata, quota, jolly, esito, b_extra in c.execute(
+                "SELECT username, giocata, quota, jolly, esito, extra FROM bets WHERE giornata = ? ORDER BY rowid",
+                (num,)):
+            b = {"giocata": giocata, "quota": quota, "jolly": bool(jolly)}
+            if b_extra:
+                b.update(json.loads(b_extra))
+            if esito is not None:
+                b["esito"] = esito
+            g["bets"][username] = b
+        if summary_id is not None:
+            g["summary_message_id"] = summary_id
+        if pinned_id is not None:
+            g["pinned_summary_id"] = pinned_id
+        if extra:
+            g.update(json.loads(extra))
+        return g
+
+    # ---- scrittura ----
+    def _sync_meta(self, keys: Optional[Iterable[str]] = None) -> None:
+        """Riscrive in meta le chiavi date (default: tutte quelle senza una tabella loro)."""
+        c = self._connect()
+        data = self.data
+        for key in (data if keys is None else keys):
+            if key not in _TABLE_KEYS and key in data:
+                value = data[key]
+                c.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)",
+                          (key, json.dumps(value, ensure_ascii=False, default=to_json)))
+
+    def _sync_players(self, names: Iterable[str]) -> None:
+        c = self._connect()
+        players = self.data.get("players", {})
+        for name in names:
+            p = players.get(name)
+            if p is None:
+                continue
+            c.execute(
+                "INSERT INTO players(name, points, jolly_used, debt, paid, extra) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET points = excluded.points, jolly_used = excluded.jolly_used, "
+                "debt = excluded.debt, paid = excluded.paid, extra = excluded.extra",
+                (name, p.points, p.jolly_used, p.debt, p.paid, None))
+
+    def _sync_roster(self) -> None:
+        c = self._connect()
+        c.execute("DELETE FROM roster")
+        c.executemany("INSERT INTO roster(username, player, pos) VALUES (?, ?, ?)",
+                      [(u, p, i) for i, (u, p) in enumerate(self.data.get("roster", {}).items())])
+        c.execute("DELETE FROM admins")
+        c.executemany("INSERT INTO admins(username, pos) VALUES (?, ?)",
+                      [(u, i) for i, u in enumerate(self.data.get("admins", []))])
+
+    def _sync_giornata(self, g_key: str) -> None:
+        c = self._connect()
+        num = int(g_key)
+        g = self.data["bets"][g_key]
+        c.execute(
+            "INSERT OR REPLACE INTO giornate(num, status, settled, leftover, summary_message_id, pinned_summary_id, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (num, g.status, int(g.settled), json.dumps(g.leftover, ensure_ascii=False),
+             g.summary_message_id, g.pinned_summary_id, _extra(g, _GIORNATA_EXTRA)))
+        c.execute("DELETE FROM assignments WHERE giornata = ?", (num,))
+        c.executemany("INSERT INTO assignments(giornata, player, match) VALUES (?, ?, ?)",
+                      [(num, p, m) for p, m in g.assignments.items()])
+        c.execute("DELETE FROM bets WHERE giornata = ?", (num,))
+        c.executemany(
+            "INSERT INTO bets(giornata, username, giocata, quota, jolly, esito, extra) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(num, u, b.giocata, b.quota, int(b.jolly), b.esito, _extra(b, _BET_EXTRA))
+             for u, b in g.bets.items()])
+
+    def _sync_movimenti(self) -> None:
+        # il registro cresce solo in coda: si inseriscono le righe nuove
+        movimenti = self.data["movimenti"]
+        self._connect().executemany(
+            "INSERT INTO movimenti(id, giocatore, tipo, euro, giornata, ts, da) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(i, m.giocatore, m.tipo, m.euro, m.giornata, m.ts, m.da)
+             for i, m in enumerate(movimenti[self._movimenti_scritti:], self._movimenti_scritti)])
+        self._movimenti_scritti = len(movimenti)
+
+    def _write_all(self) -> None:
+        c = self._connect()
+        for table in ("meta", "players", "giornate", "assignments", "bets", "movimenti"):
+            c.execute(f"DELETE FROM {table}")
+        self._movimenti_scritti = 0
+        self._sync_movimenti()
+        self._sync_meta()
+        self._sync_players(self.data.get("players", {}).keys())
+        self._sync_roster()
+        for g_key in self.data.get("bets", {}):
+            self._sync_giornata(g_key)
+
+    def apply(self, event: Event) -> None:
+        """Applica l'evento in memoria e lo scrive nelle tabelle; se uno dei due fallisce lo stato torna com'era."""
+        self._controlla_proprietario()
+        data = self.data
+        # modifiche a mano (o gruppo nuovo) non ancora nelle tabelle: vanno scritte tutte, e per
+        # tornare indietro serve una copia
+        tutto = self._dirty or not os.path.exists(self.path)
+        backup = copy.deepcopy(data) if tutto else None
+        self._seq += 1
+        event = self._stamp(event, self._seq)
+        try:
+            apply_event(data, event)
+            data["journal_seq"] = self._seq
+            self._write_event(event, tutto)
+        except BaseException:
+            self._seq -= 1
+            # senza copia si ricarica dalle tabelle al prossimo accesso (la transazione è stata annullata)
+            self._data = backup
+            self.mark_dirty()
+            self._dirty = backup is not None
+            raise
+        self._applied(event)
+
+    def _write_event(self, event: Event, tutto: bool) -> None:
+        c = self._connect()
+        with c:
+            if tutto:
+                self._write_all()
+                self._dirty = False
+            # un batch sta in una sola transazione come un evento semplice
+            for sub in flatten(event):
+                t = sub["type"]
+                if "g" in sub:
+                    self._sync_giornata(sub["g"])
+                if t == "outcomes_applied":
+                    self._sync_players(sub["roster"].values())
+                elif "player" in sub:
+                    self._sync_players([sub["player"]])
+                if t in ("player_registered", "player_removed", "admin_added"):
+                    self._sync_roster()
+                if t == "payment_recorded":
+                    c.execute("INSERT INTO payments(player, euro, seq) VALUES (?, ?, ?)",
+                              (sub["player"], sub["euro"], event["seq"]))
+            self._sync_movimenti()
+            # solo le chiavi che l'evento ha cambiato: persistenza e update_applicati possono essere grandi
+            keys = touched_keys(event)
+            self._sync_meta(None if keys is None else keys | {"journal_seq"})
+
+    def replace(self, data: Dict[str, Any]) -> None:
+        self._data = data
+        self.mark_dirty()
+
+    def mark_dirty(self) -> None:
+        self._dirty = True
+        self._touch(ALL_VIEWS)
+        self._history = None
+        self._ledger = None
+
+    def flush(self) -> bool:
+        if not self._dirty or self._data is None:
+            return False
+        with self._connect():
+            self._write_all()
+        self._dirty = False
+        return True
+
+    async def flush_async(self, force: bool = True) -> bool:
+        # ogni apply() è già una transazione: resta solo l'eventuale riscrittura completa
+        return self.flush()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ---- query indicizzate ----
+    def current_giornata(self) -> Optional[str]:
+        if self._conn is None and not os.path.exists(self.path):
+            return super().current_giornata()
+        self.flush()
+        (num,) = self._connect().execute("SELECT MAX(num) FROM giornate").fetchone()
+        return None if num is None else str(num)
+
+    def storico_perdenti(self) -> List[Tuple[str, List[str]]]:
+        if self._conn is None and not os.path.exists(self.path):
+            return super().storico_perdenti()
+        self.flush()
+        out: List[Tuple[str, List[str]]] = []
+        rows = self._connect().execute(
+            "SELECT g.num, b.username FROM giornate g "
+            "LEFT JOIN bets b ON b.giornata = g.num AND b.esito = 'persa' "
+            "WHERE g.status = 'finished' ORDER BY g.num, b.rowid")
+        for num, username in rows:
+            if not out or out[-1][0] != str(num):
+                out.append((str(num), []))
+            if username is not None:
+                out[-1][1].append(username)
+        return out
+
+    def payments(self, player: str) -> List[Tuple[int, int]]:
+        """[(seq, euro)] dei versamenti registrati per un giocatore."""
+        return list(self._connect().execute(
+            "SELECT seq, euro FROM payments WHERE player = ? ORDER BY id", (player,)))
+
+
+def import_json(json_path: str, db_path: str, roster: Optional[Dict[str, str]] = None,
+                admins: Optional[List[str]] = None) -> SqliteStore:
+    """
+    Importa una volta sola un data.json (anche nel formato storico) in un database SQLite.
+    - il formato storico viene aggiornato allo schema corrente (model.upgrade: la vecchia
+      "giornate" diventa giornate finite in "bets");
+    - i campi extra delle giocate importate dagli hotfix (tipo_verifica, dati_verifica, ...)
+      finiscono nella colonna extra e tornano identici in data;
+    - i "paid" esistenti diventano un versamento iniziale per giocatore.
+    """
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} esiste già")
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data.pop("journal_seq", None)
+    data, _ = load(data, {"roster": roster, "admins": admins or []} if roster is not None else None)
+
+    store = SqliteStore(db_path)
+    store.replace(data)
+    store.flush()
+    c = store._connect()
+    with c:
+        c.executemany("INSERT INTO payments(player, euro, seq) VALUES (?, ?, 0)",
+                      [(name, p.paid) for name, p in data["players"].items() if p.paid])
+    return store
+
+
+if __name__ == "__main__":
+    # uso: python sqlite_store.py data.json data.sqlite
+    if len(sys.argv) != 3:
+        print("uso: python sqlite_store.py <data.json> <data.sqlite>")
+        sys.exit(2)
+    from game_utils import LEGACY_ADMINS, LEGACY_ROSTER
+    st = import_json(sys.argv[1], sys.argv[2], LEGACY_ROSTER, LEGACY_ADMINS)
+    print(f"Importate {len(st.data.get('bets', {}))} giornate e {len(st.data.get('players', {}))} giocatori in {sys.argv[2]}")
+    st.close()
@@ -0,0 +1,387 @@
+from __future__ import annotations
+import asyncio, contextvars, copy, json, os, pickle, tempfile, threading, time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from events import ALL_VIEWS, Event, apply_event, flatten, touched_views
+from journal import Journal
+from ledger import Ledger
+from metrics import METRICS
+from model import IMPRONTA, load, to_json
+
+if TYPE_CHECKING:
+    from history import BetHistory  # numpy: importato al primo history(), non all'avvio
+
+# Ogni quanti secondi il flusher (vedi shards.ShardManager) controlla se serve scrivere su disco
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "5"))
+# Oltre questa dimensione il journal viene compattato in un nuovo snapshot
+JOURNAL_MAX_BYTES = int(os.getenv("JOURNAL_MAX_BYTES", str(256 * 1024)))
+# Accanto a ogni data.json uno snapshot binario (pickle del modello già validato), riscritto a ogni
+# salvataggio: all'avvio si carica quello se corrisponde al JSON su disco. 0 per spegnerlo.
+STATE_SNAPSHOT_BIN = os.getenv("STATE_SNAPSHOT_BIN", "1") == "1"
+
+# update_id dell'update che l'handler sta gestendo (impostato in bot.handler):
+# apply() lo scrive negli eventi, così un update rigiocato dall'inbox si riconosce
+CURRENT_UPDATE: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("current_update", default=None)
+
+
+class ChatNonMia(RuntimeError):
+    """Evento rifiutato: con più worker la chat è di un altro processo (vedi workers.py)."""
+
+
+class BaseStore:
+    """
+    Interfaccia comune dei backend di stato (JSON + journal, SQLite).
+    Gli handler leggono `data` (il documento in memoria, tipizzato: vedi model.py), mutano solo con apply(event)
+    e usano le query qui sotto al posto di scorrere data["bets"] a mano.
+    """
+
+    path: str
+
+    def __init__(self):
+        # con più worker: False se la chat non è (più) di questo processo (vedi shards.ShardManager)
+        self.scrivibile: Callable[[], bool] = lambda: True
+        self._view_versions: Dict[str, int] = dict.fromkeys(ALL_VIEWS, 0)
+        self._view_cache: Dict[str, Tuple[int, str]] = {}
+        self._history: Optional[BetHistory] = None
+        self._ledger: Optional[Ledger] = None
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def _touch(self, views) -> None:
+        for v in views:
+            self._view_versions[v] += 1
+
+    def _applied(self, event: Event) -> None:
+        """Dopo ogni evento: invalida le viste toccate e aggiorna lo storico colonnare."""
+        self._touch(touched_views(event))
+        if self._history is None:
+            return
+        for sub in flatten(event):
+            if sub["type"] == "outcomes_applied":
+                self._history.append_giornata(sub["g"], self.data["bets"][sub["g"]])
+            elif sub["type"] == "giornata_imported":
+                self._history = None  # giornata storica in mezzo: si ricostruisce al prossimo uso
+                return
+
+    def _controlla_proprietario(self) -> None:
+        # il journal lo scrive solo il proprietario: gli eventi di un altro processo avrebbero un suo
+        # seq e al replay verrebbero saltati (seq <= journal_seq) o applicati due volte
+        if not self.scrivibile():
+            raise ChatNonMia(f"{self.path}: la chat è di un altro worker, evento rifiutato")
+
+    def _stamp(self, event: Event, seq: int) -> Event:
+        # ts: quando è successo (lo usa il registro dei movimenti), fissato nell'evento perché il replay sia identico
+        event = dict(event, seq=seq, ts=event.get("ts") or int(time.time()))
+        update_id = CURRENT_UPDATE.get()
+        if update_id is not None:
+            event["update_id"] = update_id
+        return event
+
+    def applied_update(self, update_id: int) -> bool:
+        """True se l'update ha già prodotto eventi in questo store (es. prima di un crash)."""
+        return update_id in self.data.get("update_applicati", ())
+
+    def history(self) -> BetHistory:
+        """Storico delle giocate regolate in colonne (costruito al primo uso, poi aggiornato a ogni esito)."""
+        if self._history is None:
+            from history import BetHistory
+            self._history = BetHistory.from_data(self.data)
+        return self._history
+
+    def ledger(self) -> Ledger:
+        """Indice del registro dei movimenti (costruito al primo uso, poi aggiornato coi movimenti nuovi)."""
+        if self._ledger is None:
+            self._ledger = Ledger.from_data(self.data)
+        else:
+            self._ledger.sync(self.data["movimenti"])
+        return self._ledger
+
+    def view_version(self, view: str) -> int:
+        return self._view_versions[view]
+
+    def cached_view(self, key: str, view: str, render: Callable[[Dict[str, Any]], str]) -> str:
+        """
+        Testo renderizzato di una vista (es. /classifica), ricalcolato solo se
+        un evento ha toccato `view` dopo l'ultimo render. `key` distingue le varianti
+        della stessa vista (es. /malloppo totale e solo giocate).
+        """
+        version = self._view_versions[view]
+        hit = self._view_cache.get(key)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+        text = render(self.data)
+        self._view_cache[key] = (version, text)
+        return text
+
+    def apply(self, event: Event) -> None:
+        raise NotImplementedError
+
+    def current_giornata(self) -> Optional[str]:
+        """Chiave dell'ultima giornata estratta (None se non ce ne sono)."""
+        bets = self.data.get("bets", {})
+        return str(max(int(k) for k in bets.keys())) if bets else None
+
+    def storico_perdenti(self) -> List[Tuple[str, List[str]]]:
+        """[(g_key, [username perdenti])] delle giornate finite, in ordine crescente."""
+        bets = self.data.get("bets", {})
+        out = []
+        for g_key in sorted(bets.keys(), key=int):
+            g = bets[g_key]
+            if g.status != "finished":
+                continue
+            out.append((g_key, [u for u, b in g.bets.items() if b.esito == "persa"]))
+        return out
+
+    def replace(self, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def mark_dirty(self) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> bool:
+        return False
+
+    async def flush_async(self, force: bool = True) -> bool:
+        return False
+
+    def close(self) -> None:
+        pass
+
+
+class StateStore(BaseStore):
+    """
+    Stato del bot tenuto in memoria per tutto il processo.
+    Il file viene letto una sola volta (al primo accesso) e il journal degli
+    eventi viene rigiocato sopra. Ogni mutazione passa da apply(): l'evento
+    viene accodato al journal (costo O(1)) e applicato in memoria. Lo snapshot
+    completo viene riscritto (in modo atomico) solo quando il journal supera
+    JOURNAL_MAX_BYTES, oppure con flush() allo shutdown.
+    Con binary=True ogni snapshot JSON ha accanto "<nome>.pickle" con lo stesso documento:
+    il JSON resta il formato di riferimento, il pickle serve solo a caricare più in fretta
+    e viene ignorato se non corrisponde più al JSON (dimensione, mtime) o alle dataclass (model.IMPRONTA).
+    """
+
+    def __init__(self, path: str, journal_max_bytes: int = JOURNAL_MAX_BYTES,
+                 default: Optional[Callable[[], Dict[str, Any]]] = None,
+                 binary: bool = STATE_SNAPSHOT_BIN, legacy: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.path = path
+        self.legacy = legacy  # rosa e admin per un data.json storico che non li ha (vedi model.load)
+        self.bin_path = os.path.splitext(path)[0] + ".pickle" if binary else None
+        self.default = default  # documento iniziale se il file non esiste ancora
+        self.journal_max_bytes = journal_max_bytes
+        self.journal = Journal(os.path.splitext(path)[0] + ".jsonl")
+        self._data: Optional[Dict[str, Any]] = None
+        self._current: Optional[int] = None  # indice dell'ultima giornata
+        self._seq = 0
+        self._dirty = False
+        self._unjournaled = False  # modifiche fatte senza passare da apply()
+        self._write_lock = threading.Lock()
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._load()
+        return self._data
+
+    def _load(self) -> None:
+        data = self._load_bin()
+        upgraded = stale_bin = False
+        if data is None:
+            if self.default is not None and not os.path.exists(self.path):
+                data = self.default()
+            else:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                # snapshot binario mancante o vecchio: lo riscrive il prossimo salvataggio
+                stale_bin = self.bin_path is not None
+            # schema validato una volta qui; un file di una versione precedente va riscritto
+            data, upgraded = load(data, self.legacy)
+        seq = data.get("journal_seq", 0)
+        replayed = 0
+        for ev in self.journal.replay():
+            if ev.get("seq", 0) <= seq:
+                continue  # già incluso nello snapshot
+            try:
+                apply_event(data, ev)
+            except Exception as e:
+                # journal scritto da una versione che registrava anche gli eventi rifiutati
+                print(f"⚠️ {self.journal.path}: evento {ev.get('seq')} ({ev.get('type')}) scartato: {e!r}", flush=True)
+            seq = ev["seq"]
+            replayed += 1
+        self._data = data
+        self._current = self._max_giornata(data)
+        self._seq = seq
+        # se ho rigiocato qualcosa, lo snapshot su disco è indietro
+        self._dirty = replayed > 0 or upgraded or stale_bin
+        self._unjournaled = upgraded
+
+    def _stamp_json(self) -> Tuple[Any, int, int]:
+        # lo snapshot binario vale solo per questo data.json e per questa forma delle dataclass
+        st = os.stat(self.path)
+        return IMPRONTA, st.st_size, st.st_mtime_ns
+
+    @METRICS.timed("load_bin")
+    def _load_bin(self) -> Optional[Dict[str, Any]]:
+        """Il documento dallo snapshot binario, se c'è e corrisponde al JSON su disco; altrimenti None."""
+        if self.bin_path is None or not os.path.exists(self.bin_path) or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.bin_path, "rb") as f:
+                if pickle.load(f) != self._stamp_json():
+                    return None
+                return pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Snapshot binario {self.bin_path} illeggibile, uso il JSON: {e}", flush=True)
+            return None
+
+    @staticmethod
+    def _max_giornata(data: Dict[str, Any]) -> Optional[int]:
+        bets = data.get("bets", {})
+        return max(int(k) for k in bets.keys()) if bets else None
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty
+
+    def current_giornata(self) -> Optional[str]:
+        if self._data is None:
+            self._load()
+        return None if self._current is None else str(self._current)
+
+    def apply(self, event: Event) -> None:
+        """
+        Applica l'evento allo stato in memoria e poi lo registra nel journal. Un evento rifiutato
+        (l'applier solleva, anche a metà di un batch) non arriva nel journal e lo stato torna com'era.
+        Con più worker solo il proprietario della chat può applicare eventi (ChatNonMia).
+        """
+        self._controlla_proprietario()
+        data = self.data
+        # le modifiche fatte a mano non sono su disco: per tornare indietro serve una copia
+        backup = copy.deepcopy(data) if self._unjournaled else None
+        self._seq += 1
+        event = self._stamp(event, self._seq)
+        try:
+            apply_event(data, event)
+            self.journal.append(event)
+        except BaseException:
+            self._rollback(backup)
+            raise
+        self._applied(event)
+        for sub in flatten(event):
+            if sub["type"] in ("giornata_extracted", "giornata_imported"):
+                g = int(sub["g"])
+                self._current = g if self._current is None else max(self._current, g)
+        self._dirty = True
+
+    def _rollback(self, backup: Optional[Dict[str, Any]]) -> None:
+        """Stato di prima dell'evento rifiutato: dalla copia o, se non c'è, da snapshot + journal su disco."""
+        if backup is not None:
+            self._data = backup
+            self._current = self._max_giornata(backup)
+            self._seq -= 1
+        else:
+            self._data = None
+            self._load()
+        self._touch(ALL_VIEWS)
+        self._history = None
+        self._ledger = None
+
+    def replace(self, data: Dict[str, Any]) -> None:
+        """Sostituisce l'intero documento (es. quando il chiamante ne ha costruito uno nuovo)."""
+        self._data = data
+        self._current = self._max_giornata(data)
+        self.mark_dirty()
+
+    def mark_dirty(self) -> None:
+        """Per modifiche fatte a mano sul dict: non sono nel journal, quindi vanno in snapshot al prossimo giro."""
+        self._dirty = True
+        self._unjournaled = True
+        self._touch(ALL_VIEWS)
+        self._history = None
+        self._ledger = None
+
+    def needs_snapshot(self) -> bool:
+        return self._dirty and (self._unjournaled or self.journal.size() >= self.journal_max_bytes)
+
+    def _serialize(self) -> Tuple[str, Optional[bytes]]:
+        self.data["journal_seq"] = self._seq
+        text = json.dumps(self.data, indent=4, ensure_ascii=False, default=to_json)
+        blob = pickle.dumps(self.data, protocol=5) if self.bin_path is not None else None
+        return text, blob
+
+    @METRICS.timed("snapshot")
+    def _write(self, text: str, blob: Optional[bytes] = None) -> None:
+        # scrittura atomica: file temporaneo nella stessa cartella + rename
+        with self._write_lock:
+            folder = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".data-", suffix=".tmp", dir=folder)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    written = f.tell()
+                os.replace(tmp, self.path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            self.journal.drop_rotated()
+            if blob is not None:
+                self._write_bin(folder, blob)
+        METRICS.wrote("snapshot", written)
+
+    def _write_bin(self, folder: str, blob: bytes) -> None:
+        # dopo il JSON: se si interrompe qui, il pickle vecchio non corrisponde più e all'avvio si usa il JSON
+        fd, tmp = tempfile.mkstemp(prefix=".data-", suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(self._stamp_json(), f, protocol=5)
+                f.write(blob)
+                written = f.tell()
+            os.replace(tmp, self.bin_path)
+        except Exception as e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            print(f"⚠️ Snapshot binario {self.bin_path} non scritto: {e}", flush=True)
+            return
+        METRICS.wrote("snapshot_bin", written)
+
+    def flush(self) -> bool:
+        """Scrive subito lo snapshot se lo stato è sporco. Ritorna True se ha scritto."""
+        if not self._dirty or self._data is None:
+            return False
+        text, blob = self._serialize()
+        self.journal.rotate()
+        self._dirty = self._unjournaled = False
+        try:
+            self._write(text, blob)
+        except Exception:
+            self._dirty = self._unjournaled = True
+            raise
+        return True
+
+    async def flush_async(self, force: bool = True) -> bool:
+        """
+        Come flush(), ma l'I/O su disco gira in un thread per non bloccare l'event loop.
+        Con force=False compatta solo se il journal ha superato la soglia.
+        """
+        if self._data is None or not (self.needs_snapshot() if not force else self._dirty):
+            return False
+        # serializzazione e rotazione restano nel thread del loop: gli handler mutano il dict da lì
+        text, blob = self._serialize()
+        self.journal.rotate()
+        self._dirty = self._unjournaled = False
+        try:
+            await asyncio.to_thread(self._write, text, blob)
+        except Exception:
+            self._dirty = self._unjournaled = True
+            raise
+        return True
+
+    def close(self) -> None:
+        self.journal.close()
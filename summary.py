@@ -0,0 +1,163 @@
+from __future__ import annotations
+import asyncio, os
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from rate_limit import IN_BLOCCO, BucketPool
+from state_store import BaseStore
+
+# Le /gioca che arrivano entro SUMMARY_DEBOUNCE secondi producono un solo aggiornamento del riepilogo
+SUMMARY_DEBOUNCE = float(os.getenv("SUMMARY_DEBOUNCE", "3"))
+# Limite di Telegram per i gruppi: ~20 messaggi al minuto per chat
+CHAT_MSG_PER_MIN = float(os.getenv("CHAT_MSG_PER_MIN", "20"))
+MAX_RETRIES = 5
+
+# Chiamate che il vecchio pin_or_edit_summary faceva a ogni /gioca: unpin, edit (o send), pin
+_CALLS_PER_REFRESH = 3
+
+
+def _seconds(retry_after: Any) -> float:
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+class SummaryScheduler:
+    """
+    Aggiorna il messaggio riassuntivo in pin di una giornata con debounce per (chat, giornata).
+    - N richieste nella finestra di debounce → un solo edit, con il testo preso dallo stato al momento dell'invio;
+    - se il messaggio è già quello in pin non fa unpin/pin, se il testo non è cambiato non fa nulla;
+    - ogni chiamata passa da un token bucket per chat e su RetryAfter aspetta quanto chiesto da Telegram.
+    Con più worker aggiorna solo le chat di cui è proprietario (owns): una chat passata a un altro
+    processo nel frattempo la aggiorna il nuovo proprietario al suo prossimo evento.
+    I contatori sono in `stats`.
+    """
+
+    def __init__(self, get_store: Callable[[Hashable], BaseStore],
+                 render: Callable[[Dict[str, Any], str], str],
+                 debounce: float = SUMMARY_DEBOUNCE,
+                 buckets: Optional[BucketPool] = None,
+                 owns: Callable[[Hashable], bool] = lambda chat_id: True):
+        self.get_store = get_store
+        self.owns = owns
+        self.render = render
+        self.debounce = debounce
+        self.buckets = buckets or BucketPool(rate=CHAT_MSG_PER_MIN / 60, capacity=3)
+        self._pending: Dict[Tuple[Hashable, str], Tuple[Any, asyncio.Task]] = {}
+        self._last_text: Dict[Hashable, Tuple[str, str]] = {}  # chat_id -> (g_key, testo in pin)
+        self._inflight: Set[asyncio.Task] = set()  # aggiornamenti già partiti (es. in attesa del bucket)
+        self.stats: Dict[str, int] = {
+            "requests": 0, "coalesced": 0, "refreshes": 0,
+            "api_calls": 0, "api_calls_saved": 0, "retry_after": 0, "errors": 0, "not_owned": 0
+        }
+
+    def schedule(self, bot: Any, chat_id: Hashable, g_key: str) -> None:
+        self.stats["requests"] += 1
+        key = (chat_id, g_key)
+        if key in self._pending:
+            self.stats["coalesced"] += 1
+            self.stats["api_calls_saved"] += _CALLS_PER_REFRESH
+            return
+        task = asyncio.get_running_loop().create_task(self._run(bot, chat_id, g_key))
+        self._pending[key] = (bot, task)
+
+    async def _run(self, bot: Any, chat_id: Hashable, g_key: str) -> None:
+        await asyncio.sleep(self.debounce)
+        # da qui in poi una nuova /gioca programma un nuovo aggiornamento
+        self._pending.pop((chat_id, g_key), None)
+        task = asyncio.current_task()
+        self._inflight.add(task)
+        try:
+            await self._refresh(bot, chat_id, g_key)
+        finally:
+            self._inflight.discard(task)
+
+    async def drain(self) -> None:
+        """Esegue subito gli aggiornamenti in attesa (allo shutdown)."""
+        pending, self._pending = self._pending, {}
+        for _, task in pending.values():
+            task.cancel()
+        # chat diverse hanno bucket diversi: in parallelo lo shutdown aspetta la chat più lenta, non la somma
+        await asyncio.gather(*(self._refresh(bot, chat_id, g_key)
+                               for (chat_id, g_key), (bot, _) in pending.items()))
+        # quelli già partiti ma fermi sul rate limit non arriverebbero prima della chiusura
+        inflight, self._inflight = self._inflight, set()
+        for task in inflight:
+            task.cancel()
+        await asyncio.gather(*inflight, return_exceptions=True)
+
+    async def _call(self, chat_id: Hashable, fn: Callable, **kwargs) -> Any:
+        bucket = self.buckets.get(chat_id)
+        for attempt in range(MAX_RETRIES):
+            await bucket.acquire()
+            self.stats["api_calls"] += 1
+            try:
+                return await fn(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                self.stats["retry_after"] += 1
+                bucket.block_for(_seconds(e.retry_after))
+                if attempt == MAX_RETRIES - 1:
+                    raise
+
+    async def _refresh(self, bot: Any, chat_id: Hashable, g_key: str) -> None:
+        # gira sempre in un task suo (_run o drain): traffico in blocco, dopo le risposte ai comandi
+        IN_BLOCCO.set(True)
+        try:
+            await self._push(bot, chat_id, g_key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"⚠️ Riepilogo G{g_key} per chat {chat_id} non aggiornato: {e}", flush=True)
+
+    async def _push(self, bot: Any, chat_id: Hashable, g_key: str) -> None:
+        if not self.owns(chat_id):
+            self.stats["not_owned"] += 1
+            return
+        data = self.get_store(chat_id).data
+        giornata = data.get("bets", {}).get(g_key)
+        if giornata is None:
+            return
+        text = self.render(data, g_key)
+        msg_id = giornata.summary_message_id
+        pinned_id = giornata.pinned_summary_id
+        if msg_id and msg_id == pinned_id and self._last_text.get(chat_id) == (g_key, text):
+            self.stats["api_calls_saved"] += _CALLS_PER_REFRESH
+            return
+
+        self.stats["refreshes"] += 1
+        new_id = None
+        if msg_id:
+            try:
+                await self._call(chat_id, bot.edit_message_text, message_id=msg_id, text=text)
+                new_id = msg_id
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    new_id = msg_id
+            except TelegramError:
+                pass
+        if new_id is None:
+            m = await self._call(chat_id, bot.send_message, text=text)
+            new_id = m.message_id
+
+        new_pinned = pinned_id
+        if pinned_id == new_id:
+            self.stats["api_calls_saved"] += 2  # niente unpin + pin
+        else:
+            if pinned_id:
+                try:
+                    await self._call(chat_id, bot.unpin_chat_message, message_id=pinned_id)
+                except TelegramError:
+                    pass
+            try:
+                await self._call(chat_id, bot.pin_chat_message, message_id=new_id)
+                new_pinned = new_id
+            except TelegramError:
+                pass
+        self._last_text[chat_id] = (g_key, text)
+
+        if new_id != msg_id or new_pinned != pinned_id:
+            # lo shard può essere stato ricaricato durante le chiamate: lo riprendo
+            self.get_store(chat_id).apply({
+                "type": "summary_updated",
+                "g": g_key,
+                "summary_message_id": new_id,
+                "pinned_summary_id": new_pinned
+            })
@@ -0,0 +1,64 @@
+import os, sys, tempfile
+
+# Lo stato dei test non deve mai finire in gruppi/ del checkout: la configurazione si legge
+# all'import di game_utils, quindi va impostata prima di qualsiasi import del bot
+os.environ.setdefault("SHARDS_DIR", tempfile.mkdtemp(prefix="test-gruppi-"))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+for _var in ("WEBHOOK_URL", "WORKER_ID", "WORKERS", "LEGACY_CHAT_ID", "BOT_API_BASE_URL"):
+    os.environ.pop(_var, None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+import itertools
+
+import pytest
+
+
+class BotFinto:
+    """Al posto di telegram.Bot: ogni metodo della Bot API registra la chiamata e ritorna un messaggio finto."""
+
+    defaults = None
+
+    def __init__(self):
+        self.chiamate = []
+        self._ids = itertools.count(1000)
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        async def call(*args, **kwargs):
+            self.chiamate.append((method, kwargs))
+            from telegram import Chat, Message
+            chat_id = kwargs.get("chat_id", 0)
+            return Message(next(self._ids), None, Chat(chat_id, "group"), text=kwargs.get("text"))
+        return call
+
+    def testi(self, chat_id=None):
+        return [kw.get("text") for m, kw in self.chiamate
+                if m == "send_message" and (chat_id is None or kw.get("chat_id") == chat_id)]
+
+
+@pytest.fixture
+def bot_finto():
+    return BotFinto()
+
+
+@pytest.fixture
+def aggiornamento(bot_finto):
+    """aggiornamento(chat_id, username, testo) -> (Update, context) come li passa PTB a un handler."""
+    from types import SimpleNamespace
+    from telegram import Update
+    ids = itertools.count(1)
+
+    def crea(chat_id, username, testo, tipo=None):
+        update_id = next(ids)
+        user = {"id": abs(hash(username)) % 10 ** 9, "is_bot": False, "first_name": username, "username": username}
+        message = {"message_id": update_id, "date": 0, "text": testo, "from": user,
+                   "chat": {"id": chat_id, "type": tipo or ("private" if chat_id > 0 else "supergroup")}}
+        if testo.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(testo.split()[0])}]
+        update = Update.de_json({"update_id": update_id, "message": message}, bot_finto)
+        return update, SimpleNamespace(bot=bot_finto, args=testo.split()[1:])
+    return crea
@@ -0,0 +1,46 @@
+import asyncio, os
+
+import bot
+import game_utils
+from game_utils import SHARDS, SHARDS_DIR
+
+
+def test_chat_privata_non_crea_uno_stato(aggiornamento, bot_finto):
+    for testo, handler in (("/classifica", bot.handler(bot.classifica)),
+                           ("/start", bot.handler(bot.start, solo_gruppi=False))):
+        update, context = aggiornamento(555, "pippo", testo)
+        asyncio.run(handler(update, context))
+    assert bot_finto.testi(555)[0] == "ℹ️ Questo comando funziona solo nei gruppi."
+    assert bot_finto.testi(555)[1].startswith("Ciao!")
+    assert 555 not in SHARDS._shards
+    assert not os.path.exists(os.path.join(SHARDS_DIR, "555"))
+
+
+def test_avviso_se_manca_legacy_chat_id(tmp_path, monkeypatch):
+    path = tmp_path / "data.json"
+    path.write_text("{}")
+    monkeypatch.setattr(game_utils, "DATA_PATH", str(path))
+    monkeypatch.setattr(game_utils, "LEGACY_CHAT_ID", None)
+    assert "LEGACY_CHAT_ID" in game_utils.avviso_legacy()
+    monkeypatch.setattr(game_utils, "LEGACY_CHAT_ID", "-100")
+    assert game_utils.avviso_legacy() is None
+
+
+def test_esporta_manda_il_file_aperto(aggiornamento, bot_finto):
+    chat = -3001
+    store = game_utils.get_store(chat)
+    store.apply({"type": "player_registered", "username": "@capo", "player": "Capo"})
+    store.apply({"type": "admin_added", "username": "@capo"})
+    store.apply({"type": "giornata_extracted", "g": "1", "leftover": [], "assignments": {"Capo": "A-B"}})
+    inviati = []
+
+    async def send_document(chat_id, document, filename, caption=None, **kwargs):
+        # il file passa aperto, non già letto in memoria
+        inviati.append((filename, caption, document.read().decode()))
+
+    bot_finto.send_document = send_document
+    update, context = aggiornamento(chat, "capo", "/esporta")
+    asyncio.run(bot.handler(bot.esporta)(update, context))
+    [(filename, caption, testo)] = inviati
+    assert filename == f"storico_{chat}_tutto.csv" and caption == "📦 Storico: 1 righe"
+    assert testo.splitlines()[1].startswith(f"{chat},giocata,")
@@ -0,0 +1,48 @@
+import asyncio
+
+import bot
+from chat_locks import per_chat
+from game_utils import SHARDS, get_store
+
+GIOCATORI = 300
+CHAT = -1_000_300
+
+
+def test_giocate_simultanee_sulla_stessa_chat(aggiornamento, bot_finto):
+    store = get_store(CHAT)
+    for i in range(GIOCATORI):
+        store.apply({"type": "player_registered", "username": f"@g{i}", "player": f"G{i}"})
+    store.apply({"type": "giornata_extracted", "g": "1", "leftover": [],
+                 "assignments": {f"G{i}": f"Casa{i}-Ospite{i}" for i in range(GIOCATORI)}})
+    dentro = [0, 0]  # handler in corso, massimo osservato
+
+    async def gioca(update, context):
+        dentro[0] += 1
+        dentro[1] = max(dentro)
+        try:
+            await asyncio.sleep(0)  # punto di cessione: senza per_chat gli update si accavallano qui
+            await bot.gioca(update, context)
+        finally:
+            dentro[0] -= 1
+
+    gioca = per_chat(gioca)
+    # quote sotto MIN_QUOTA a rotazione: anche i contatori dei jolly passano per load → modifica → apply
+    updates = [aggiornamento(CHAT, f"g{i}", f"/gioca Over 2.5 {1.3 if i % 4 == 0 else 1.8}")
+               for i in range(GIOCATORI)]
+
+    async def tutte():
+        await asyncio.gather(*(gioca(u, c) for u, c in updates))
+        await bot.SUMMARIES.drain()
+
+    asyncio.run(tutte())
+
+    assert dentro[1] == 1
+    assert bot_finto.testi(CHAT).count("✅ Giocata salvata.") == GIOCATORI - GIOCATORI // 4
+    bets = store.data["bets"]["1"].bets
+    assert set(bets) == {f"@g{i}" for i in range(GIOCATORI)}
+    assert all(store.data["players"][f"G{i}"].jolly_used == (i % 4 == 0) for i in range(GIOCATORI))
+    # e nessuna manca rileggendo snapshot + journal da disco
+    SHARDS.unload(CHAT)
+    riletto = get_store(CHAT)
+    assert riletto is not store
+    assert set(riletto.data["bets"]["1"].bets) == set(bets)
@@ -0,0 +1,126 @@
+import asyncio, os, threading
+from types import SimpleNamespace
+
+import bot
+import inbox
+from game_utils import SHARDS, get_store
+from inbox import Inbox, InboxQueue
+
+
+def test_rigioca_dopo_un_crash(tmp_path, aggiornamento, bot_finto):
+    path = str(tmp_path / "inbox.jsonl")
+    box = Inbox(path)
+    updates = [aggiornamento(-4001, "a", f"/gioca Over 2.5 1.{i + 6}")[0] for i in range(3)]
+
+    async def ricevi():
+        for u in updates:
+            assert await box.receive(u)
+    asyncio.run(ricevi())
+    box.done(updates[0].update_id)
+    # crash: niente compattazione né chiusura pulita, ultima riga scritta a metà
+    box._f.write('{"u":{"update_id":')
+    box._f.flush()
+
+    riaperta = Inbox(path)
+    assert set(riaperta.pending) == {updates[1].update_id, updates[2].update_id}
+    app = SimpleNamespace(bot=bot_finto, update_queue=asyncio.Queue())
+
+    async def rigioca():
+        assert await riaperta.replay(app) == 2
+        return [app.update_queue.get_nowait() for _ in range(app.update_queue.qsize())]
+    rigiocati = asyncio.run(rigioca())
+    assert [u.update_id for u in rigiocati] == [updates[1].update_id, updates[2].update_id]
+    assert rigiocati[0].message.text == updates[1].message.text
+
+
+def test_consegna_doppia_scartata(tmp_path, aggiornamento):
+    path = str(tmp_path / "inbox.jsonl")
+    update, _ = aggiornamento(-4002, "a", "/classifica")
+    coda = InboxQueue(Inbox(path))
+
+    async def consegna():
+        await coda.put(update)
+        await coda.put(update)
+    asyncio.run(consegna())
+    assert coda.qsize() == 1
+    assert coda.inbox.stats["received"] == 1 and coda.inbox.stats["duplicates"] == 1
+
+    # finito, poi riavvio: Telegram lo rimanda ma non rientra in coda
+    coda.inbox.done(update.update_id)
+    coda.inbox.close()
+    riaperta = Inbox(path)
+    assert riaperta.seen(update.update_id) and not riaperta.pending
+    # anche dopo la compattazione
+    riaperta.compact()
+    riaperta.close()
+    assert not asyncio.run(Inbox(path).receive(update))
+
+
+def test_fsync_fuori_dall_event_loop_e_raggruppato(tmp_path, aggiornamento, monkeypatch):
+    thread = []
+    fsync = os.fsync
+
+    def registra(fd):
+        thread.append(threading.current_thread() is threading.main_thread())
+        fsync(fd)
+
+    monkeypatch.setattr(inbox.os, "fsync", registra)
+    box = Inbox(str(tmp_path / "inbox.jsonl"), fsync=True)
+    updates = [aggiornamento(-4003, "a", "/classifica")[0] for _ in range(5)]
+
+    async def ricevi():
+        return await asyncio.gather(*(box.receive(u) for u in updates))
+    assert asyncio.run(ricevi()) == [True] * 5
+    # il primo fsync copre il primo update, il secondo tutti quelli arrivati nel frattempo
+    assert thread == [False, False]
+
+
+def _prepara(chat):
+    store = get_store(chat)
+    store.apply({"type": "player_registered", "username": "@capo", "player": "Capo"})
+    store.apply({"type": "admin_added", "username": "@capo"})
+    store.apply({"type": "player_registered", "username": "@a", "player": "A"})
+    store.apply({"type": "giornata_extracted", "g": "1", "leftover": [],
+                 "assignments": {"Capo": "Inter-Milan", "A": "Roma-Lazio"}})
+    return store
+
+
+def test_versa_rigiocato_non_raddoppia(aggiornamento, bot_finto):
+    chat = -4004
+    _prepara(chat)
+    versa = bot.handler(bot.versa)
+    update, context = aggiornamento(chat, "capo", "/versa @a 5")
+    asyncio.run(versa(update, context))
+    asyncio.run(versa(update, context))
+    assert get_store(chat).data["players"]["A"].paid == 5
+    assert bot_finto.testi(chat) == ["✅ Aggiunti 5€ a @a."]
+
+    # update_applicati sopravvive al riavvio
+    SHARDS.unload(chat)
+    asyncio.run(versa(update, context))
+    riletto = get_store(chat)
+    assert riletto.data["players"]["A"].paid == 5
+    assert [m.tipo for m in riletto.data["movimenti"]] == ["versamento"]
+
+
+def test_penale_jolly_rigiocata_non_raddoppia(aggiornamento, bot_finto):
+    chat = -4005
+    _prepara(chat)
+    gioca = bot.handler(bot.gioca)
+    updates = [aggiornamento(chat, "a", "/gioca Over 2.5 1.3") for _ in range(bot.TOT_JOLLY + 1)]
+    for update, context in updates:
+        asyncio.run(gioca(update, context))
+    store = get_store(chat)
+    assert store.data["players"]["A"].debt == bot.JOLLY_PENALTY_EUR
+    assert store.data["players"]["A"].jolly_used == 1
+
+    # l'inbox rigioca l'ultimo update (quello della penale), prima e dopo un riavvio
+    asyncio.run(gioca(*updates[-1]))
+    SHARDS.unload(chat)
+    asyncio.run(gioca(*updates[-1]))
+    riletto = get_store(chat)
+    assert riletto.data["players"]["A"].debt == bot.JOLLY_PENALTY_EUR
+    assert riletto.data["players"]["A"].jolly_used == 1
+    assert riletto.data["malloppo"].penali_jolly == bot.JOLLY_PENALTY_EUR
+    assert riletto.data["bets"]["1"].penali == {"@a": bot.JOLLY_PENALTY_EUR}
+    assert len([t for t in bot_finto.testi(chat) if "Penale" in t]) == 1
@@ -0,0 +1,146 @@
+import asyncio
+from types import SimpleNamespace
+
+import bot
+import kickoff
+from game_utils import get_store
+from kickoff import KickoffScheduler, piano_giornata
+
+PROMEMORIA, DURATA = kickoff.KICKOFF_PROMEMORIA, kickoff.KICKOFF_DURATA
+
+
+class JobQueueFinta:
+    """Al posto della JobQueue di PTB: registra i job di run_once senza eseguirli."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, name=None):
+        job = SimpleNamespace(callback=callback, when=when, rimosso=False)
+        job.schedule_removal = lambda: setattr(job, "rimosso", True)
+        self.jobs.append(job)
+        return job
+
+    def armati(self):
+        return [job.when for job in self.jobs if not job.rimosso]
+
+
+def _gruppo(chat, g="1", assignments=None):
+    store = get_store(chat)
+    for u, name in (("@a", "A"), ("@b", "B"), ("@c", "C")):
+        if u not in store.data.get("roster", {}):
+            store.apply({"type": "player_registered", "username": u, "player": name})
+    store.apply({"type": "giornata_extracted", "g": g, "leftover": [],
+                 "assignments": assignments or {"A": "Inter-Milan", "B": "Roma-Lazio", "C": "Napoli-Juve"}})
+    return store
+
+
+def _scheduler(calendario, adesso, actions=None):
+    return KickoffScheduler(get_store, lambda store, g_key: calendario.get(g_key, {}),
+                            actions if actions is not None else {
+                                "promemoria": bot._kickoff_promemoria, "inizio": bot._kickoff_inizio,
+                                "blocco": bot._kickoff_blocco, "fine": bot._kickoff_fine,
+                            }, clock=lambda: adesso[0])
+
+
+def test_piano_giornata():
+    piano = piano_giornata({"Inter-Milan": 1000.0, "Roma-Lazio": 5000.0, "Napoli-Juve": 1000.0},
+                           {"A": "Inter-Milan", "B": "Roma-Lazio", "C": "Napoli-Juve", "D": "Torino-Genoa"},
+                           {"@a": "A", "@b": "B", "@c": "C", "@d": "D"})
+    # Torino-Genoa senza orario: non blocca @d
+    assert piano == [(1000 - PROMEMORIA, "promemoria", ()), (1000, "inizio", ()),
+                     (1000, "blocco", ("@a", "@c")), (5000, "blocco", ("@b",)),
+                     (5000 + DURATA, "fine", ())]
+    assert piano_giornata({}, {"A": "Inter-Milan"}, {"@a": "A"}) == []
+
+
+def test_un_solo_job_riarmato_sulla_prima_scadenza():
+    adesso = [0.0]
+    tardi, presto, dopo = -5101, -5102, -5103
+    for chat in (tardi, presto, dopo):
+        _gruppo(chat)
+    calendario = {"1": {"Inter-Milan": 100_000.0}}
+    scheduler = _scheduler(calendario, adesso)
+    # pianificata prima di avere la JobQueue: start() la arma
+    assert scheduler.plan(tardi)
+    jq = JobQueueFinta()
+    scheduler.start(jq)
+    assert jq.armati() == [100_000 - PROMEMORIA]
+    assert not scheduler.plan(tardi)  # già pianificata
+    assert len(scheduler) == 4
+
+    # un calcio d'inizio più vicino in un altro gruppo: il job viene spostato, non duplicato
+    calendario["1"] = {"Inter-Milan": 50_000.0}
+    assert scheduler.plan(presto)
+    assert jq.armati() == [50_000 - PROMEMORIA]
+    assert len(jq.jobs) == 2 and jq.jobs[0].rimosso
+    # uno più lontano non tocca il job armato
+    calendario["1"] = {"Inter-Milan": 200_000.0}
+    assert scheduler.plan(dopo)
+    assert jq.armati() == [50_000 - PROMEMORIA] and len(jq.jobs) == 2
+    assert scheduler.stats["planned"] == 3
+
+    # gruppo passato a un altro worker: le sue azioni escono dall'heap
+    scheduler.forget(presto)
+    assert len(scheduler) == 8 and all(t[2] != presto for t in scheduler._heap)
+
+
+def test_blocco_per_giocatore(aggiornamento, bot_finto):
+    chat = -5104
+    store = _gruppo(chat)
+    adesso = [9_000.0]  # promemoria già passato: non pianificato
+    scheduler = _scheduler({"1": {"Inter-Milan": 10_000.0, "Roma-Lazio": 20_000.0}}, adesso)
+    jq = JobQueueFinta()
+    scheduler.start(jq, [chat])
+    assert [t[4] for t in sorted(scheduler._heap)] == ["inizio", "blocco", "blocco", "fine"]
+    context = SimpleNamespace(bot=bot_finto)
+
+    adesso[0] = 10_000.0
+    asyncio.run(scheduler._fire(context))
+    giornata = store.data["bets"]["1"]
+    assert giornata.status == "started"
+    # Napoli-Juve non ha orario: @c resta libero
+    assert giornata.bloccate == ["@a"]
+    assert jq.armati()[-1] == 20_000.0 - adesso[0]
+
+    gioca = bot.handler(bot.gioca)
+    for u in ("a", "b"):
+        asyncio.run(gioca(*aggiornamento(chat, u, "/gioca Over 2.5 1.8")))
+    assert "🔒 La tua partita è già iniziata: giocata bloccata." in bot_finto.testi(chat)
+    assert set(giornata.bets) == {"@b"}
+
+    adesso[0] = 20_000.0 + DURATA
+    asyncio.run(scheduler._fire(context))
+    assert giornata.bloccate == ["@a", "@b"]
+    assert giornata.status == "finished"
+    assert scheduler.stats["fired"] == 4 and not len(scheduler)
+
+
+def test_azioni_scartate_dopo_una_nuova_giornata(bot_finto):
+    chat = -5105
+    store = _gruppo(chat)
+    adesso = [9_000.0]
+    eseguite = []
+
+    async def registra(bot, chat_id, store, g_key, usernames):
+        eseguite.append((g_key, usernames))
+
+    calendario = {"1": {"Inter-Milan": 10_000.0}, "2": {"Roma-Lazio": 50_000.0}}
+    scheduler = _scheduler(calendario, adesso, dict.fromkeys(("promemoria", "inizio", "blocco", "fine"), registra))
+    scheduler.start(JobQueueFinta(), [chat])
+    # la G1 chiusa a mano e la G2 estratta prima dei calci d'inizio della G1
+    store.apply({"type": "status_changed", "g": "1", "status": "finished"})
+    _gruppo(chat, "2")
+    assert scheduler.plan(chat)
+
+    adesso[0] = 10_000.0
+    asyncio.run(scheduler._fire(SimpleNamespace(bot=bot_finto)))
+    assert eseguite == []
+    assert scheduler.stats["stale"] == 2
+    assert (chat, "1") not in scheduler._planned and (chat, "2") in scheduler._planned
+    assert store.data["bets"]["1"].bloccate == []
+
+    adesso[0] = 50_000.0
+    asyncio.run(scheduler._fire(SimpleNamespace(bot=bot_finto)))
+    # promemoria, inizio e blocco della G2
+    assert eseguite == [("2", ()), ("2", ()), ("2", ("@b",))]
@@ -0,0 +1,88 @@
+import random
+
+from ledger import Ledger, _Fenwick
+from model import Movimento
+
+TIPI = ("persa", "penale_jolly", "versamento", "rettifica_debito", "rettifica_versato")
+
+
+def _movimenti(n, giornate, seed=0):
+    rnd = random.Random(seed)
+    return [Movimento(rnd.choice("AB"), rnd.choice(TIPI), rnd.randint(1, 30),
+                      rnd.choice(giornate), 1_000 + i)
+            for i in range(n)]
+
+
+def _ingenuo(movimenti, giocatore, giornata):
+    return sum(m.variazione for m in movimenti
+               if m.giocatore == giocatore and (m.giornata or 0) <= giornata)
+
+
+def test_fenwick_somme_prefisse():
+    rnd = random.Random(1)
+    valori = [0] * 50
+    albero = _Fenwick(50)
+    for _ in range(300):
+        i, v = rnd.randrange(50), rnd.randint(-20, 20)
+        valori[i] += v
+        albero.add(i, v)
+    assert [albero.prefix(i) for i in range(50)] == [sum(valori[:i + 1]) for i in range(50)]
+    # oltre la fine: la somma di tutto
+    assert albero.prefix(500) == sum(valori)
+
+
+def test_saldi_per_giornata_come_la_somma_ingenua():
+    # giornate storiche importate fuori ordine, anche prima del registro (None)
+    movimenti = _movimenti(400, [None, 7, 2, 30, 1, 15, 2, 9])
+    ledger = Ledger.from_data({"movimenti": movimenti})
+    for giocatore in "AB":
+        for g in range(-1, 35):
+            atteso = _ingenuo(movimenti, giocatore, g) if g >= 0 else 0
+            assert ledger.saldo(giocatore, g) == atteso
+        assert ledger.saldo(giocatore) == _ingenuo(movimenti, giocatore, 10 ** 9)
+        assert ledger.variazione(giocatore, 3, 9) == \
+            _ingenuo(movimenti, giocatore, 9) - _ingenuo(movimenti, giocatore, 2)
+    assert ledger.saldo("nessuno", 5) == 0
+
+
+def test_albero_cresce_oltre_le_giornate_iniziali():
+    movimenti = _movimenti(100, [1, 5, 60])
+    ledger = Ledger.from_data({"movimenti": movimenti})
+    assert len(ledger.conti["A"].per_giornata) == 64
+    # una giornata oltre la dimensione attuale: l'albero si ricostruisce senza perdere i saldi
+    movimenti += [Movimento("A", "persa", 5, 200, 9_000), Movimento("A", "versamento", 3, 70, 9_001)]
+    ledger.sync(movimenti)
+    assert len(ledger.conti["A"].per_giornata) > 200
+    for g in (0, 1, 5, 60, 69, 70, 199, 200, 500):
+        assert ledger.saldo("A", g) == _ingenuo(movimenti, "A", g)
+
+
+def test_sync_indicizza_solo_i_nuovi():
+    movimenti = _movimenti(50, [3, 1, 2])
+    ledger = Ledger.from_data({"movimenti": movimenti[:20]})
+    ledger.sync(movimenti)
+    nuovo = Ledger.from_data({"movimenti": movimenti})
+    for giocatore in "AB":
+        assert [ledger.saldo(giocatore, g) for g in range(5)] == [nuovo.saldo(giocatore, g) for g in range(5)]
+        assert ledger.conti[giocatore].indici == nuovo.conti[giocatore].indici
+
+
+def test_estratto_in_ordine_di_giornata():
+    movimenti = [
+        Movimento("A", "persa", 5, 3, 100),
+        Movimento("A", "persa", 5, 1, 101),       # giornata importata dopo
+        Movimento("A", "versamento", 4, 3, 102),
+        Movimento("A", "penale_jolly", 20, 2, 103),
+        Movimento("A", "rettifica_debito", 2, None, 104),
+        Movimento("B", "persa", 5, 1, 105),
+    ]
+    ledger = Ledger.from_data({"movimenti": movimenti})
+    righe = [(m.giornata, m.tipo, saldo) for m, saldo in ledger.estratto(movimenti, "A")]
+    assert righe == [(None, "rettifica_debito", 2), (1, "persa", 7), (2, "penale_jolly", 27),
+                     (3, "persa", 32), (3, "versamento", 28)]
+    # da..a: parte dal saldo prima di `da`
+    assert [saldo for _, saldo in ledger.estratto(movimenti, "A", 2, 2)] == [27]
+    assert ledger.saldo("A", 1) == 7
+    # saldo a una data: in ordine di registrazione
+    assert ledger.saldo_al("A", 101) == 10 and ledger.saldo_al("A", 99) == 0
+    assert list(ledger.estratto(movimenti, "nessuno")) == []
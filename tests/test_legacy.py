@@ -0,0 +1,45 @@
+import os, shutil
+
+import game_utils
+from game_utils import LEGACY, LEGACY_ROSTER, get_store, verifica_aggregati
+from state_store import StateStore
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _copia_data_json(tmp_path) -> str:
+    path = str(tmp_path / "data.json")
+    shutil.copy(os.path.join(_REPO_DIR, "data.json"), path)
+    return path
+
+
+def _controlla_g1(store) -> None:
+    data = store.data
+    assert data["roster"] == LEGACY_ROSTER
+    # la G1 storica: le giocate perse sono dei giocatori della rosa, per username
+    perdenti = {u for u, b in data["bets"]["1"].bets.items() if b.esito == "persa"}
+    assert perdenti and perdenti <= set(LEGACY_ROSTER)
+    # registro: una "persa" da 5€ nella G1 per ciascuno, nessun saldo di apertura senza giornata
+    movimenti = data["movimenti"]
+    assert sorted((m.giocatore, m.tipo, m.euro, m.giornata) for m in movimenti) == sorted(
+        (LEGACY_ROSTER[u], "persa", 5, 1) for u in perdenti)
+    for name, p in data["players"].items():
+        assert store.ledger().saldo(name) == p.debt - p.paid
+    assert verifica_aggregati(data) == []
+
+
+def test_data_json_storico_aggiornato_con_la_rosa(tmp_path):
+    store = StateStore(_copia_data_json(tmp_path), legacy=LEGACY)
+    _controlla_g1(store)
+    assert store.dirty  # va riscritto nello schema corrente
+    store.close()
+
+
+def test_get_store_del_gruppo_storico(tmp_path, monkeypatch):
+    _copia_data_json(tmp_path)
+    monkeypatch.setattr(game_utils, "_BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(game_utils, "LEGACY_CHAT_ID", "-100")
+    try:
+        _controlla_g1(get_store(-100))
+    finally:
+        game_utils.SHARDS.discard(-100)
@@ -0,0 +1,43 @@
+import copy
+
+from game_utils import applica_lotto, get_store, invarianti, verifica_aggregati
+
+
+def _gruppo(chat_id):
+    store = get_store(chat_id)
+    for u, name in (("@chri", "Chri2"), ("@ale", "Ale")):
+        store.apply({"type": "player_registered", "username": u, "player": name})
+    store.apply({"type": "giornata_extracted", "g": "1", "leftover": [],
+                 "assignments": {"Chri2": "A-B", "Ale": "C-D"}})
+    store.apply({"type": "outcomes_applied", "g": "1", "losers": ["@chri"],
+                 "roster": {"@chri": "Chri2", "@ale": "Ale"}})
+    return store
+
+
+def test_invarianti_strutturati():
+    store = _gruppo(-2001)
+    assert invarianti(store.data) == []
+    # un punto in più senza giocata persa (il nome contiene una cifra)
+    store.apply({"type": "player_adjusted", "player": "Chri2", "points": 1})
+    assert invarianti(store.data) == [("Chri2", "punti", 1, 2)]
+    assert verifica_aggregati(store.data) == ["Chri2: punti 2 ma lo storico dice 1"]
+
+
+def test_lotto_tollera_le_differenze_vecchie_non_le_nuove():
+    store = _gruppo(-2002)
+    store.apply({"type": "player_adjusted", "player": "Chri2", "points": 1})
+    # un versamento non cambia la differenza già presente sui punti
+    assert applica_lotto(store, [{"type": "payment_recorded", "player": "Chri2", "euro": 5}]) == (1, None)
+    # una giornata storica con una persa di Chri2 senza punti: nuova differenza sullo stesso soggetto
+    prima = copy.deepcopy(store.data)
+    n, err = applica_lotto(store, [
+        {"type": "giornata_imported", "g": "0", "bets": {"@chri": {"giocata": "X", "quota": 2.0, "esito": "persa"}}},
+        {"type": "payment_recorded", "player": "Ale", "euro": 5},
+    ])
+    assert n is None and "Chri2: debito 5€ ma lo storico dice 10€" in err
+    # la prova non ha toccato lo stato vero
+    assert store.data == prima
+    # un debito negativo è sempre nuovo
+    n, err = applica_lotto(store, [{"type": "player_adjusted", "player": "Ale", "debt": -5}])
+    assert n is None and "Ale: debt negativo (-5)" in err
+    assert store.data == prima
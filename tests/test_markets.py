@@ -0,0 +1,67 @@
+import pytest
+
+from markets import Market, canonical, combo_vince, from_dati, parse_giocata, regola_giornata, to_dati, vince
+from model import Bet, Giornata
+
+
+@pytest.mark.parametrize("testo, mercati", [
+    ("Over 2.5", (Market("over", (2.5,)),)),
+    ("o2,5", (Market("over", (2.5,)),)),
+    ("1X", (Market("doppia", ("1X",)),)),
+    ("gg", (Market("gg"),)),
+    ("No Goal", (Market("ng"),)),
+    ("1 + Over 1.5", (Market("esito", ("1",)), Market("over", (1.5,)))),
+    ("Multigol 2-4", (Market("multigol", (2, 4)),)),
+    ("2-1", (Market("esatto", (2, 1)),)),
+])
+def test_parse_giocata(testo, mercati):
+    assert parse_giocata(testo) == mercati
+    # la forma salvata in dati_verifica torna la stessa combo
+    assert from_dati(to_dati(mercati)) == mercati
+
+
+@pytest.mark.parametrize("testo", ["Juve vince", "Over", "1 + boh", "Multigol 4-2", ""])
+def test_giocata_non_riconosciuta(testo):
+    assert parse_giocata(testo) is None
+
+
+def test_canonical():
+    assert canonical(parse_giocata(" o 1,5 +  1 ")) == "Over 1.5 + 1"
+
+
+@pytest.mark.parametrize("testo, vinte, perse", [
+    ("Over 2.5", [(2, 1), (0, 3)], [(1, 1), (0, 0)]),
+    ("1X", [(1, 0), (2, 2)], [(0, 1)]),
+    ("GG", [(1, 1), (3, 2)], [(1, 0), (0, 0)]),
+    ("1 + Over 1.5", [(2, 0), (3, 1)], [(1, 0), (1, 1), (1, 2)]),
+    ("Multigol 2-4", [(1, 1), (2, 2)], [(1, 0), (3, 2)]),
+])
+def test_vince(testo, vinte, perse):
+    combo = parse_giocata(testo)
+    assert all(combo_vince(combo, s) for s in vinte)
+    assert not any(combo_vince(combo, s) for s in perse)
+
+
+def test_mercato_sconosciuto():
+    with pytest.raises(ValueError):
+        vince(Market("handicap", (1,)), (1, 0))
+
+
+def test_regola_giornata():
+    rosa = {"@a": "A", "@b": "B", "@c": "C", "@d": "D", "@e": "E", "@f": "F"}
+    g = Giornata(
+        assignments={"A": "Inter-Milan", "B": "Inter-Milan", "C": "Roma-Lazio", "D": "Roma-Lazio",
+                     "E": "Napoli-Juve", "F": "Inter-Milan"},
+        bets={"@a": Bet("Over 2.5", 1.8), "@b": Bet("1 + Over 1.5", 2.1), "@c": Bet("Juve vince", 1.6),
+              "@d": Bet("GG", 1.7), "@e": Bet("Multigol 2-4", 1.5),
+              # dati_verifica salvati prevalgono sul testo
+              "@f": Bet("X", 3.2, False, None, "mercato", to_dati(parse_giocata("2")))},
+        risultati={"Inter-Milan": [2, 0], "Roma-Lazio": [1, 1]},
+    )
+    perdenti, da_decidere = regola_giornata(g, rosa)
+    assert perdenti == ["@a", "@f"]
+    assert da_decidere == {"@c": "giocata non riconosciuta: Juve vince",
+                           "@e": "manca il risultato di Napoli-Juve"}
+    # chi non ha giocato va deciso a mano
+    assert regola_giornata(Giornata(assignments={"A": "Inter-Milan"}), {"@a": "A"}) == \
+        ([], {"@a": "nessuna giocata"})
@@ -0,0 +1,54 @@
+import asyncio, time
+
+from outbox import Outbox
+from rate_limit import IN_BLOCCO, TokenBucket
+
+
+def test_le_risposte_non_aspettano_il_bucket_globale():
+    outbox = Outbox(global_bucket=TokenBucket(rate=10, capacity=5))
+
+    async def in_blocco():
+        IN_BLOCCO.set(True)
+        t0 = time.monotonic()
+        await outbox.acquire_global()
+        return time.monotonic() - t0
+
+    async def prova():
+        t0 = time.monotonic()
+        for _ in range(20):  # ben oltre il limite: nessuna attesa, il debito resta limitato
+            await outbox.acquire_global()
+        assert time.monotonic() - t0 < 0.05
+        assert outbox.global_bucket.tokens >= -outbox.global_bucket.capacity
+        # il traffico in blocco paga il debito delle risposte
+        return await asyncio.create_task(in_blocco())
+
+    assert asyncio.run(prova()) > 0.2
+
+
+def test_errori_definitivi_non_vengono_ripetuti(monkeypatch):
+    import outbox as modulo
+    from telegram.error import BadRequest, Forbidden, TimedOut
+    monkeypatch.setattr(modulo, "OUTBOX_BACKOFF", 0)
+    outbox = Outbox(global_bucket=TokenBucket(rate=10, capacity=5))
+    errori = {-1: [BadRequest("Chat not found")], 2: [Forbidden("bot can't initiate conversation")],
+              -3: [TimedOut(), None]}  # -3: un timeout e poi va
+    chiamate = []
+
+    class Bot:
+        async def send_message(self, chat_id, text):
+            chiamate.append(chat_id)
+            e = errori[chat_id].pop(0)
+            if e is not None:
+                raise e
+            return text
+
+    async def prova():
+        bot = Bot()
+        futures = [outbox.send(bot, chat_id, "ciao") for chat_id in errori]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    non_trovata, bloccato, ok = asyncio.run(prova())
+    assert isinstance(non_trovata, BadRequest) and isinstance(bloccato, Forbidden)
+    assert ok == "ciao"
+    assert sorted(chiamate) == [-3, -3, -1, 2]
+    assert outbox.stats["retries"] == 1 and outbox.stats["errors"] == 2
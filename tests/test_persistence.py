@@ -0,0 +1,67 @@
+import asyncio, json
+
+from game_utils import PERSISTENZA_KEY, SHARDS, persistence_store
+from model import new_group
+from persistence import StorePersistence
+from state_store import StateStore
+
+
+def test_dati_di_ptb_sopravvivono_al_riavvio():
+    p = StorePersistence(persistence_store)
+
+    async def salva():
+        await p.update_chat_data(-100, {"solleciti": ["@a", "@b"]})
+        await p.update_chat_data(-200, {"x": 1})
+        await p.update_user_data(42, {"privato": True})
+        await p.update_bot_data({"avvii": 3})
+        await p.update_conversation("modifica", (-100, 42), "quota")
+        await p.drop_chat_data(-200)
+        await p.flush()
+    asyncio.run(salva())
+
+    SHARDS.unload(PERSISTENZA_KEY)
+    riletta = StorePersistence(persistence_store)
+
+    async def leggi():
+        return (await riletta.get_chat_data(), await riletta.get_user_data(),
+                await riletta.get_bot_data(), await riletta.get_conversations("modifica"))
+    chat_data, user_data, bot_data, conversazioni = asyncio.run(leggi())
+    assert chat_data == {-100: {"solleciti": ["@a", "@b"]}}
+    assert user_data == {42: {"privato": True}}
+    assert bot_data == {"avvii": 3}
+    assert conversazioni == {(-100, 42): "quota"}
+
+    # PTB modifica in place quello che ha letto: lo stato non deve cambiare con lui
+    chat_data[-100]["solleciti"].append("@c")
+    assert persistence_store().data["persistenza"]["chat_data"]["-100"] == {"solleciti": ["@a", "@b"]}
+    # e un valore uguale all'ultimo letto non viene riscritto
+    asyncio.run(riletta.update_bot_data({"avvii": 3}))
+    assert riletta.stats == {"updates": 1, "skipped": 1, "written": 0, "batches": 0}
+
+
+def test_update_nel_journal_senza_riscrivere_lo_snapshot(tmp_path):
+    path = tmp_path / "persistenza.json"
+    store = StateStore(str(path), default=new_group)
+    snapshot = []
+    store._write = lambda *args: snapshot.append(args)
+    p = StorePersistence(lambda: store)
+
+    async def giro(chat_data):
+        # come PTB: gli update_* di un giro partono insieme
+        await asyncio.gather(*(p.update_chat_data(chat_id, d) for chat_id, d in chat_data.items()),
+                             p.update_bot_data({"giri": len(chat_data)}))
+    asyncio.run(giro({-1: {"a": 1}, -2: {"b": 2}, -3: {"c": 3}}))
+    asyncio.run(giro({-1: {"a": 1}, -2: {"b": 20}}))
+
+    assert snapshot == [] and not path.exists()
+    righe = [json.loads(r) for r in (tmp_path / "persistenza.jsonl").read_text().splitlines()]
+    # un evento per giro, solo con le voci cambiate
+    assert [e["type"] for e in righe] == ["persistence_updated"] * 2
+    assert len(righe[0]["entries"]) == 4
+    assert righe[1]["entries"] == [["chat_data", "-2", {"b": 20}], ["bot_data", "", {"giri": 2}]]
+    assert p.stats["skipped"] == 1 and p.stats["batches"] == 2
+
+    # rileggendo dal solo journal
+    store.close()
+    riletto = StateStore(str(path), default=new_group)
+    assert riletto.data["persistenza"]["chat_data"] == {"-1": {"a": 1}, "-2": {"b": 20}, "-3": {"c": 3}}
@@ -0,0 +1,25 @@
+from model import new_group
+from sqlite_store import SqliteStore
+from state_store import CURRENT_UPDATE
+
+
+def test_evento_riscrive_solo_le_chiavi_meta_cambiate(tmp_path):
+    path = str(tmp_path / "data.sqlite")
+    store = SqliteStore(path, default=new_group)
+    store.apply({"type": "persistence_updated", "entries": [["chat_data", str(i), {"x": i}] for i in range(200)]})
+    scritte = []
+    store._connect().set_trace_callback(lambda sql: scritte.append(sql) if "INTO meta" in sql else None)
+    token = CURRENT_UPDATE.set(42)
+    try:
+        store.apply({"type": "admin_added", "username": "@a"})
+    finally:
+        CURRENT_UPDATE.reset(token)
+    chiavi = {sql.split("VALUES ('", 1)[1].split("'", 1)[0] for sql in scritte}
+    assert chiavi == {"journal_seq", "update_applicati"}
+    store.close()
+
+    riaperto = SqliteStore(path)
+    assert riaperto.data["admins"] == ["@a"]
+    assert len(riaperto.data["persistenza"]["chat_data"]) == 200
+    assert riaperto.applied_update(42)
+    riaperto.close()
@@ -0,0 +1,57 @@
+import pytest
+
+import state_store
+from model import new_group
+from sqlite_store import SqliteStore
+from state_store import StateStore
+
+
+def _gruppo(tmp_path):
+    path = str(tmp_path / "data.json")
+    store = StateStore(path, default=new_group)
+    store.apply({"type": "admin_added", "username": "@a"})
+    store.flush()
+    store.close()
+    return path
+
+
+def test_snapshot_binario_usato_se_corrisponde(tmp_path):
+    path = _gruppo(tmp_path)
+    store = StateStore(path)
+    assert store._load_bin() is not None
+    assert store.data["admins"] == ["@a"]
+    assert not store.dirty
+
+
+def test_snapshot_binario_ignorato_se_cambiano_le_dataclass(tmp_path, monkeypatch):
+    path = _gruppo(tmp_path)
+    # un campo aggiunto a Player senza cambiare SCHEMA_VERSION
+    monkeypatch.setattr(state_store, "IMPRONTA", state_store.IMPRONTA + (("Player", "nuovo"),))
+    store = StateStore(path)
+    assert store._load_bin() is None
+    assert store.data["admins"] == ["@a"]
+    assert store.dirty  # il prossimo salvataggio riscrive lo snapshot binario con l'impronta nuova
+
+
+def _importa(g):
+    return {"type": "giornata_imported", "g": g, "assignments": {}, "bets": {}}
+
+
+@pytest.mark.parametrize("store_cls", [StateStore, SqliteStore])
+def test_evento_rifiutato_non_resta_nel_journal(tmp_path, store_cls):
+    path = str(tmp_path / ("data.json" if store_cls is StateStore else "data.sqlite"))
+    store = store_cls(path, default=new_group)
+    store.apply(_importa("1"))
+    with pytest.raises(ValueError):
+        store.apply(_importa("1"))  # "la giornata 1 esiste già"
+    # un batch rifiutato a metà non lascia in memoria la parte già applicata
+    with pytest.raises(ValueError):
+        store.apply({"type": "batch", "events": [{"type": "admin_added", "username": "@a"}, _importa("1")]})
+    assert "@a" not in store.data.get("admins", [])
+    store.apply({"type": "admin_added", "username": "@b"})
+    store.close()
+
+    riaperto = store_cls(path, default=new_group)
+    assert list(riaperto.data["bets"]) == ["1"]
+    assert riaperto.data["admins"] == ["@b"]
+    riaperto.close()
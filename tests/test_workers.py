@@ -0,0 +1,107 @@
+import asyncio, os, sqlite3, time
+
+import pytest
+
+from model import new_group
+from shards import ShardManager
+from state_store import ChatNonMia
+from summary import SummaryScheduler
+from workers import Coordinator
+
+CHAT = -3001
+
+
+def _worker(tmp_path, worker_id, orologio):
+    coord = Coordinator(str(tmp_path / "workers.sqlite"), worker_id, lease=10, clock=lambda: orologio[0])
+    shards = ShardManager(lambda key: str(tmp_path / str(key) / "data.json"), new_group,
+                          may_write=coord.mia)
+    return coord, shards
+
+
+def _journal(tmp_path):
+    with open(tmp_path / str(CHAT) / "data.jsonl", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_riepilogo_dopo_il_passaggio_della_chat(tmp_path, bot_finto):
+    orologio = [1000.0]
+    w1, shards1 = _worker(tmp_path, "w1", orologio)
+    w2, shards2 = _worker(tmp_path, "w2", orologio)
+    asyncio.run(w1.heartbeat())
+    asyncio.run(w2.heartbeat())
+    assert asyncio.run(w1.proprietario(CHAT)) == "w1"
+    assert asyncio.run(w2.proprietario(CHAT)) == "w1"
+
+    store1 = shards1.get(CHAT)
+    store1.apply({"type": "player_registered", "username": "@chri", "player": "Chri"})
+    store1.apply({"type": "giornata_extracted", "g": "1", "leftover": [], "assignments": {"Chri": "A-B"}})
+    riepiloghi1 = SummaryScheduler(shards1.get, lambda data, g: f"G{g}", debounce=0, owns=w1.mia)
+    # prima del passaggio w1 può leggere la chat da un altro worker, ma non scriverla
+    with pytest.raises(ChatNonMia):
+        shards2.get(CHAT).apply({"type": "bet_deleted", "g": "1", "username": "@chri"})
+
+    # w1 non rinnova il lease: la chat passa a w2, che la rilegge da disco e ci scrive
+    orologio[0] += 11
+    asyncio.run(w2.heartbeat())
+    assert asyncio.run(w2.proprietario(CHAT)) == "w2"
+    shards2.discard(CHAT)
+    store2 = shards2.get(CHAT)
+    store2.apply({"type": "bet_placed", "g": "1", "username": "@chri", "player": "Chri",
+                  "giocata": "Over 2.5", "quota": 1.8, "jolly": False})
+    righe = _journal(tmp_path)
+
+    # il riepilogo programmato da w1 prima del passaggio parte adesso: niente chiamate, niente journal
+    async def aggiorna():
+        riepiloghi1.schedule(bot_finto, CHAT, "1")
+        await riepiloghi1.drain()
+
+    asyncio.run(aggiorna())
+    assert riepiloghi1.stats["not_owned"] == 1 and riepiloghi1.stats["api_calls"] == 0
+    assert bot_finto.testi(CHAT) == []
+    with pytest.raises(ChatNonMia):
+        store1.apply({"type": "summary_updated", "g": "1", "summary_message_id": 7, "pinned_summary_id": 7})
+    assert _journal(tmp_path) == righe
+
+    # rilette da disco le scritture di entrambi i proprietari ci sono tutte, una volta sola
+    shards2.discard(CHAT)
+    data = shards2.get(CHAT).data
+    assert data["bets"]["1"].bets["@chri"].giocata == "Over 2.5"
+    assert data["bets"]["1"].summary_message_id is None
+    assert os.path.exists(tmp_path / str(CHAT) / "data.jsonl")
+    for w in (w1, w2):
+        w.close()
+
+
+def test_il_database_bloccato_non_ferma_il_loop(tmp_path, aggiornamento):
+    orologio = [1000.0]
+    w1, _ = _worker(tmp_path, "w1", orologio)
+    w2, _ = _worker(tmp_path, "w2", orologio)
+    mia, altrui = -3002, -3003
+    asyncio.run(w1.heartbeat())
+    asyncio.run(w2.heartbeat())
+    asyncio.run(w1.proprietario(mia))
+    asyncio.run(w2.proprietario(altrui))
+    asyncio.run(w1.heartbeat())
+    assert w1.altrui == {str(altrui): "w2"}
+
+    # un altro processo tiene il lock di scrittura del database di coordinamento
+    blocco = sqlite3.connect(str(tmp_path / "workers.sqlite"), isolation_level=None)
+    blocco.execute("BEGIN IMMEDIATE")
+
+    async def prova():
+        heartbeat = asyncio.create_task(w1.heartbeat())
+        t0 = time.monotonic()
+        for _ in range(10):  # il loop continua a girare mentre l'heartbeat aspetta il lock
+            await asyncio.sleep(0.01)
+        assert not heartbeat.done()
+        # instradare non aspetta il lock: proprietario dalla memoria, update girati in attesa con una lettura
+        assert await w1.proprietario(altrui) == "w2"
+        assert await w1.instrada(aggiornamento(mia, "chri", "/classifica")[0]) is False
+        assert time.monotonic() - t0 < 1
+        blocco.execute("COMMIT")
+        await heartbeat
+
+    asyncio.run(prova())
+    blocco.close()
+    for w in (w1, w2):
+        w.close()
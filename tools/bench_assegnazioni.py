@@ -0,0 +1,90 @@
+"""
+Simula stagioni intere con il calendario di giornate.json e confronta l'estrazione casuale
+(random.sample, come prima) con quella equa di assignment.assegna.
+
+Per ogni stagione ogni squadra ha una difficoltà "vera" nascosta; l'esito delle giocate viene
+estratto da quella, così assignment impara la difficoltà solo dallo storico come nel bot.
+
+    python tools/bench_assegnazioni.py --stagioni 20 --giocatori 7
+"""
+from __future__ import annotations
+import argparse, os, random, statistics, sys, time
+from typing import Any, Dict, List
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _REPO_DIR)
+
+import numpy as np  # noqa: E402
+
+from assignment import _teams, assegna  # noqa: E402
+from model import Bet, Giornata  # noqa: E402
+from schedule import ScheduleService  # noqa: E402
+
+
+def casuale(players: List[str], matches: List[str], data: Dict[str, Any], rng: random.Random) -> Dict[str, str]:
+    selected = rng.sample(matches, len(players))
+    shuffled = players.copy()
+    rng.shuffle(shuffled)
+    return dict(zip(shuffled, selected))
+
+
+def stagione(giornate: Dict[str, List[str]], n_players: int, metodo: str, seed: int) -> Dict[str, float]:
+    rng = random.Random(seed)
+    nrng = np.random.default_rng(seed)
+    players = [f"P{i}" for i in range(n_players)]
+    data: Dict[str, Any] = {"roster": {f"@p{i}": p for i, p in enumerate(players)}, "bets": {}}
+    teams = {t for ms in giornate.values() for f in ms for t in _teams(f)}
+    vera = {t: rng.uniform(0.2, 0.7) for t in sorted(teams)}
+    cumulata = dict.fromkeys(players, 0.0)
+    tempi: List[float] = []
+
+    for g_key in sorted(giornate, key=int):
+        matches = giornate[g_key]
+        t0 = time.perf_counter()
+        if metodo == "equo":
+            assignments = assegna(players, matches, data, rng=nrng)
+        else:
+            assignments = casuale(players, matches, data, rng)
+        tempi.append(time.perf_counter() - t0)
+        bets = {}
+        for u, p in data["roster"].items():
+            home, away = _teams(assignments[p])
+            d = (vera[home] + vera[away]) / 2
+            cumulata[p] += d
+            bets[u] = Bet(esito="persa" if rng.random() < d else "vinta")
+        data["bets"][g_key] = Giornata(status="finished", assignments=assignments, bets=bets)
+
+    conteggi: Dict[str, Dict[str, int]] = {p: {} for p in players}
+    for g in data["bets"].values():
+        for p, f in g.assignments.items():
+            for t in _teams(f):
+                conteggi[p][t] = conteggi[p].get(t, 0) + 1
+    return {
+        "max_ripetizioni": max(max(c.values()) for c in conteggi.values()),
+        "squadre_diverse": statistics.mean(len(c) for c in conteggi.values()),
+        "scarto_difficolta": max(cumulata.values()) - min(cumulata.values()),
+        "ms_medio": statistics.mean(tempi) * 1000,
+        "ms_max": max(tempi) * 1000,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark dell'assegnazione delle partite")
+    ap.add_argument("--stagioni", type=int, default=20)
+    ap.add_argument("--giocatori", type=int, default=7)
+    ap.add_argument("--calendario", default=os.path.join(_REPO_DIR, "giornate.json"))
+    args = ap.parse_args()
+    giornate = ScheduleService().calendar(args.calendario).giornate
+
+    print(f"{args.stagioni} stagioni × {len(giornate)} giornate, {args.giocatori} giocatori")
+    print(f"{'metodo':<8} {'max rip. squadra':>17} {'squadre diverse':>16} {'scarto difficoltà':>18} "
+          f"{'ms/giornata':>12} {'ms max':>8}")
+    for metodo in ("casuale", "equo"):
+        rows = [stagione(giornate, args.giocatori, metodo, seed) for seed in range(args.stagioni)]
+        avg = {k: statistics.mean(r[k] for r in rows) for k in rows[0]}
+        print(f"{metodo:<8} {avg['max_ripetizioni']:>17.1f} {avg['squadre_diverse']:>16.1f} "
+              f"{avg['scarto_difficolta']:>18.2f} {avg['ms_medio']:>12.2f} {max(r['ms_max'] for r in rows):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Tempo di avvio a freddo del bot: dal lancio di bot.py alla risposta al primo update.
+
+1. Genera --groups gruppi (come tools/bench_modello.py) nella cartella degli shard.
+2. Avvia bot.py in polling contro il server finto della Bot API (tools/fake_bot_api.py) con un
+   /classifica già in coda per uno dei gruppi, misura quando arriva la risposta e lo ferma.
+   Il primo avvio serve solo a portare gli stati allo schema corrente (e a scrivere gli
+   snapshot binari): non viene contato.
+3. Ripete --ripetizioni volte per ogni modalità (snapshot binario acceso e spento,
+   STATE_SNAPSHOT_BIN) e riporta le mediane, con le fasi stampate dal bot ("⏱️ Primo update: ...").
+
+Lo stesso script gira su un checkout precedente (--repo), dove le fasi non ci sono:
+
+    git worktree add /tmp/base <commit>
+    python tools/bench_avvio.py --repo /tmp/base
+    python tools/bench_avvio.py
+"""
+from __future__ import annotations
+import argparse, os, re, shutil, signal, statistics, subprocess, sys, tempfile, time
+from typing import Dict, List, Tuple
+
+_TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPO_DIR = os.path.dirname(_TOOLS_DIR)
+sys.path.insert(0, _TOOLS_DIR)
+
+from bench_modello import genera  # noqa: E402
+from fake_bot_api import FakeBotApi  # noqa: E402
+
+_FASE = re.compile(r"([a-z][a-z ]*?) (\d+) ms")
+
+
+def prepara(shards_dir: str, n_groups: int, n_players: int, n_giornate: int, seed: int) -> None:
+    """Gruppi in shards_dir/<chat_id>/data.json, con chat_id negativi come i gruppi veri."""
+    tmp = tempfile.mkdtemp(prefix="bench-avvio-gen-")
+    try:
+        genera(tmp, n_groups, n_players, n_giornate, seed)
+        os.makedirs(shards_dir, exist_ok=True)
+        for gi in range(n_groups):
+            os.rename(os.path.join(tmp, str(gi)), os.path.join(shards_dir, str(-1_000_000 - gi)))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def avvia(api: FakeBotApi, repo: str, shards_dir: str, binario: bool,
+          timeout: float) -> Tuple[float, Dict[str, float]]:
+    """(secondi dal lancio alla prima risposta, fasi in ms dal riepilogo del bot) per un avvio."""
+    chat = {"id": -1_000_000, "type": "group", "title": "Gruppo 0"}
+    user = {"id": 10_000, "is_bot": False, "first_name": "G0", "username": "u0_0"}
+    update_id = api.push_message(chat, user, "/classifica")
+    env = dict(os.environ)
+    env.pop("WEBHOOK_URL", None)
+    env.update({"BOT_TOKEN": "123456:BENCH", "BOT_API_BASE_URL": api.base_url, "SHARDS_DIR": shards_dir,
+                "STATE_SNAPSHOT_BIN": "1" if binario else "0", "PYTHONUNBUFFERED": "1"})
+    t0 = time.monotonic()
+    proc = subprocess.Popen([sys.executable, os.path.join(repo, "bot.py")], cwd=repo, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        while update_id not in api.responses:
+            if proc.poll() is not None:
+                raise SystemExit(f"bot.py è uscito (codice {proc.returncode}):\n{proc.stdout.read()}")
+            if time.monotonic() - t0 > timeout:
+                raise SystemExit(f"nessuna risposta entro {timeout:.0f}s")
+            time.sleep(0.002)
+        elapsed = api.responses[update_id] - t0
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            out, _ = proc.communicate(timeout=60)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            out, _ = proc.communicate()
+    fasi: Dict[str, float] = {}
+    for line in out.splitlines():
+        if "Primo update:" in line:
+            fasi = {nome: float(ms) for nome, ms in _FASE.findall(line.split(":", 1)[1].split("=")[0])}
+    return elapsed, fasi
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Tempo dal lancio di bot.py alla risposta al primo update")
+    ap.add_argument("--repo", default=_REPO_DIR, help="checkout da misurare (default: questo)")
+    ap.add_argument("--groups", type=int, default=100)
+    ap.add_argument("--players", type=int, default=10)
+    ap.add_argument("--giornate", type=int, default=38)
+    ap.add_argument("--ripetizioni", type=int, default=5)
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    repo = os.path.abspath(args.repo)
+
+    folder = tempfile.mkdtemp(prefix="bench-avvio-")
+    api = FakeBotApi().start()
+    risultati: List[Tuple[str, List[float], Dict[str, List[float]]]] = []
+    try:
+        shards_dir = os.path.join(folder, "gruppi")
+        prepara(shards_dir, args.groups, args.players, args.giornate, args.seed)
+        avvia(api, repo, shards_dir, True, args.timeout)  # riscaldamento: schema corrente e snapshot binari
+        for nome, binario in (("snapshot binario", True), ("solo JSON", False)):
+            tempi: List[float] = []
+            fasi: Dict[str, List[float]] = {}
+            for _ in range(args.ripetizioni):
+                elapsed, f = avvia(api, repo, shards_dir, binario, args.timeout)
+                tempi.append(elapsed)
+                for k, v in f.items():
+                    fasi.setdefault(k, []).append(v)
+            risultati.append((nome, tempi, fasi))
+    finally:
+        api.stop()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"{repo}")
+    print(f"{args.groups} gruppi × {args.players} giocatori × {args.giornate} giornate, "
+          f"mediana di {args.ripetizioni} avvii")
+    for nome, tempi, fasi in risultati:
+        dettaglio = " + ".join(f"{k} {statistics.median(v):.0f}" for k, v in fasi.items())
+        print(f"{nome:>16}: primo update dopo {statistics.median(tempi) * 1000:.0f} ms "
+              f"(min {min(tempi) * 1000:.0f}, max {max(tempi) * 1000:.0f})"
+              + (f" | {dettaglio} ms" if dettaglio else ""))
+
+
+if __name__ == "__main__":
+    main()
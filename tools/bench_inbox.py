@@ -0,0 +1,156 @@
+"""
+Misura il recupero dopo un crash con l'inbox durevole (inbox.py).
+
+1. Avvia bot.py contro la Bot API finta, registra i gruppi, estrae la giornata e manda
+   --live /gioca che il bot gestisce normalmente; poi lo uccide con SIGKILL.
+2. Simula il caso peggiore: i segni "finito" di quelle giocate si sono persi (non hanno fsync)
+   e nell'inbox ci sono altre --backlog /gioca ricevute ma mai gestite.
+3. Riavvia il bot e misura quanto ci mette a rigiocare tutto.
+
+Alla fine confronta jolly usati e debito di ogni giocatore con quelli attesi: se una giocata
+già applicata venisse rigiocata, jolly e penali risulterebbero contati due volte.
+
+    python tools/bench_inbox.py --groups 20 --players 7 --backlog 5000
+"""
+from __future__ import annotations
+import argparse, json, os, shutil, sys, time
+from typing import Dict, List, Tuple
+
+_TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPO_DIR = os.path.dirname(_TOOLS_DIR)
+sys.path.insert(0, _TOOLS_DIR)
+sys.path.insert(0, _REPO_DIR)
+
+from loadgen import LoadGen  # noqa: E402
+
+# Stesse regole di bot.gioca
+MIN_QUOTA, TOT_JOLLY, JOLLY_PENALTY_EUR = 1.50, 3, 20
+QUOTE = [1.35, 1.45, 1.6, 1.9, 2.1]
+
+
+class RecoveryBench(LoadGen):
+    def __init__(self, args):
+        super().__init__(args)
+        self.sent: Dict[int, List[Tuple[int, str, float]]] = {}  # chat_id -> [(update_id, username, quota)]
+
+    def _gioca(self, queue: bool) -> dict:
+        g = self.rng.choice(self.groups)
+        user = self.rng.choice(g.users)
+        quota = self.rng.choice(QUOTE)
+        update = self.api.message_update(g.chat, user, f"/gioca Over 2.5 {quota}", queue=queue)
+        self.sent.setdefault(g.chat["id"], []).append((update["update_id"], f"@{user['username']}", quota))
+        return update
+
+    def _inbox_path(self) -> str:
+        return os.path.join(self.state_dir, "inbox.jsonl")
+
+    def _forget_done(self, update_ids: List[int], backlog: List[dict]) -> None:
+        """Toglie dall'inbox i segni "finito" di update_ids e aggiunge gli update del backlog come ricevuti."""
+        forget = set(update_ids)
+        out = []
+        with open(self._inbox_path(), "r", encoding="utf-8") as f:
+            for line in f:
+                rec = json.loads(line)
+                if rec.get("d") in forget:
+                    continue
+                if "seen" in rec:
+                    rec["seen"] = [u for u in rec["seen"] if u not in forget]
+                out.append(json.dumps(rec, ensure_ascii=False))
+        out += [json.dumps({"u": u}, ensure_ascii=False) for u in backlog]
+        with open(self._inbox_path(), "w", encoding="utf-8") as f:
+            f.write("\n".join(out) + "\n")
+
+    def expected(self) -> Dict[int, Dict[str, Tuple[int, int]]]:
+        """chat_id -> username -> (jolly_used, penali in euro) attesi, rigiocando le regole di /gioca."""
+        out = {}
+        for chat_id, bets in self.sent.items():
+            state: Dict[str, Tuple[int, int]] = {}
+            for _, username, quota in sorted(bets):
+                used, debt = state.get(username, (0, 0))
+                if quota < MIN_QUOTA:
+                    used += 1
+                    if used > TOT_JOLLY:
+                        used, debt = 1, debt + JOLLY_PENALTY_EUR
+                state[username] = (used, debt)
+            out[chat_id] = state
+        return out
+
+    def mismatches(self) -> int:
+        from model import new_group
+        from state_store import StateStore
+        wrong = 0
+        for g in self.groups:
+            store = StateStore(os.path.join(self.state_dir, str(g.chat["id"]), "data.json"),
+                               default=new_group)
+            d = store.data
+            for username, (used, debt) in self.expected().get(g.chat["id"], {}).items():
+                p = d["players"][d["roster"][username]]
+                if (p.jolly_used, p.debt) != (used, debt):
+                    wrong += 1
+                    print(f"  ✗ {g.chat['id']} {username}: jolly/debito {p.jolly_used}/{p.debt}, "
+                          f"attesi {used}/{debt}")
+            store.close()
+        return wrong
+
+    def run(self) -> int:
+        log_path = os.path.join(self.state_dir, "bot.log")
+        try:
+            with open(log_path, "w", encoding="utf-8") as log:
+                self.start_bot(stdout=None if self.args.verbose else log)
+                self.setup()
+                live = [self._gioca(queue=True)["update_id"] for _ in range(self.args.live)]
+                if self.wait(live, self.args.timeout):
+                    raise SystemExit("il bot non ha risposto a tutte le giocate prima del crash")
+                self.proc.kill()
+                self.proc.wait()
+                backlog = [self._gioca(queue=False) for _ in range(self.args.backlog)]
+                self._forget_done(live, backlog)
+                size = os.path.getsize(self._inbox_path())
+                print(f"inbox dopo il crash: {len(live)} giocate già applicate senza segno di fine "
+                      f"+ {len(backlog)} mai gestite ({size / 1024:.0f} KB)")
+
+                t0 = time.monotonic()
+                self.start_bot(stdout=None if self.args.verbose else log)
+                t_ready = time.monotonic()
+                ids = [u["update_id"] for u in backlog]
+                unanswered = self.wait(ids, self.args.timeout)
+                t_done = time.monotonic()
+                self.stop_bot()
+        finally:
+            if self.proc is not None and self.proc.poll() is None:
+                self.proc.kill()
+            self.api.stop()
+
+        print(f"riavvio: polling dopo {(t_ready - t0) * 1000:.0f} ms, backlog rigiocato in {t_done - t0:.2f} s "
+              f"({len(ids) / max(t_done - t0, 1e-9):.0f} update/s)")
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(("📥", "Inbox:")):
+                    print("  bot:", line.rstrip())
+        if unanswered:
+            print(f"⚠️ {unanswered} giocate del backlog senza risposta entro {self.args.timeout}s")
+        wrong = self.mismatches()
+        print(f"giocatori con jolly/penali sbagliati: {wrong}")
+        if self.args.keep:
+            print(f"stato lasciato in {self.state_dir}")
+        else:
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+        return 1 if wrong or unanswered else 0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark del recupero dall'inbox dopo un crash")
+    ap.add_argument("--groups", type=int, default=20)
+    ap.add_argument("--players", type=int, default=7)
+    ap.add_argument("--live", type=int, default=200, help="giocate gestite prima del crash")
+    ap.add_argument("--backlog", type=int, default=5000, help="giocate nell'inbox mai gestite")
+    ap.add_argument("--debounce", type=float, default=0.5, help="SUMMARY_DEBOUNCE passato al bot")
+    ap.add_argument("--timeout", type=float, default=300)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--keep", action="store_true", help="non cancellare lo stato temporaneo")
+    ap.add_argument("--verbose", action="store_true", help="mostra l'output del bot")
+    sys.exit(RecoveryBench(ap.parse_args()).run())
+
+
+if __name__ == "__main__":
+    main()
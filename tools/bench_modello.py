@@ -0,0 +1,141 @@
+"""
+Confronta il modello tipizzato (model.py) con i dict annidati di una versione precedente:
+memoria dello stato in RAM e tempo dei percorsi caldi.
+
+1. Genera --groups data.json nel formato storico (con "games", "jornate_status", "giornate"),
+   ognuno con --players giocatori e --giornate giornate concluse.
+2. Li carica tutti (StateStore(path).data) misurando il tempo, poi di nuovo misurando la
+   memoria allocata (tracemalloc).
+3. Cronometra in memoria, senza l'I/O del journal, le giocate (evento bet_placed, come /gioca),
+   gli esiti (outcomes_applied, come applica_esiti_manuali) e il controllo dei totali
+   (verifica_aggregati).
+
+Usa solo API presenti in entrambe le versioni, così lo stesso script gira su un checkout
+precedente (--repo) e sull'albero corrente:
+
+    git worktree add /tmp/base <commit>
+    python tools/bench_modello.py --repo /tmp/base
+    python tools/bench_modello.py
+"""
+from __future__ import annotations
+import argparse, gc, json, os, random, shutil, sys, tempfile, time, tracemalloc
+from typing import Any, Dict, List
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def genera(folder: str, n_groups: int, n_players: int, n_giornate: int, seed: int) -> List[str]:
+    """data.json storici, uno per gruppo; ritorna i percorsi."""
+    rng = random.Random(seed)
+    paths = []
+    for gi in range(n_groups):
+        roster = {f"@u{gi}_{i}": f"P{i}" for i in range(n_players)}
+        players = {p: {"points": 0, "jolly_used": 0, "debt": 0} for p in roster.values()}
+        malloppo = {"giocate_sbagliate": 0, "penali_jolly": 0, "giocate_gruppo": 0}
+        bets: Dict[str, Any] = {}
+        for g in range(1, n_giornate + 1):
+            giornata: Dict[str, Any] = {
+                "assignments": {p: f"Casa{i}-Ospite{i}" for i, p in enumerate(roster.values())},
+                "leftover": [f"Casa{i}-Ospite{i}" for i in range(n_players, 10)],
+                "bets": {}, "status": "finished", "settled": True}
+            for u, p in roster.items():
+                esito = "persa" if rng.random() < 0.4 else "vinta"
+                giornata["bets"][u] = {"giocata": "1 + over 1.5", "quota": round(rng.uniform(1.3, 3), 2),
+                                       "jolly": False, "tipo_verifica": "mercato",
+                                       "dati_verifica": {"mercati": [["1", []], ["over", [1.5]]]},
+                                       "esito": esito}
+                if esito == "persa":
+                    players[p]["points"] += 1
+                    players[p]["debt"] += 5
+                    malloppo["giocate_sbagliate"] += 5
+            bets[str(g)] = giornata
+        # l'ultima giornata è ancora aperta alle giocate
+        bets[str(n_giornate + 1)] = {"assignments": {p: "A-B" for p in roster.values()}, "leftover": [],
+                                     "bets": {}, "status": "started", "settled": False}
+        data = {"players": players, "games": {}, "jornate_status": {"current": n_giornate + 1, "is_active": True},
+                "malloppo": malloppo, "giornate": {str(g): {} for g in range(1, n_giornate + 2)},
+                "bets": bets, "roster": roster, "admins": [next(iter(roster))]}
+        path = os.path.join(folder, str(gi), "data.json")
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        paths.append(path)
+    return paths
+
+
+def cronometra(fn, ripetizioni: int) -> float:
+    """Microsecondi per chiamata (migliore di 5 giri)."""
+    best = float("inf")
+    for _ in range(5):
+        t0 = time.perf_counter()
+        for _ in range(ripetizioni):
+            fn()
+        best = min(best, time.perf_counter() - t0)
+    return best / ripetizioni * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Memoria e percorsi caldi dello stato dei gruppi")
+    ap.add_argument("--repo", default=_REPO_DIR, help="checkout da misurare (default: questo)")
+    ap.add_argument("--groups", type=int, default=200)
+    ap.add_argument("--players", type=int, default=10)
+    ap.add_argument("--giornate", type=int, default=38)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    sys.path.insert(0, os.path.abspath(args.repo))
+
+    from events import apply_event
+    from game_utils import verifica_aggregati
+    from state_store import StateStore
+
+    folder = tempfile.mkdtemp(prefix="bench-modello-")
+    try:
+        paths = genera(folder, args.groups, args.players, args.giornate, args.seed)
+        t0 = time.perf_counter()
+        stores = [StateStore(p) for p in paths]
+        for s in stores:
+            s.data
+        t_load = time.perf_counter() - t0
+        del stores
+        gc.collect()
+        tracemalloc.start()
+        stores = [StateStore(p) for p in paths]
+        for s in stores:
+            s.data
+        gc.collect()
+        mem = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        g_open = str(args.giornate + 1)
+        data = stores[0].data
+        u, p = next(iter(data["roster"].items()))
+        bet = {"type": "bet_placed", "g": g_open, "username": u, "player": p, "giocata": "1 + over 1.5",
+               "quota": 1.2, "jolly": True, "jolly_used": 1, "tipo_verifica": "mercato",
+               "dati_verifica": {"mercati": [["1", []], ["over", [1.5]]]}}
+        us_bet = cronometra(lambda: apply_event(data, bet), 20000)
+
+        # esiti: ogni giro su un gruppo diverso, con giocate per tutti
+        for s in stores:
+            for uu, pp in s.data["roster"].items():
+                apply_event(s.data, dict(bet, username=uu, player=pp, jolly=False))
+        esiti = [(s.data, {"type": "outcomes_applied", "g": g_open, "roster": dict(s.data["roster"]),
+                           "losers": [uu for i, uu in enumerate(s.data["roster"]) if i % 3 == 0]})
+                 for s in stores]
+        giro = iter(range(10 ** 9))
+        us_esiti = cronometra(lambda: apply_event(*esiti[next(giro) % len(esiti)]), 2000)
+        us_verifica = cronometra(lambda: verifica_aggregati(data), 200)
+        for s in stores:
+            s.close()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"{args.repo}")
+    print(f"{args.groups} gruppi × {args.players} giocatori × {args.giornate} giornate")
+    print(f"caricamento: {t_load * 1000:.0f} ms, memoria {mem / 2 ** 20:.1f} MiB "
+          f"({mem / args.groups / 1024:.1f} KiB per gruppo)")
+    print(f"giocata (bet_placed): {us_bet:.2f} µs | esiti (outcomes_applied): {us_esiti:.2f} µs | "
+          f"verifica_aggregati: {us_verifica:.0f} µs")
+
+
+if __name__ == "__main__":
+    main()
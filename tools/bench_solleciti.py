@@ -0,0 +1,103 @@
+"""
+Misura i solleciti (/sollecita) quando molti gruppi li fanno partire nello stesso momento.
+
+La Bot API finta applica i limiti di Telegram (flood_limits: ~30 msg/s per bot, 20/min per
+gruppo, 1/s per chat privata, oltre risponde 429 con retry_after) e solo una parte dei
+giocatori ha avviato il bot in privato (gli altri ricevono 403 e vanno menzionati nel gruppo).
+
+1. Registra i gruppi ed estrae la giornata; ogni giocatore manda un comando (così il bot ne
+   conosce lo user_id).
+2. Tutti gli admin mandano insieme /sollecita privato.
+3. Aspetta che ogni giocatore abbia ricevuto il sollecito (in privato o menzionato nel gruppo)
+   e riporta durata, messaggi, 429 ricevuti e picco di messaggi al secondo.
+
+    python tools/bench_solleciti.py --groups 100 --players 10
+"""
+from __future__ import annotations
+import argparse, os, shutil, sys, time
+from typing import Dict, List, Set, Tuple
+
+_TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPO_DIR = os.path.dirname(_TOOLS_DIR)
+sys.path.insert(0, _TOOLS_DIR)
+sys.path.insert(0, _REPO_DIR)
+
+from loadgen import LoadGen  # noqa: E402
+
+
+class SollecitiBench(LoadGen):
+    def reminded(self, since: int) -> Tuple[Dict[int, Set[str]], List[float]]:
+        """chat_id -> username sollecitati, e istanti di invio dei solleciti (dalle chiamate dopo `since`)."""
+        by_user_id = {u["id"]: (g.chat["id"], f"@{u['username']}") for g in self.groups for u in g.users}
+        out: Dict[int, Set[str]] = {}
+        times = []
+        for t, method, params in self.api.calls[since:]:
+            if method != "sendMessage":
+                continue
+            text = str(params.get("text", ""))
+            chat_id = int(params["chat_id"])
+            if "Non hai ancora giocato" in text and chat_id in by_user_id:
+                group_id, username = by_user_id[chat_id]
+                out.setdefault(group_id, set()).add(username)
+            elif "devono ancora giocare" in text:
+                out.setdefault(chat_id, set()).update(w.strip(",") for w in text.split() if w.startswith("@"))
+            else:
+                continue
+            times.append(t)
+        return out, times
+
+    def run(self) -> int:
+        try:
+            self.start_bot()
+            self.setup()
+            warm = [self.send(g, u, "/jolly") for g in self.groups for u in g.users[1:]]
+            self.wait(warm, self.args.timeout)
+            started = {u["id"] for g in self.groups for u in g.users if u["id"] % 2 == 0}
+            self.api.private_started = started
+            self.api.flood_limits = True
+            since = len(self.api.calls)
+            t0 = time.monotonic()
+            cmds = [self.send(g, g.admin, "/sollecita privato") for g in self.groups]
+            self.wait(cmds, self.args.timeout)
+            t_ack = time.monotonic()
+            expected = {g.chat["id"]: {f"@{u['username']}" for u in g.users} for g in self.groups}
+            deadline = t0 + self.args.timeout
+            while time.monotonic() < deadline:
+                got, times = self.reminded(since)
+                if all(expected[c] <= got.get(c, set()) for c in expected):
+                    break
+                time.sleep(0.1)
+            t_done = time.monotonic()
+        finally:
+            self.stop_bot()
+            self.api.stop()
+
+        got, times = self.reminded(since)
+        missing = sum(len(expected[c] - got.get(c, set())) for c in expected)
+        peak = max((sum(1 for u in times if t <= u < t + 1) for t in times), default=0)
+        dm = sum(1 for _, m, p in self.api.calls[since:] if m == "sendMessage" and int(p["chat_id"]) > 0)
+        print(f"{len(self.groups)} gruppi × {self.args.players} giocatori: risposte a /sollecita in "
+              f"{(t_ack - t0) * 1000:.0f} ms, tutti sollecitati in {t_done - t0:.2f} s")
+        print(f"solleciti: {len(times)} messaggi ({dm} in privato), picco {peak} msg/s, "
+              f"429 ricevuti: {self.api.too_many_requests}, non sollecitati: {missing}")
+        if self.args.keep:
+            print(f"stato lasciato in {self.state_dir}")
+        else:
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+        return 1 if missing else 0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark dei solleciti con i limiti di Telegram")
+    ap.add_argument("--groups", type=int, default=100)
+    ap.add_argument("--players", type=int, default=10)
+    ap.add_argument("--debounce", type=float, default=0.5, help="SUMMARY_DEBOUNCE passato al bot")
+    ap.add_argument("--timeout", type=float, default=300)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--keep", action="store_true", help="non cancellare lo stato temporaneo")
+    ap.add_argument("--verbose", action="store_true", help="mostra l'output del bot")
+    sys.exit(SollecitiBench(ap.parse_args()).run())
+
+
+if __name__ == "__main__":
+    main()
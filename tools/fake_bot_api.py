@@ -0,0 +1,382 @@
+"""
+Server HTTP che imita la Bot API di Telegram, per provare e misurare il bot offline.
+
+Uso da riga di comando:
+    python tools/fake_bot_api.py --port 8081
+e poi avvia il bot con BOT_API_BASE_URL=http://127.0.0.1:8081 (BOT_TOKEN qualsiasi, es. 123:TEST).
+
+Da Python (vedi tools/loadgen.py): FakeBotApi().start(), poi push_message()/push_callback()
+per iniettare update; ogni chiamata del bot viene registrata in `calls` e la prima
+risposta a ciascun update (messaggio in risposta o answerCallbackQuery) in `responses`.
+
+Se il bot imposta un webhook (setWebhook) gli update gli vengono consegnati con POST come fa
+Telegram, su più connessioni in parallelo ma in ordine per chat: così si prova anche un pool
+di worker sulla stessa porta (WORKERS=N, vedi workers.py).
+"""
+from __future__ import annotations
+import argparse, itertools, json, threading, time, urllib.request
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Autoscommesse", "username": "autoscommesse_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+def _decode(value: str) -> Any:
+    # la Bot API accetta valori JSON (numeri, oggetti) anche dentro i form
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class ApiError(Exception):
+    """Errore restituito al bot come farebbe Telegram (es. 429 con retry_after, 403)."""
+
+    def __init__(self, code: int, description: str, retry_after: Optional[int] = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+
+class FakeBotApi:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, flood_limits: bool = False,
+                 webhook_connections: int = 8):
+        self.host = host
+        self.port = port
+        # con flood_limits risponde 429 come Telegram oltre ~30 msg/s per bot, 20/min per gruppo, 1/s in privato
+        self.flood_limits = flood_limits
+        self.too_many_requests = 0
+        self._sent_at: Dict[Any, Deque[float]] = {}             # chat_id (None = globale) -> istanti di invio
+        # user_id che hanno avviato il bot in privato (None = tutti): agli altri risponde 403
+        self.private_started: Optional[Set[int]] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._cond = threading.Condition()
+        self._updates: List[Dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._callback_ids = itertools.count(1)
+        self.webhook_url = ""
+        self.webhook_sets = 0
+        self.webhook_connections = webhook_connections          # consegne in parallelo, come max_connections
+        self._delivering: Set[Any] = set()                      # chat con una consegna in corso
+        self._deliverers: List[threading.Thread] = []
+        self._stopped = False
+        self.calls: List[Tuple[float, str, Dict[str, Any]]] = []
+        self.sent: Dict[Tuple[int, int], Dict[str, Any]] = {}   # (chat_id, message_id) -> messaggio
+        self.injected: Dict[int, float] = {}                    # update_id -> istante di invio
+        self.responses: Dict[int, float] = {}                   # update_id -> prima risposta del bot
+        self.replies: Dict[int, int] = {}                       # update_id -> message_id della risposta
+        self.polls = 0
+        self._by_message: Dict[Tuple[int, int], int] = {}       # messaggio dell'utente -> update_id
+        self._by_callback: Dict[str, int] = {}                  # callback_query_id -> update_id
+
+    # ---- ciclo di vita ----
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "FakeBotApi":
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._handle(b"")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self._handle(self.rfile.read(length))
+
+            def _handle(self, body: bytes):
+                parts = urlsplit(self.path)
+                segments = parts.path.strip("/").split("/")
+                if len(segments) != 2 or not segments[0].startswith("bot"):
+                    self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    return
+                params = dict(parse_qsl(parts.query))
+                params.update(api._parse_body(self.headers.get("Content-Type", ""), body))
+                params = {k: _decode(v) if isinstance(v, str) else v for k, v in params.items()}
+                try:
+                    result = api.handle(segments[1], params)
+                except KeyError as e:
+                    self._reply(400, {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"})
+                    return
+                except ApiError as e:
+                    payload = {"ok": False, "error_code": e.code, "description": e.description}
+                    if e.retry_after is not None:
+                        payload["parameters"] = {"retry_after": e.retry_after}
+                    self._reply(e.code, payload)
+                    return
+                self._reply(200, {"ok": True, "result": result})
+
+            def _reply(self, status: int, payload: Dict[str, Any]):
+                raw = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @staticmethod
+    def _parse_body(content_type: str, body: bytes) -> Dict[str, Any]:
+        if not body:
+            return {}
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+        if content_type.startswith("multipart/form-data"):
+            msg = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+            out: Dict[str, Any] = {}
+            for part in msg.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                payload = part.get_payload(decode=True) or b""
+                if part.get_filename():
+                    out[name] = {"filename": part.get_filename(), "size": len(payload)}
+                else:
+                    out[name] = payload.decode("utf-8")
+            return out
+        return dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+
+    # ---- update in ingresso ----
+    def _push(self, update: Dict[str, Any], queue: bool = True) -> int:
+        with self._cond:
+            update_id = next(self._update_ids)
+            update["update_id"] = update_id
+            self.injected[update_id] = time.monotonic()
+            if queue:
+                self._updates.append(update)
+                self._cond.notify_all()
+        return update_id
+
+    def message_update(self, chat: Dict[str, Any], user: Dict[str, Any], text: str,
+                       queue: bool = False) -> Dict[str, Any]:
+        """
+        Update con un messaggio di testo (i comandi ricevono l'entity bot_command).
+        Con queue=False non viene consegnato ma le risposte vengono comunque registrate:
+        serve per update che arrivano al bot per un'altra strada (es. l'inbox, vedi tools/bench_inbox.py).
+        """
+        message_id = next(self._message_ids)
+        message = {"message_id": message_id, "date": int(time.time()), "chat": chat, "from": user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        update = {"message": message}
+        with self._cond:
+            update_id = self._push(update, queue=queue)
+            self._by_message[(chat["id"], message_id)] = update_id
+        return update
+
+    def push_message(self, chat: Dict[str, Any], user: Dict[str, Any], text: str) -> int:
+        """Inietta un messaggio di testo."""
+        return self.message_update(chat, user, text, queue=True)["update_id"]
+
+    def push_callback(self, chat: Dict[str, Any], user: Dict[str, Any], message_id: int, data: str) -> int:
+        """Inietta la pressione di un bottone inline sul messaggio `message_id` del bot."""
+        cq_id = str(next(self._callback_ids))
+        original = self.sent.get((chat["id"], message_id), {"message_id": message_id, "date": int(time.time()),
+                                                            "chat": chat, "from": BOT_USER, "text": ""})
+        with self._cond:
+            update_id = self._push({"callback_query": {
+                "id": cq_id, "from": user, "chat_instance": str(chat["id"]), "data": data, "message": original
+            }})
+            self._by_callback[cq_id] = update_id
+        return update_id
+
+    # ---- metodi della Bot API ----
+    def _record_response(self, method: str, params: Dict[str, Any]) -> None:
+        if method == "answerCallbackQuery":
+            update_id = self._by_callback.get(str(params.get("callback_query_id")))
+        else:
+            update_id = self._reply_update(params)
+        if update_id is not None and update_id not in self.responses:
+            self.responses[update_id] = time.monotonic()
+
+    def _reply_update(self, params: Dict[str, Any]) -> Optional[int]:
+        reply_to = params.get("reply_to_message_id")
+        if reply_to is None and isinstance(params.get("reply_parameters"), dict):
+            reply_to = params["reply_parameters"].get("message_id")
+        return None if reply_to is None else self._by_message.get((params.get("chat_id"), reply_to))
+
+    def _message(self, params: Dict[str, Any], **extra) -> Dict[str, Any]:
+        chat_id = params["chat_id"]
+        msg = {"message_id": next(self._message_ids), "date": int(time.time()),
+               "chat": {"id": chat_id, "type": "group" if int(chat_id) < 0 else "private", "title": "test"},
+               "from": BOT_USER, **extra}
+        if "text" in params:
+            msg["text"] = params["text"]
+        if "reply_markup" in params:
+            msg["reply_markup"] = params["reply_markup"]
+        self.sent[(chat_id, msg["message_id"])] = msg
+        update_id = self._reply_update(params)
+        if update_id is not None:
+            self.replies.setdefault(update_id, msg["message_id"])
+        return msg
+
+    def _check_limits(self, chat_id: Any) -> None:
+        chat_id = int(chat_id)
+        if chat_id > 0 and self.private_started is not None and chat_id not in self.private_started:
+            raise ApiError(403, "Forbidden: bot can't initiate conversation with a user")
+        if not self.flood_limits:
+            return
+        now = time.monotonic()
+        limits = [(None, 1.0, 30), (chat_id, 1.0, 1) if chat_id > 0 else (chat_id, 60.0, 20)]
+        with self._cond:
+            for key, window, limit in limits:
+                times = self._sent_at.setdefault(key, deque())
+                while times and times[0] <= now - window:
+                    times.popleft()
+                if len(times) >= limit:
+                    self.too_many_requests += 1
+                    retry = max(1, int(times[0] + window - now + 0.999))
+                    raise ApiError(429, f"Too Many Requests: retry after {retry}", retry_after=retry)
+            for key, _, _ in limits:
+                self._sent_at[key].append(now)
+
+    def handle(self, method: str, params: Dict[str, Any]) -> Any:
+        if method != "getUpdates" and "chat_id" in params:
+            self._check_limits(params["chat_id"])
+        if method != "getUpdates":
+            with self._cond:
+                self.calls.append((time.monotonic(), method, params))
+                self._record_response(method, params)
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": len(self._updates)}
+        if method == "setWebhook":
+            with self._cond:
+                self.webhook_url = params["url"]
+                self.webhook_sets += 1
+                self._cond.notify_all()
+            while len(self._deliverers) < self.webhook_connections:
+                t = threading.Thread(target=self._deliver_loop, daemon=True)
+                self._deliverers.append(t)
+                t.start()
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = ""
+            if params.get("drop_pending_updates"):
+                with self._cond:
+                    self._updates.clear()
+            return True
+        if method == "sendMessage":
+            return self._message(params)
+        if method == "sendDocument":
+            doc = params.get("document") or {}
+            return self._message(params, document={"file_id": "fake", "file_unique_id": "fake",
+                                                   "file_name": doc.get("filename", "file"),
+                                                   "file_size": doc.get("size", 0)})
+        if method in ("editMessageText", "editMessageReplyMarkup"):
+            key = (params["chat_id"], params["message_id"])
+            msg = self.sent.get(key) or self._message(params)
+            if "text" in params:
+                msg["text"] = params["text"]
+            if "reply_markup" in params:
+                msg["reply_markup"] = params["reply_markup"]
+            msg["edit_date"] = int(time.time())
+            return msg
+        # pinChatMessage, unpinChatMessage, answerCallbackQuery, setMyCommands, ...
+        return True
+
+    def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._cond:
+            self.polls += 1
+            if offset:
+                # come Telegram: un offset conferma (e scarta) gli update precedenti
+                self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            return self._updates[:limit]
+
+    # ---- consegna via webhook ----
+    @staticmethod
+    def _update_chat(update: Dict[str, Any]) -> Any:
+        if "message" in update:
+            return update["message"]["chat"]["id"]
+        cq = update.get("callback_query", {})
+        return cq.get("message", {}).get("chat", {}).get("id", ("user", cq.get("from", {}).get("id")))
+
+    def _next_delivery(self) -> Optional[Dict[str, Any]]:
+        """Il primo update di una chat senza consegne in corso (None allo stop)."""
+        with self._cond:
+            while not self._stopped:
+                if self.webhook_url:
+                    for i, update in enumerate(self._updates):
+                        chat = self._update_chat(update)
+                        if chat not in self._delivering:
+                            self._delivering.add(chat)
+                            return self._updates.pop(i)
+                self._cond.wait(0.5)
+            return None
+
+    def _deliver_loop(self) -> None:
+        while True:
+            update = self._next_delivery()
+            if update is None:
+                return
+            req = urllib.request.Request(self.webhook_url, data=json.dumps(update).encode(),
+                                         headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(req, timeout=30) as resp:
+                    ok = 200 <= resp.status < 300
+            except OSError:
+                ok = False
+            with self._cond:
+                if not ok:
+                    # come Telegram: l'update resta in coda e si riprova
+                    self._updates.insert(0, update)
+                    self._updates.sort(key=lambda u: u["update_id"])
+                self._delivering.discard(self._update_chat(update))
+                self._cond.notify_all()
+            if not ok:
+                time.sleep(0.1)
+
+    def api_calls(self) -> int:
+        return len(self.calls)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Server finto della Bot API di Telegram")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    args = ap.parse_args()
+    api = FakeBotApi(args.host, args.port).start()
+    print(f"Fake Bot API in ascolto su {api.base_url} (BOT_API_BASE_URL={api.base_url})", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
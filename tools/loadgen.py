@@ -0,0 +1,255 @@
+"""
+Generatore di carico offline: avvia il server finto della Bot API, lancia bot.py contro di esso
+(BOT_API_BASE_URL) con uno stato temporaneo e simula molti gruppi e giocatori.
+
+Fasi per ogni gruppo: /registra dei giocatori, /estrai, poi un mix casuale di comandi
+(/gioca, /classifica, /soldi, /jolly, /malloppo, /giornate) e infine /inizio_giornata,
+/fine_giornata, /esiti con i toggle sui bottoni e la conferma.
+
+Alla fine riporta latenza p50/p99 (dall'invio dell'update alla prima risposta del bot),
+update al secondo e chiamate API per update, e controlla che nessuna /gioca sia andata persa.
+
+Con --workers N il bot gira come pool di N worker sulla stessa porta (WORKERS=N, webhook
+consegnato dalla Bot API finta) e con --kill-worker uno viene ucciso con SIGKILL a metà carico
+(il supervisore lo riavvia e riprende le sue chat).
+
+    python tools/loadgen.py --groups 20 --players 7 --updates 2000
+    python tools/loadgen.py --groups 20 --workers 4 --kill-worker
+"""
+from __future__ import annotations
+import argparse, os, random, shutil, signal, socket, sqlite3, subprocess, sys, tempfile, time
+from typing import Dict, List, Optional
+
+_TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPO_DIR = os.path.dirname(_TOOLS_DIR)
+sys.path.insert(0, _TOOLS_DIR)
+sys.path.insert(0, _REPO_DIR)
+
+from fake_bot_api import FakeBotApi  # noqa: E402
+
+# Mix "realistico": soprattutto giocate, poi consultazioni
+MIX = [("gioca", 0.55), ("classifica", 0.15), ("soldi", 0.08), ("jolly", 0.07),
+       ("malloppo", 0.07), ("giornate", 0.08)]
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+class Group:
+    def __init__(self, index: int, players: int):
+        self.chat = {"id": -1_000_000 - index, "type": "group", "title": f"Gruppo {index}"}
+        self.users = [{"id": 10_000 * (index + 1) + i, "is_bot": False, "first_name": f"G{i}",
+                       "username": f"g{index}_p{i}"} for i in range(players)]
+        self.admin = self.users[0]
+        self.played: Dict[str, str] = {}  # username -> ultima giocata inviata
+
+
+class LoadGen:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.api = FakeBotApi().start()
+        self.groups = [Group(i, args.players) for i in range(args.groups)]
+        self.state_dir = tempfile.mkdtemp(prefix="loadgen-")
+        self.proc: Optional[subprocess.Popen] = None
+
+    # ---- bot sotto test ----
+    def start_bot(self, stdout=None) -> None:
+        env = dict(os.environ)
+        env.pop("WEBHOOK_URL", None)
+        env.update({
+            "BOT_TOKEN": "123456:LOADGEN",
+            "BOT_API_BASE_URL": self.api.base_url,
+            "SHARDS_DIR": self.state_dir,
+            "SUMMARY_DEBOUNCE": str(self.args.debounce),
+            "PYTHONUNBUFFERED": "1",
+        })
+        if self.args.workers > 1:
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                port = s.getsockname()[1]
+            env.update({"WORKERS": str(self.args.workers), "PORT": str(port),
+                        "WEBHOOK_URL": f"http://127.0.0.1:{port}/"})
+        out = stdout or (None if self.args.verbose else subprocess.DEVNULL)
+        self.proc = subprocess.Popen([sys.executable, os.path.join(_REPO_DIR, "bot.py")],
+                                     cwd=_REPO_DIR, env=env, stdout=out, stderr=out)
+        deadline = time.monotonic() + 30
+        polls = self.api.polls
+        # in polling basta il primo getUpdates, con più worker il webhook impostato da tutti
+        while (self.api.polls == polls if self.args.workers <= 1
+               else self.api.webhook_sets < self.args.workers):
+            if self.proc.poll() is not None:
+                raise SystemExit(f"bot.py è uscito subito (codice {self.proc.returncode})")
+            if time.monotonic() > deadline:
+                raise SystemExit("bot.py non ha iniziato il polling entro 30s")
+            time.sleep(0.05)
+
+    def kill_worker(self) -> None:
+        """SIGKILL a un worker (il pid è nel database di coordinamento)."""
+        db = sqlite3.connect(os.path.join(self.state_dir, "workers.sqlite"))
+        try:
+            rows = db.execute("SELECT id, pid FROM workers ORDER BY id").fetchall()
+        finally:
+            db.close()
+        if rows:
+            worker_id, pid = self.rng.choice(rows)
+            print(f"💀 SIGKILL al worker {worker_id} (pid {pid})")
+            os.kill(pid, signal.SIGKILL)
+
+    def stop_bot(self) -> None:
+        if self.proc is None:
+            return
+        self.proc.send_signal(signal.SIGINT)
+        try:
+            self.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+    # ---- invio e attesa ----
+    def send(self, group: Group, user: dict, text: str) -> int:
+        return self.api.push_message(group.chat, user, text)
+
+    def wait(self, update_ids: List[int], timeout: float) -> int:
+        """Aspetta le risposte; ritorna quante sono rimaste senza risposta."""
+        deadline = time.monotonic() + timeout
+        pending = set(update_ids)
+        while pending and time.monotonic() < deadline:
+            pending = {u for u in pending if u not in self.api.responses}
+            time.sleep(0.01)
+        return len(pending)
+
+    def _random_command(self, group: Group) -> int:
+        user = self.rng.choice(group.users)
+        cmd = self.rng.choices([c for c, _ in MIX], weights=[w for _, w in MIX])[0]
+        if cmd == "gioca":
+            quota = self.rng.choice([1.35, 1.6, 1.75, 1.9, 2.1, 2.5])
+            giocata = self.rng.choice(["Over 2.5", "GG", "1X", "Under 3.5", "X2", "1 + Over 1.5"])
+            group.played[f"@{user['username']}"] = giocata
+            return self.send(group, user, f"/gioca {giocata} {quota}")
+        return self.send(group, user, f"/{cmd}")
+
+    # ---- fasi ----
+    def setup(self) -> None:
+        ids = []
+        for g in self.groups:
+            for i, u in enumerate(g.users):
+                ids.append(self.send(g, g.admin, f"/registra @{u['username']} P{i}"))
+                if i == 0:
+                    # il primo /registra rende admin chi lo manda: aspetto prima di continuare
+                    self.wait(ids[-1:], 10)
+        self.wait(ids, 30)
+        self.wait([self.send(g, g.admin, "/estrai") for g in self.groups], 30)
+
+    def load(self) -> List[int]:
+        ids = []
+        interval = 1 / self.args.rate if self.args.rate else 0
+        for i in range(self.args.updates):
+            if self.args.kill_worker and i == self.args.updates // 2:
+                self.kill_worker()
+            ids.append(self._random_command(self.rng.choice(self.groups)))
+            if interval:
+                time.sleep(interval)
+        unanswered = self.wait(ids, self.args.timeout)
+        if unanswered:
+            print(f"⚠️ {unanswered} update senza risposta entro {self.args.timeout}s")
+        return ids
+
+    def settle(self) -> List[int]:
+        ids = []
+        for step in ("/inizio_giornata", "/fine_giornata", "/esiti"):
+            step_ids = [self.send(g, g.admin, step) for g in self.groups]
+            self.wait(step_ids, 30)
+            ids += step_ids
+        esiti_ids = ids[-len(self.groups):]
+        toggles = []
+        for g, uid in zip(self.groups, esiti_ids):
+            message_id = self.api.replies.get(uid)
+            if message_id is None:
+                continue
+            for u in self.rng.sample(g.users, k=min(3, len(g.users))):
+                toggles.append(self.api.push_callback(g.chat, g.admin, message_id, f"esiti_toggle|@{u['username']}"))
+        self.wait(toggles, 30)
+        confirms = []
+        for g, uid in zip(self.groups, esiti_ids):
+            message_id = self.api.replies.get(uid)
+            if message_id is not None:
+                confirms.append(self.api.push_callback(g.chat, g.admin, message_id, "esiti_confirm"))
+        self.wait(confirms, 30)
+        return ids + toggles + confirms
+
+    # ---- verifica e report ----
+    def lost_bets(self) -> int:
+        backend = os.getenv("STORAGE_BACKEND", "json")
+        lost = 0
+        for g in self.groups:
+            folder = os.path.join(self.state_dir, str(g.chat["id"]))
+            if backend == "sqlite":
+                from sqlite_store import SqliteStore
+                store = SqliteStore(os.path.join(folder, "data.sqlite"))
+            else:
+                from state_store import StateStore
+                store = StateStore(os.path.join(folder, "data.json"))
+            bets = store.data["bets"]["1"].bets
+            for username, giocata in g.played.items():
+                bet = bets.get(username)
+                if bet is None or bet.giocata != giocata:
+                    lost += 1
+            store.close()
+        return lost
+
+    def report(self, label: str, ids: List[int], api_calls: int) -> None:
+        lat = [(self.api.responses[u] - self.api.injected[u]) * 1000 for u in ids if u in self.api.responses]
+        if not lat:
+            print(f"{label}: nessuna risposta")
+            return
+        start = min(self.api.injected[u] for u in ids)
+        end = max(self.api.responses[u] for u in ids if u in self.api.responses)
+        print(f"{label}: {len(ids)} update, {len(lat)} risposte | p50 {_percentile(lat, 50):.1f} ms, "
+              f"p99 {_percentile(lat, 99):.1f} ms, max {max(lat):.1f} ms | "
+              f"{len(lat) / max(end - start, 1e-9):.1f} update/s | {api_calls / len(ids):.2f} chiamate API/update")
+
+    def run(self) -> int:
+        try:
+            self.start_bot()
+            self.setup()
+            calls0 = self.api.api_calls()
+            load_ids = self.load()
+            calls1 = self.api.api_calls()
+            self.report("carico", load_ids, calls1 - calls0)
+            settle_ids = self.settle()
+            self.report("esiti", settle_ids, self.api.api_calls() - calls1)
+        finally:
+            self.stop_bot()
+            self.api.stop()
+        lost = self.lost_bets()
+        print(f"giocate perse: {lost}")
+        if not self.args.keep:
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+        else:
+            print(f"stato lasciato in {self.state_dir}")
+        return 1 if lost else 0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Generatore di carico per bot.py contro la Bot API finta")
+    ap.add_argument("--groups", type=int, default=10)
+    ap.add_argument("--players", type=int, default=7)
+    ap.add_argument("--updates", type=int, default=1000, help="update nella fase di carico")
+    ap.add_argument("--rate", type=float, default=0, help="update/s da iniettare (0 = tutti subito)")
+    ap.add_argument("--debounce", type=float, default=0.5, help="SUMMARY_DEBOUNCE passato al bot")
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--workers", type=int, default=1, help="worker del bot sulla stessa porta (webhook)")
+    ap.add_argument("--kill-worker", action="store_true", help="con --workers: uccide un worker a metà carico")
+    ap.add_argument("--keep", action="store_true", help="non cancellare lo stato temporaneo")
+    ap.add_argument("--verbose", action="store_true", help="mostra l'output del bot")
+    sys.exit(LoadGen(ap.parse_args()).run())
+
+
+if __name__ == "__main__":
+    main()
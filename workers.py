@@ -0,0 +1,411 @@
+"""
+Più processi del bot sullo stesso stato: repliche con WORKER_ID diversi, oppure WORKERS=N
+per un pool pre-fork sulla stessa porta del webhook (vedi supervisiona).
+
+Il coordinamento passa da un database SQLite in WAL condiviso (WORKERS_DB):
+- ogni worker rinnova un lease (heartbeat); chi non lo rinnova entro WORKER_LEASE secondi è morto;
+- ogni chat ha un solo proprietario alla volta, l'unico che ne tiene lo stato in memoria e lo
+  scrive. Un update arrivato a un altro worker viene girato al proprietario (tabella instradati,
+  scritta prima di confermare l'update a Telegram) invece di essere gestito; una chat senza
+  proprietario vivo la prende chi riceve il suo update;
+- un leader (con un suo lease) fa il lavoro globale della JobQueue: assegna ai worker vivi le
+  chat rimaste senza proprietario, così i loro calci d'inizio hanno chi li esegue, e ripassa
+  ai nuovi proprietari gli update girati a worker morti.
+Chi prende una chat ne butta l'eventuale copia in memoria e la rilegge da disco (snapshot +
+journal); chi scopre di aver perso il lease butta le sue senza salvarle.
+
+Il database si usa solo da due thread dedicati (run_in_executor), uno per le scritture e uno per
+le letture: mentre un altro processo tiene il lock di scrittura aspetta il primo, non l'event loop
+che serve gli update né le letture (in WAL non aspettano i lock).
+"""
+from __future__ import annotations
+import asyncio, json, os, signal, socket, sqlite3, subprocess, sys, threading, time, zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple, TypeVar
+
+from telegram import Update
+
+from chat_locks import chat_key
+
+# Identità del worker (stabile tra i riavvii: il suo inbox viene rigiocato e riprende le sue chat).
+# Se impostato il bot gira in modalità multi-worker.
+WORKER_ID = os.getenv("WORKER_ID")
+# Processi da avviare sulla stessa porta (WORKER_ID = <host>-0 .. <host>-N-1)
+WORKERS = int(os.getenv("WORKERS", "1"))
+# Secondi senza heartbeat dopo cui un worker è considerato morto e le sue chat passano ad altri
+WORKER_LEASE = float(os.getenv("WORKER_LEASE", "15"))
+WORKER_HEARTBEAT = float(os.getenv("WORKER_HEARTBEAT", str(WORKER_LEASE / 5)))
+# Ogni quanti secondi un worker guarda se gli sono stati girati update
+WORKER_POLL = float(os.getenv("WORKER_POLL", "0.05"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, scadenza REAL NOT NULL, pid INTEGER);
+CREATE TABLE IF NOT EXISTS owners (chat TEXT PRIMARY KEY, worker TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS leader (k INTEGER PRIMARY KEY CHECK (k = 0), worker TEXT NOT NULL, scadenza REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS instradati (id INTEGER PRIMARY KEY AUTOINCREMENT, worker TEXT NOT NULL,
+                                       chat TEXT NOT NULL, update_json TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS instradati_worker_chat ON instradati (worker, chat);
+"""
+
+
+T = TypeVar("T")
+
+
+def _testo(key: Hashable) -> str:
+    """Chiave di chat_locks.chat_key come testo: "<chat_id>" oppure "user:<user_id>"."""
+    return f"user:{key[1]}" if isinstance(key, tuple) else str(key)
+
+
+def _chiave(testo: str) -> Hashable:
+    return ("user", int(testo[5:])) if testo.startswith("user:") else int(testo)
+
+
+def _rendezvous(chat: str, vivi: List[str]) -> str:
+    """Worker scelto per la chat: stabile finché il worker resta vivo, e le chat si spartiscono alla pari."""
+    return max(vivi, key=lambda w: zlib.crc32(f"{chat}|{w}".encode()))
+
+
+class Coordinator:
+    """
+    Lease del worker, proprietà delle chat, update girati e leader, tutti nel database condiviso.
+    Le chat di cui il worker è proprietario stanno in `mie`, i proprietari vivi delle altre in
+    `altrui` (riletti a ogni heartbeat): finché il lease è valido il proprietario di una chat
+    si chiede al database solo se la chat non ne ha ancora uno.
+    `acquisita(chat_id)` e `persa(chat_id)` vengono chiamate (nell'event loop) quando una chat
+    entra o esce da `mie`, `heartbeat_fatto()` dopo ogni heartbeat.
+    """
+
+    def __init__(self, path: str, worker_id: str, lease: float = WORKER_LEASE,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.id = worker_id
+        self.lease = lease
+        self.clock = clock
+        self.mie: Set[str] = set()
+        self.altrui: Dict[str, str] = {}  # chat -> altro worker vivo che ne è proprietario
+        self.scadenza = 0.0       # fin quando vale il lease (ultimo heartbeat riuscito)
+        self.leader = False
+        self.vivi = 1             # worker vivi all'ultimo heartbeat
+        self.quota = 1.0          # parte delle chat di questo worker (per spartire i limiti globali del bot)
+        self._leader_da: Optional[float] = None
+        self._ultima_spartizione = 0.0
+        self._db: Dict[bool, sqlite3.Connection] = {}             # lettura? -> connessione
+        self._executors: Dict[bool, ThreadPoolExecutor] = {}     # lettura? -> il suo thread
+        self._db_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._accodato = 0        # ultimo update girato a questo worker già messo in coda
+        self.acquisita: Callable[[Hashable], None] = lambda key: None
+        self.persa: Callable[[Hashable], None] = lambda key: None
+        self.heartbeat_fatto: Callable[[], None] = lambda: None
+        self.stats: Dict[str, int] = {"instradati": 0, "ricevuti": 0, "acquisite": 0, "perse": 0,
+                                      "elezioni": 0, "assegnate": 0, "errori": 0}
+
+    # ---- database ----
+    async def _in_thread(self, fn: Callable[..., T], *args, lettura: bool = False) -> T:
+        """fn(*args) nel thread del database (quello delle letture con lettura=True)."""
+        executor = self._executors.get(lettura)
+        if executor is None:
+            nome = f"worker-{self.id}-" + ("lettura" if lettura else "db")
+            executor = self._executors[lettura] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=nome)
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    def _conn(self, lettura: bool = False) -> sqlite3.Connection:
+        db = self._db.get(lettura)
+        if db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            if not lettura:  # lo schema lo crea chi scrive (il primo heartbeat, prima di ogni lettura)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.executescript(_SCHEMA)
+            self._db[lettura] = db
+        return db
+
+    @contextmanager
+    def _tx(self):
+        with self._db_lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def close(self) -> None:
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+        self._executors.clear()
+        for db in self._db.values():
+            db.close()
+        self._db.clear()
+
+    # ---- lease e leader ----
+    def valido(self) -> bool:
+        return self.clock() < self.scadenza
+
+    def _heartbeat_db(self, now: float) -> Tuple[bool, Set[str], Dict[str, str], int, int]:
+        with self._tx() as db:
+            db.execute("INSERT INTO workers (id, scadenza, pid) VALUES (?, ?, ?) "
+                       "ON CONFLICT(id) DO UPDATE SET scadenza = excluded.scadenza, pid = excluded.pid",
+                       (self.id, now + self.lease, os.getpid()))
+            db.execute("INSERT INTO leader (k, worker, scadenza) VALUES (0, ?, ?) "
+                       "ON CONFLICT(k) DO UPDATE SET worker = excluded.worker, scadenza = excluded.scadenza "
+                       "WHERE leader.worker = excluded.worker OR leader.scadenza < ?",
+                       (self.id, now + self.lease, now))
+            leader = db.execute("SELECT worker FROM leader").fetchone()[0] == self.id
+            nel_db = {r[0] for r in db.execute("SELECT chat FROM owners WHERE worker = ?", (self.id,))}
+            altrui = dict(db.execute("SELECT o.chat, o.worker FROM owners o JOIN workers w ON w.id = o.worker "
+                                     "WHERE o.worker != ? AND w.scadenza > ?", (self.id, now)))
+            vivi = db.execute("SELECT COUNT(*) FROM workers WHERE scadenza > ?", (now,)).fetchone()[0]
+            totale = db.execute("SELECT COUNT(*) FROM owners").fetchone()[0]
+        return leader, nel_db, altrui, vivi, totale
+
+    async def heartbeat(self) -> None:
+        """Rinnova il lease, prova a diventare (o restare) leader e allinea `mie` e `altrui` al database."""
+        now = self.clock()
+        scaduto = self.scadenza and now >= self.scadenza
+        leader, nel_db, self.altrui, self.vivi, totale = await self._in_thread(self._heartbeat_db, now)
+        # +1 per worker: anche chi non ha ancora chat ha una parte, e le parti sommano a 1
+        self.quota = (len(nel_db) + 1) / (totale + max(self.vivi, 1))
+        self.scadenza = now + self.lease
+        if leader and not self.leader:
+            self.stats["elezioni"] += 1
+            self._leader_da = now
+            print(f"👑 Worker {self.id} è il leader", flush=True)
+        self.leader = leader
+        if scaduto:
+            # con il lease scaduto un altro worker può aver preso e scritto le nostre chat:
+            # le copie in memoria non valgono più, quelle ancora nostre si rileggono da disco
+            print(f"⚠️ Worker {self.id}: lease scaduto, rileggo le chat da disco", flush=True)
+            for chat in list(self.mie):
+                self._perdi(chat)
+        for chat in list(self.mie - nel_db):
+            self._perdi(chat)
+        for chat in nel_db - self.mie:
+            self._prendi(chat)
+        self.heartbeat_fatto()
+
+    def _prendi(self, chat: str) -> None:
+        self.mie.add(chat)
+        self.stats["acquisite"] += 1
+        self.acquisita(_chiave(chat))
+
+    def _perdi(self, chat: str) -> None:
+        self.mie.discard(chat)
+        self.stats["perse"] += 1
+        self.persa(_chiave(chat))
+
+    def _lascia_db(self) -> None:
+        with self._tx() as db:
+            db.execute("DELETE FROM owners WHERE worker = ?", (self.id,))
+            db.execute("DELETE FROM leader WHERE worker = ?", (self.id,))
+            db.execute("DELETE FROM workers WHERE id = ?", (self.id,))
+
+    async def lascia(self) -> None:
+        """Allo shutdown (dopo aver salvato lo stato): libera chat, leader e lease."""
+        await self._in_thread(self._lascia_db)
+        self.mie.clear()
+        self.altrui.clear()
+        self.leader = False
+        self.scadenza = 0.0
+
+    # ---- proprietà delle chat ----
+    def mia(self, key: Hashable) -> bool:
+        """True se il worker è proprietario della chat e può scriverne lo stato."""
+        return _testo(key) in self.mie and self.valido()
+
+    def _reclama(self, chat: str, now: float) -> str:
+        with self._tx() as db:
+            row = db.execute("SELECT o.worker, w.scadenza FROM owners o LEFT JOIN workers w ON w.id = o.worker "
+                             "WHERE o.chat = ?", (chat,)).fetchone()
+            if row is not None and row[0] != self.id and row[1] is not None and row[1] > now:
+                return row[0]
+            if row is None or row[0] != self.id:
+                db.execute("INSERT INTO owners (chat, worker) VALUES (?, ?) "
+                           "ON CONFLICT(chat) DO UPDATE SET worker = excluded.worker", (chat, self.id))
+        return self.id
+
+    async def proprietario(self, key: Hashable) -> str:
+        """
+        Worker proprietario della chat; se non ne ha uno vivo la chat diventa di questo worker.
+        Con il lease valido risponde dalla memoria (`mie`, `altrui`); il database solo per le chat nuove.
+        """
+        chat = _testo(key)
+        if not self.valido():
+            await self.heartbeat()
+        if chat in self.mie:
+            return self.id
+        if chat in self.altrui:
+            # può essere cambiato dall'ultimo heartbeat: il vecchio proprietario lo rigira (vedi bot.once_per_update)
+            return self.altrui[chat]
+        owner = await self._in_thread(self._reclama, chat, self.clock())
+        if owner != self.id:
+            self.altrui[chat] = owner
+        elif chat not in self.mie:
+            self._prendi(chat)
+        return owner
+
+    # ---- update girati ----
+    def _gira(self, owner: str, chat: str, update_json: str) -> None:
+        with self._tx() as db:
+            db.execute("INSERT INTO instradati (worker, chat, update_json) VALUES (?, ?, ?)",
+                       (owner, chat, update_json))
+
+    async def instrada(self, update: Update, in_ordine: bool = True) -> bool:
+        """
+        Gira l'update al proprietario della sua chat se non è questo worker. True se l'ha girato.
+        Con in_ordine, se alla chat di questo worker restano update girati ancora da accodare,
+        l'update si mette in fila dopo di loro (sempre in instradati): l'ordine della chat resta quello di arrivo.
+        """
+        key = chat_key(update)
+        if key is None:
+            return False
+        owner = await self.proprietario(key)
+        chat = _testo(key)
+        if owner == self.id and not (in_ordine and await self._in_thread(self._in_attesa, chat, lettura=True)):
+            return False
+        await self._in_thread(self._gira, owner, chat, json.dumps(update.to_dict(), ensure_ascii=False))
+        self.stats["instradati"] += 1
+        return True
+
+    def _in_attesa(self, chat: str) -> bool:
+        return self._conn(lettura=True).execute(
+            "SELECT 1 FROM instradati WHERE worker = ? AND chat = ? AND id > ? LIMIT 1",
+            (self.id, chat, self._accodato)).fetchone() is not None
+
+    def girati(self, limit: int = 100) -> List[Tuple[int, Dict[str, Any]]]:
+        """Update girati a questo worker, [(id, update)]; vanno confermati con conferma() dopo averli accodati."""
+        rows = self._conn(lettura=True).execute("SELECT id, update_json FROM instradati WHERE worker = ? "
+                                                "ORDER BY id LIMIT ?", (self.id, limit)).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def conferma(self, ids: List[int]) -> None:
+        if not ids:
+            return
+        with self._tx() as db:
+            db.executemany("DELETE FROM instradati WHERE id = ?", [(i,) for i in ids])
+        self.stats["ricevuti"] += len(ids)
+
+    # ---- lavoro del leader ----
+    def spartisci(self, chat_ids: List[Hashable]) -> int:
+        """
+        Dà un proprietario vivo (scelto con rendezvous hashing) alle chat senza, e ripassa ai nuovi
+        proprietari gli update girati a worker morti. Ritorna quante chat ha assegnato.
+        """
+        now = self.clock()
+        with self._tx() as db:
+            vivi = sorted(r[0] for r in db.execute("SELECT id FROM workers WHERE scadenza > ?", (now,)))
+            if not vivi:
+                return 0
+            db.execute("DELETE FROM owners WHERE worker NOT IN (SELECT id FROM workers WHERE scadenza > ?)", (now,))
+            possedute = {r[0] for r in db.execute("SELECT chat FROM owners")}
+            orfani = db.execute("SELECT id, chat FROM instradati WHERE worker NOT IN "
+                                "(SELECT id FROM workers WHERE scadenza > ?)", (now,)).fetchall()
+            libere = dict.fromkeys(c for c in map(_testo, chat_ids) if c not in possedute)
+            libere.update(dict.fromkeys(c for _, c in orfani if c not in possedute))
+            for chat in libere:
+                db.execute("INSERT INTO owners (chat, worker) VALUES (?, ?)", (chat, _rendezvous(chat, vivi)))
+            db.executemany("UPDATE instradati SET worker = (SELECT worker FROM owners WHERE chat = ?) WHERE id = ?",
+                           [(chat, row_id) for row_id, chat in orfani])
+        return len(libere)
+
+    # ---- ciclo in background ----
+    async def ciclo(self, queue: asyncio.Queue, bot: Any, chat_ids: Callable[[], Iterable[Hashable]],
+                    intervallo: float = WORKER_HEARTBEAT, poll: float = WORKER_POLL, limit: int = 100) -> None:
+        """
+        Heartbeat ogni `intervallo` secondi; il leader, passato un lease dall'elezione (il tempo di
+        far registrare gli altri worker), spartisce le chat ogni lease. Ogni `poll` secondi mette
+        nella coda degli update quelli girati a questo worker (fino a `limit` per giro, e senza
+        aspettare il giro dopo se ce ne sono altri).
+        """
+        prossimo = 0.0
+        while True:
+            girati: List[Tuple[int, Dict[str, Any]]] = []
+            try:
+                if time.monotonic() >= prossimo:
+                    await self.heartbeat()
+                    now = self.clock()
+                    if (self.leader and now - self._leader_da >= self.lease
+                            and now - self._ultima_spartizione >= self.lease):
+                        self._ultima_spartizione = now
+                        n = await self._in_thread(self.spartisci, list(chat_ids()))
+                        self.stats["assegnate"] += n
+                        if n:
+                            print(f"👑 Assegnate {n} chat senza proprietario", flush=True)
+                    prossimo = time.monotonic() + intervallo
+                # senza update girati il giro è una sola lettura, nel thread che non aspetta i lock
+                girati = await self._in_thread(self.girati, limit, lettura=True)
+                for row_id, data in girati:
+                    # dritto nell'inbox del worker: se intanto la chat è passata ad altri lo rigira l'handler
+                    await queue.put_girato(Update.de_json(data, bot))
+                    self._accodato = row_id
+                if girati:
+                    await self._in_thread(self.conferma, [row_id for row_id, _ in girati])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errori"] += 1
+                print(f"⚠️ Worker {self.id}: coordinamento fallito: {e}", flush=True)
+            if len(girati) < limit:
+                await asyncio.sleep(poll)
+
+    async def start(self, queue: asyncio.Queue, bot: Any, chat_ids: Callable[[], Iterable[Hashable]]) -> None:
+        """Primo heartbeat subito (le chat del worker prima di un riavvio tornano sue), poi il ciclo."""
+        await self.heartbeat()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.ciclo(queue, bot, chat_ids))
+
+    async def stop(self) -> None:
+        """Ferma il ciclo e lascia chat e lease: va chiamato dopo aver salvato gli shard."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.lascia()
+        self.close()
+
+
+def supervisiona(n: int, argv: List[str]) -> int:
+    """
+    Pool pre-fork: avvia n copie di `argv` con WORKER_ID <host>-<i>, che ascoltano sulla stessa
+    porta (SO_REUSEPORT), e riavvia quelle che muoiono con lo stesso WORKER_ID. SIGINT e SIGTERM
+    vengono girati ai worker; ritorna quando sono usciti tutti.
+    """
+    base = os.getenv("WORKER_PREFIX", socket.gethostname())
+    procs: Dict[int, subprocess.Popen] = {}
+    fermo = False
+
+    def avvia(i: int) -> None:
+        env = dict(os.environ, WORKER_ID=f"{base}-{i}")
+        # in un gruppo di processi suo: il Ctrl-C del terminale arriva solo tramite ferma()
+        procs[i] = subprocess.Popen([sys.executable] + argv, env=env, start_new_session=True)
+        print(f"👷 Worker {base}-{i} avviato (pid {procs[i].pid})", flush=True)
+
+    def ferma(signum, frame) -> None:
+        nonlocal fermo
+        fermo = True
+        for p in procs.values():
+            if p.poll() is None:
+                p.send_signal(signum)
+
+    signal.signal(signal.SIGINT, ferma)
+    signal.signal(signal.SIGTERM, ferma)
+    for i in range(n):
+        avvia(i)
+    while True:
+        vivi = [i for i, p in procs.items() if p.poll() is None]
+        if fermo and not vivi:
+            break
+        if not fermo:
+            for i, p in list(procs.items()):
+                if p.poll() is not None:
+                    print(f"⚠️ Worker {base}-{i} uscito (codice {p.returncode}), lo riavvio", flush=True)
+                    avvia(i)
+        time.sleep(0.5)
+    return max((p.returncode or 0 for p in procs.values()), default=0)